@@ -13,6 +13,7 @@ import Configs
 class CommandInjectionAgent(HMI):
     def __init__(self, name , period , destination):
         super().__init__(name, TAG.TAG_LIST, Controllers.PLCs, period)
+        self.set_dedicated_clients(True)
         self.destination= destination
 
     def _before_start(self):
@@ -69,19 +69,38 @@ class TAG:
 
 
 class Controllers:
+    # requests of addresses out of the whitelist are rate limited by the PLC servers, see AdmissionControl
+    ADMISSION = {
+        'rate': 100,
+        'burst': 20,
+        'max_concurrent': 16,
+        'whitelist': ['192.168.0.21', '192.168.0.22', '192.168.0.23'],
+    }
+    # requests served per function code and client, dumped every interval seconds to logs/server-metrics_<PLC>
+    METRICS = {
+        'interval': 10,
+        'format': 'csv',
+    }
+
     PLC_CONFIG = {
         SimulationConfig.EXECUTION_MODE_DOCKER: {
             1: {
                 'name': 'PLC1',
                 'ip': '192.168.0.11',
                 'port': 502,
-                'protocol': 'ModbusWriteRequest-TCP'
+                'protocol': 'ModbusWriteRequest-TCP',
+                'server_engine': 'eventloop',
+                'admission': ADMISSION,
+                'metrics': METRICS
              },
             2: {
                 'name': 'PLC2',
                 'ip': '192.168.0.12',
                 'port': 502,
-                'protocol': 'ModbusWriteRequest-TCP'
+                'protocol': 'ModbusWriteRequest-TCP',
+                'server_engine': 'eventloop',
+                'admission': ADMISSION,
+                'metrics': METRICS
              },
         },
         SimulationConfig.EXECUTION_MODE_GNS3: {
@@ -89,13 +108,19 @@ class Controllers:
                 'name': 'PLC1',
                 'ip': '192.168.0.11',
                 'port': 502,
-                'protocol': 'ModbusWriteRequest-TCP'
+                'protocol': 'ModbusWriteRequest-TCP',
+                'server_engine': 'eventloop',
+                'admission': ADMISSION,
+                'metrics': METRICS
             },
             2: {
                 'name': 'PLC2',
                 'ip': '192.168.0.12',
                 'port': 502,
-                'protocol': 'ModbusWriteRequest-TCP'
+                'protocol': 'ModbusWriteRequest-TCP',
+                'server_engine': 'eventloop',
+                'admission': ADMISSION,
+                'metrics': METRICS
             },
         },
         SimulationConfig.EXECUTION_MODE_LOCAL: {
@@ -103,13 +128,17 @@ class Controllers:
                 'name': 'PLC1',
                 'ip': '127.0.0.1',
                 'port': 5502,
-                'protocol': 'ModbusWriteRequest-TCP'
+                'protocol': 'ModbusWriteRequest-TCP',
+                'server_engine': 'eventloop',
+                'metrics': METRICS
              },
             2: {
                 'name': 'PLC2',
                 'ip': '127.0.0.1',
                 'port': 5503,
-                'protocol': 'ModbusWriteRequest-TCP'
+                'protocol': 'ModbusWriteRequest-TCP',
+                'server_engine': 'eventloop',
+                'metrics': METRICS
              },
         }
     }
@@ -122,6 +151,13 @@ class Connection:
         'type': 'sqlite',
         'path': 'storage/PhysicalSimulation1.sqlite',
         'name': 'fp_table',
+        'options': {'persistent': True},
+    }
+    SQLITE_COMPACT_CONNECTION = {
+        'type': 'sqlite',
+        'path': 'storage/PhysicalSimulation1.sqlite',
+        'name': 'fp_table',
+        'options': {'persistent': True, 'tags': TAG.TAG_LIST},
     }
     MEMCACHE_DOCKER_CONNECTION = {
         'type': 'memcache',
@@ -133,6 +169,12 @@ class Connection:
         'path': '127.0.0.1:11211',
         'name': 'fp_table',
     }
+    SHM_CONNECTION = {
+        'type': 'shm',
+        'path': 'storage/PhysicalSimulation1.shm',
+        'name': 'fp_table',
+        'options': {'tags': TAG.TAG_LIST},
+    }
     File_CONNECTION = {
         'type': 'file',
         'path': 'storage/sensors_actuators.json',
@@ -141,8 +183,8 @@ class Connection:
 
     CONNECTION_CONFIG = {
         SimulationConfig.EXECUTION_MODE_GNS3: MEMCACHE_DOCKER_CONNECTION,
-        SimulationConfig.EXECUTION_MODE_DOCKER: SQLITE_CONNECTION, #todo : return back to sqlite connection
-        SimulationConfig.EXECUTION_MODE_LOCAL: SQLITE_CONNECTION
+        SimulationConfig.EXECUTION_MODE_DOCKER: SQLITE_COMPACT_CONNECTION, #todo : return back to sqlite connection
+        SimulationConfig.EXECUTION_MODE_LOCAL: SQLITE_COMPACT_CONNECTION
     }
     CONNECTION = CONNECTION_CONFIG[SimulationConfig.EXECUTION_MODE]
 
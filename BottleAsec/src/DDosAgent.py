@@ -4,7 +4,8 @@ import os
 import random
 
 from time import sleep
-from ics_sim.Device import HMI, Runnable
+from ics_sim.Device import HMI, Runnable, LoopScheduler
+from ics_sim.runtime import CooperativeRuntime
 from Configs import TAG, Controllers
 
 
@@ -16,6 +17,11 @@ class DDosAgent(HMI):
         # initialize members
         self.__shared_logger = shared_logger
         super().__init__(name, TAG.TAG_LIST, Controllers.PLCs, 1)
+        # the agent floods, a scan longer than the cycle starts the next one right away
+        self.set_loop_schedule(overrun=LoopScheduler.OVERRUN_CATCH_UP)
+        # every agent floods over its own connection, as a separate attacker would
+        self.set_dedicated_clients(True)
+        self._start_delay = 5000
         self.__target_ip = target_ip
 
         # select target signal for attack based on input target_ip
@@ -29,7 +35,6 @@ class DDosAgent(HMI):
 
     def _before_start(self):
         self._set_clear_scr(False)
-        sleep(5)
         self.report(f'selected target = {self.__target}', level=logging.INFO)
 
     def _logic(self):
@@ -75,6 +80,9 @@ class DDosAgent(HMI):
         parser.add_argument('--timeout', metavar='timeout for attack', type=float, default=60,
                             help='interval to apply attack', required=False)
 
+        parser.add_argument('--runtime', action='store_true',
+                            help='run all agents in one cooperative runtime instead of a thread each')
+
         return parser.parse_args()
 
 
@@ -99,10 +107,15 @@ if __name__ == '__main__':
         attacker_list.append(
             DDosAgent(name=f'DDoS_Agent_{args.name_prefix}_{i}', target_ip=args.target, shared_logger=logger))
 
+    runtime = CooperativeRuntime() if args.runtime else None
     for attacker in attacker_list:
-        attacker.start()
+        attacker.start(runtime)
+    if runtime is not None:
+        runtime.start()
 
     sleep(args.timeout)
 
     for attacker in attacker_list:
         attacker.stop()
+    if runtime is not None:
+        runtime.stop()
@@ -5,19 +5,30 @@ from Configs import TAG, PHYSICS, Connection
 
 
 class FactorySimulation(HIL):
+    LOGIC_TAGS = [
+        TAG.TAG_TANK_LEVEL_VALUE,
+        TAG.TAG_TANK_INPUT_VALVE_STATUS,
+        TAG.TAG_TANK_OUTPUT_VALVE_STATUS,
+        TAG.TAG_TANK_OUTPUT_FLOW_VALUE,
+        TAG.TAG_BOTTLE_LEVEL_VALUE,
+        TAG.TAG_BOTTLE_DISTANCE_TO_FILLER_VALUE,
+        TAG.TAG_CONVEYOR_BELT_ENGINE_STATUS,
+    ]
+
     def __init__(self):
         super().__init__('Factory', Connection.CONNECTION, 100)
         self.init()
 
     def _logic(self):
         elapsed_time = self._current_loop_time - self._last_loop_time
+        values = self._get_many(self.LOGIC_TAGS)
 
         # update tank water level
-        tank_water_amount = self._get(TAG.TAG_TANK_LEVEL_VALUE) * PHYSICS.TANK_LEVEL_CAPACITY
-        if self._get(TAG.TAG_TANK_INPUT_VALVE_STATUS):
+        tank_water_amount = values[TAG.TAG_TANK_LEVEL_VALUE] * PHYSICS.TANK_LEVEL_CAPACITY
+        if values[TAG.TAG_TANK_INPUT_VALVE_STATUS]:
             tank_water_amount += PHYSICS.TANK_INPUT_FLOW_RATE * elapsed_time
 
-        if self._get(TAG.TAG_TANK_OUTPUT_VALVE_STATUS):
+        if values[TAG.TAG_TANK_OUTPUT_VALVE_STATUS]:
             tank_water_amount -= PHYSICS.TANK_OUTPUT_FLOW_RATE * elapsed_time
 
         tank_water_level = tank_water_amount / PHYSICS.TANK_LEVEL_CAPACITY
@@ -31,17 +42,17 @@ class FactorySimulation(HIL):
 
         # update tank water flow
         tank_water_flow = 0
-        if self._get(TAG.TAG_TANK_OUTPUT_VALVE_STATUS) and tank_water_amount > 0:
+        if values[TAG.TAG_TANK_OUTPUT_VALVE_STATUS] and tank_water_amount > 0:
             tank_water_flow = PHYSICS.TANK_OUTPUT_FLOW_RATE
 
         # update bottle water
-        if self._get(TAG.TAG_BOTTLE_DISTANCE_TO_FILLER_VALUE) > 1:
+        if values[TAG.TAG_BOTTLE_DISTANCE_TO_FILLER_VALUE] > 1:
             bottle_water_amount = 0
-            if self._get(TAG.TAG_TANK_OUTPUT_FLOW_VALUE):
+            if values[TAG.TAG_TANK_OUTPUT_FLOW_VALUE]:
                 self.report('water is wasting', logging.WARNING)
         else:
-            bottle_water_amount = self._get(TAG.TAG_BOTTLE_LEVEL_VALUE) * PHYSICS.BOTTLE_LEVEL_CAPACITY
-            bottle_water_amount += self._get(TAG.TAG_TANK_OUTPUT_FLOW_VALUE) * elapsed_time
+            bottle_water_amount = values[TAG.TAG_BOTTLE_LEVEL_VALUE] * PHYSICS.BOTTLE_LEVEL_CAPACITY
+            bottle_water_amount += values[TAG.TAG_TANK_OUTPUT_FLOW_VALUE] * elapsed_time
 
         bottle_water_level = bottle_water_amount / PHYSICS.BOTTLE_LEVEL_CAPACITY
 
@@ -50,16 +61,18 @@ class FactorySimulation(HIL):
             self.report('bottle water overflowed', logging.WARNING)
 
         # update bottle position
-        bottle_distance_to_filler = self._get(TAG.TAG_BOTTLE_DISTANCE_TO_FILLER_VALUE)
-        if self._get(TAG.TAG_CONVEYOR_BELT_ENGINE_STATUS):
+        bottle_distance_to_filler = values[TAG.TAG_BOTTLE_DISTANCE_TO_FILLER_VALUE]
+        if values[TAG.TAG_CONVEYOR_BELT_ENGINE_STATUS]:
             bottle_distance_to_filler -= elapsed_time * PHYSICS.CONVEYOR_BELT_SPEED
             bottle_distance_to_filler %= PHYSICS.BOTTLE_DISTANCE
 
         # update physical properties
-        self._set(TAG.TAG_TANK_LEVEL_VALUE, tank_water_level)
-        self._set(TAG.TAG_TANK_OUTPUT_FLOW_VALUE, tank_water_flow)
-        self._set(TAG.TAG_BOTTLE_LEVEL_VALUE, bottle_water_level)
-        self._set(TAG.TAG_BOTTLE_DISTANCE_TO_FILLER_VALUE, bottle_distance_to_filler)
+        self._set_many({
+            TAG.TAG_TANK_LEVEL_VALUE: tank_water_level,
+            TAG.TAG_TANK_OUTPUT_FLOW_VALUE: tank_water_flow,
+            TAG.TAG_BOTTLE_LEVEL_VALUE: bottle_water_level,
+            TAG.TAG_BOTTLE_DISTANCE_TO_FILLER_VALUE: bottle_distance_to_filler,
+        })
 
     def init(self):
         initial_list = []
@@ -31,6 +31,7 @@ class HMI1(HMI):
                 self._rows[tag_name] = {'tag': tag_name.center(self.title_length, ' '), 'msg1': '', 'msg2': ''}
 
         self._latency = 0
+        self._values = {}
 
     def _display(self):
 
@@ -40,7 +41,18 @@ class HMI1(HMI):
         self.__update_massages()
 
     def __update_massages(self):
-        self._latency = 0
+        timestamp = datetime.now()
+        # one batch per PLC, an unreachable PLC only blanks its own tags
+        self._values = {}
+        for plc_id in self.plcs:
+            plc_tags = [tag for tag in self.tags if self.tags[tag]['plc'] == plc_id]
+            if not plc_tags:
+                continue
+            try:
+                self._values.update(self._receive_many(plc_tags))
+            except Exception as e:
+                self.report(e.__str__(), logging.WARNING)
+        self._latency = (datetime.now() - timestamp).microseconds
 
         for row in self._rows:
             self._rows[row]['msg1'] = ''
@@ -66,16 +78,11 @@ class HMI1(HMI):
                 self._rows[row]['msg2'] = ''.center(self.msg1_length, ' ')
 
     def __get_formatted_value(self, tag):
-        timestamp = datetime.now()
         pos = tag.rfind('_')
         tag_name = tag[0:pos]
         tag_attribute = tag[pos + 1:]
 
-        try:
-            value = self._receive(tag)
-        except Exception as e:
-            self.report(e.__str__(), logging.WARNING)
-            value = 'NULL'
+        value = self._values.get(tag, 'NULL')
 
         if tag_attribute == 'mode':
             if value == 1:
@@ -107,10 +114,6 @@ class HMI1(HMI):
         else:
             value = self._make_text(str(value).center(self.msg2_length, " "), self.COLOR_CYAN)
 
-        elapsed = datetime.now() - timestamp
-
-        if elapsed.microseconds > self._latency:
-            self._latency = elapsed.microseconds
         return value
 
     def __show_table(self):
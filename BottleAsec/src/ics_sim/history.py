@@ -0,0 +1,230 @@
+import bisect
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+
+NAN = float('nan')
+
+
+class HistoryChunk:
+    """Read only view of a spilled chunk file.
+
+    Layout: header (magic, columns, rows, names length), the json list of column names padded to 8 bytes,
+    then float64 arrays: last value and last write time of every column before the chunk, the time column
+    and one column per tag. Values a row did not write are NaN.
+    """
+    HEADER = struct.Struct('<IIII')
+    MAGIC = 0x48495354
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, columns, rows, names_length = HistoryChunk.HEADER.unpack_from(self._map, 0)
+        if magic != HistoryChunk.MAGIC:
+            raise ValueError('%s is not a history chunk.' % path)
+
+        offset = HistoryChunk.HEADER.size
+        self.names = json.loads(bytes(self._map[offset:offset + names_length]))
+        self.index = {name: i for i, name in enumerate(self.names)}
+        offset += HistoryChunk._padded(names_length)
+
+        doubles = memoryview(self._map)[offset:].cast('d')
+        self.last_values = doubles[0:columns]
+        self.last_times = doubles[columns:2 * columns]
+        self.times = doubles[2 * columns:2 * columns + rows]
+        start = 2 * columns + rows
+        self.columns = [doubles[start + i * rows:start + (i + 1) * rows] for i in range(columns)]
+
+    @staticmethod
+    def _padded(length):
+        return (length + 7) // 8 * 8
+
+    @staticmethod
+    def write(path, names, last_values, last_times, times, columns):
+        """Write a chunk atomically, readers never see a partial file."""
+        names_data = json.dumps(names).encode()
+        padding = bytes(HistoryChunk._padded(len(names_data)) - len(names_data))
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HistoryChunk.HEADER.pack(HistoryChunk.MAGIC, len(names), len(times), len(names_data)))
+            f.write(names_data + padding)
+            for data in [last_values, last_times, times] + columns:
+                f.write(array('d', data).tobytes())
+        os.replace(temp_path, path)
+
+    def close(self):
+        # the column views must go before the map can be closed
+        self.last_values = self.last_times = self.times = None
+        self.columns = []
+        self._map.close()
+
+
+class HistoryBuffer:
+    """Preallocated in-memory rows of one writer, with the same columns interface as HistoryChunk."""
+    def __init__(self, names, capacity, last_values, last_times):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.capacity = capacity
+        self.count = 0
+        self.last_values = array('d', last_values)
+        self.last_times = array('d', last_times)
+        self._times = array('d', [NAN]) * capacity
+        self._columns = [array('d', [NAN]) * capacity for _ in self.names]
+
+    @property
+    def times(self):
+        return memoryview(self._times)[:self.count]
+
+    @property
+    def columns(self):
+        return [memoryview(column)[:self.count] for column in self._columns]
+
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, timestamp, values):
+        row = self.count
+        self._times[row] = timestamp
+        for column in self._columns:
+            column[row] = NAN
+        for tag, value in values.items():
+            self._columns[self.index[tag]][row] = value
+        self.count += 1
+
+
+class HistoryStore:
+    """Columnar time series of tag writes: a ring buffer of rows spilled to memory mapped chunk files.
+
+    Every record() appends a row stamped with time.monotonic(), holding the written tags and NaN for the
+    others. A full buffer is written to <directory>/<first time>-<pid>.chunk, so several processes may record
+    into the same directory. range() and at() search the chunks and the buffer of this process by time.
+    """
+    def __init__(self, directory, capacity=4096):
+        self._directory = directory
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._buffer = HistoryBuffer([], capacity, [], [])
+        self._chunks = {}
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def record(self, values, timestamp=None):
+        if not values:
+            return
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        values = {tag: float(value) for tag, value in values.items()}
+
+        with self._lock:
+            new_tags = [tag for tag in values if tag not in self._buffer.index]
+            if new_tags or self._buffer.full():
+                self._spill(self._buffer.names + new_tags)
+            self._buffer.append(timestamp, values)
+
+    def flush(self):
+        """Write the buffered rows to a chunk file."""
+        with self._lock:
+            self._spill(self._buffer.names)
+
+    def _spill(self, names):
+        buffer = self._buffer
+        if buffer.count:
+            path = os.path.join(self._directory, '{:020d}-{}.chunk'.format(
+                int(buffer.times[0] * 1e9), os.getpid()))
+            HistoryChunk.write(path, buffer.names, buffer.last_values, buffer.last_times,
+                               buffer.times, buffer.columns)
+
+        # the last write of every tag so far opens the next chunk, at() never needs to look further back
+        last_values = []
+        last_times = []
+        for name in names:
+            value, written = NAN, NAN
+            if name in buffer.index:
+                column = buffer.index[name]
+                value, written = buffer.last_values[column], buffer.last_times[column]
+                row = HistoryStore._last_row(buffer.columns[column], buffer.count)
+                if row is not None:
+                    value, written = buffer.columns[column][row], buffer.times[row]
+            last_values.append(value)
+            last_times.append(written)
+        self._buffer = HistoryBuffer(names, self._capacity, last_values, last_times)
+
+    @staticmethod
+    def _last_row(column, end):
+        for row in range(end - 1, -1, -1):
+            if not math.isnan(column[row]):
+                return row
+        return None
+
+    def _blocks(self):
+        """(writer pid, block) of every chunk in the directory by time, then the rows buffered by this process."""
+        names = sorted(name for name in os.listdir(self._directory) if name.endswith('.chunk'))
+        blocks = []
+        for name in names:
+            if name not in self._chunks:
+                self._chunks[name] = HistoryChunk(os.path.join(self._directory, name))
+            blocks.append((int(name[:-len('.chunk')].split('-')[1]), self._chunks[name]))
+        if self._buffer.count:
+            blocks.append((os.getpid(), self._buffer))
+        return blocks
+
+    def range(self, tag, t0, t1):
+        """Times and values written to tag with t0 <= time <= t1, in time order."""
+        samples = []
+        with self._lock:
+            for _, block in self._blocks():
+                if tag not in block.index or not len(block.times):
+                    continue
+                times = block.times
+                if times[0] > t1 or times[len(times) - 1] < t0:
+                    continue
+                column = block.columns[block.index[tag]]
+                for row in range(bisect.bisect_left(times, t0), bisect.bisect_right(times, t1)):
+                    if not math.isnan(column[row]):
+                        samples.append((times[row], column[row]))
+
+        samples.sort(key=lambda sample: sample[0])
+        return [sample[0] for sample in samples], [sample[1] for sample in samples]
+
+    def at(self, t):
+        """Value of every recorded tag at time t, the latest write at or before t of any writer."""
+        latest = {}
+        with self._lock:
+            # the last block of a writer starting at or before t holds, with its opening last writes, the
+            # writer's whole history up to t
+            writer_blocks = {}
+            for writer, block in self._blocks():
+                if block.times[0] <= t:
+                    writer_blocks[writer] = block
+
+            for block in writer_blocks.values():
+                times = block.times
+                end = bisect.bisect_right(times, t)
+                columns = block.columns
+                for tag, column in block.index.items():
+                    row = HistoryStore._last_row(columns[column], end)
+                    if row is not None:
+                        candidate = (times[row], columns[column][row])
+                    elif not math.isnan(block.last_times[column]) and block.last_times[column] <= t:
+                        candidate = (block.last_times[column], block.last_values[column])
+                    else:
+                        continue
+                    if tag not in latest or candidate[0] >= latest[tag][0]:
+                        latest[tag] = candidate
+
+        return {tag: value for tag, (_, value) in latest.items()}
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            for chunk in self._chunks.values():
+                chunk.close()
+            self._chunks = {}
@@ -0,0 +1,289 @@
+import csv
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+
+class LatencyHistogram:
+    """Log-linear latency histogram (HDR style) over integer nanoseconds.
+
+    Every power of two is split into 2 ** SUB_BUCKET_BITS buckets, so a recorded value is known within about
+    6% whatever its magnitude, with a few hundred counters at most.
+    """
+    SUB_BUCKET_BITS = 4
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def _index(value):
+        if value < 2 * LatencyHistogram.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - LatencyHistogram.SUB_BUCKET_BITS - 1
+        return shift * LatencyHistogram.SUB_BUCKETS + (value >> shift)
+
+    @staticmethod
+    def _lowest_value(index):
+        if index < 2 * LatencyHistogram.SUB_BUCKETS:
+            return index
+        shift = index // LatencyHistogram.SUB_BUCKETS - 1
+        return (index - shift * LatencyHistogram.SUB_BUCKETS) << shift
+
+    def record(self, value):
+        value = max(int(value), 0)
+        index = LatencyHistogram._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+
+        rank = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                # highest value equivalent to the bucket, never above what was really recorded
+                return min(LatencyHistogram._lowest_value(index + 1) - 1, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'min': self.min or 0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'max': self.max or 0,
+        }
+
+
+class PeriodicDump(ABC):
+    """Calls dump(path) of the subclass every interval seconds from a daemon thread."""
+
+    def __init__(self):
+        self._dump_thread = None
+        self._dump_stop = threading.Event()
+
+    @abstractmethod
+    def dump(self, path):
+        pass
+
+    def start_periodic_dump(self, interval, file_dir='./logs', name='metrics', file_ext='.csv'):
+        """Dump into <file_dir>/<name><file_ext> every interval seconds, once per instance."""
+        if self._dump_thread is not None:
+            return
+
+        if not os.path.exists(file_dir):
+            os.makedirs(file_dir)
+        path = os.path.join(file_dir, name) + file_ext
+
+        def dump_loop():
+            while not self._dump_stop.wait(interval):
+                self.dump(path)
+
+        self._dump_stop.clear()
+        self._dump_thread = threading.Thread(target=dump_loop, name='metrics-dump', daemon=True)
+        self._dump_thread.start()
+
+    def stop_periodic_dump(self):
+        if self._dump_thread is not None:
+            self._dump_stop.set()
+            self._dump_thread.join()
+            self._dump_thread = None
+
+
+class MetricsRegistry(PeriodicDump):
+    """Latency histograms and error counters keyed by (source, operation, tag), tag None for the aggregate."""
+    CSV_FIELDS = ['time', 'source', 'operation', 'tag', 'errors',
+                  'count', 'mean', 'min', 'p50', 'p90', 'p99', 'p999', 'max']
+
+    def __init__(self):
+        PeriodicDump.__init__(self)
+        self._histograms = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keys(source, operation, tag):
+        if tag is None:
+            return [(source, operation, None)]
+        return [(source, operation, None), (source, operation, tag)]
+
+    def record(self, source, operation, elapsed_ns, tag=None):
+        with self._lock:
+            for key in MetricsRegistry._keys(source, operation, tag):
+                if key not in self._histograms:
+                    self._histograms[key] = LatencyHistogram()
+                self._histograms[key].record(elapsed_ns)
+
+    def record_error(self, source, operation, tag=None):
+        with self._lock:
+            for key in MetricsRegistry._keys(source, operation, tag):
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            keys = set(self._histograms) | set(self._errors)
+            result = {}
+            for key in keys:
+                item = self._histograms[key].snapshot() if key in self._histograms else LatencyHistogram().snapshot()
+                item['errors'] = self._errors.get(key, 0)
+                result[key] = item
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._errors = {}
+
+    def dump(self, path):
+        """Append the current snapshot to a csv file, writing the header when the file is new."""
+        new_file = not os.path.isfile(path)
+        now = datetime.now()
+        with open(path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=MetricsRegistry.CSV_FIELDS)
+            if new_file:
+                writer.writeheader()
+            for (source, operation, tag), item in sorted(self.snapshot().items(), key=lambda x: str(x[0])):
+                writer.writerow(dict(item, time=now, source=source, operation=operation, tag=tag or ''))
+
+
+class ServerMetrics(PeriodicDump):
+    """Requests served by a server per (function code, client address): count, bytes in and out, error
+    responses and service time.
+
+    Every serving thread records into its own shard without locking, snapshot() merges the shards. It also
+    adds the aggregates per function code (client None) and per client (function code None).
+    """
+    CSV_FIELDS = ['time', 'function', 'client', 'requests', 'bytes_in', 'bytes_out', 'errors',
+                  'count', 'mean', 'min', 'p50', 'p90', 'p99', 'p999', 'max']
+
+    def __init__(self):
+        PeriodicDump.__init__(self)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def record(self, function, client, bytes_in, bytes_out, error, elapsed_ns):
+        shard = self._shard()
+        entry = shard.get((function, client))
+        if entry is None:
+            entry = shard[(function, client)] = [0, 0, 0, 0, LatencyHistogram()]
+        entry[0] += 1
+        entry[1] += bytes_in
+        entry[2] += bytes_out
+        entry[3] += 1 if error else 0
+        entry[4].record(elapsed_ns)
+
+    @staticmethod
+    def _merge(totals, key, entry):
+        if key not in totals:
+            totals[key] = [0, 0, 0, 0, LatencyHistogram()]
+        total = totals[key]
+        for i in range(4):
+            total[i] += entry[i]
+        # the owner thread may be recording meanwhile, its counts are copied before being iterated
+        histogram = LatencyHistogram()
+        histogram.counts = entry[4].counts.copy()
+        histogram.count, histogram.total = entry[4].count, entry[4].total
+        histogram.min, histogram.max = entry[4].min, entry[4].max
+        total[4].merge(histogram)
+
+    def snapshot(self):
+        with self._lock:
+            # shards of finished threads are folded once, thread per client servers would pile them up
+            for thread, shard in [item for item in self._shards if not item[0].is_alive()]:
+                for key, entry in shard.items():
+                    ServerMetrics._merge(self._retired, key, entry)
+            self._shards = [item for item in self._shards if item[0].is_alive()]
+
+            totals = {}
+            for key, entry in self._retired.items():
+                ServerMetrics._merge(totals, key, entry)
+            for thread, shard in self._shards:
+                for key, entry in shard.copy().items():
+                    ServerMetrics._merge(totals, key, entry)
+
+        result = {}
+        for (function, client), entry in totals.items():
+            for key in ((function, client), (function, None), (None, client)):
+                ServerMetrics._merge(result, key, entry)
+        return {key: dict(entry[4].snapshot(), requests=entry[0], bytes_in=entry[1], bytes_out=entry[2],
+                          errors=entry[3])
+                for key, entry in result.items()}
+
+    def dump(self, path):
+        """Append the current snapshot to a csv file, or to a json lines file when path ends with .json."""
+        now = datetime.now()
+        rows = [dict(item, time=str(now), function='' if function is None else function, client=client or '')
+                for (function, client), item in sorted(self.snapshot().items(), key=lambda x: str(x[0]))]
+        if path.endswith('.json'):
+            with open(path, 'a') as f:
+                f.write(json.dumps({'time': str(now), 'requests': rows}) + '\n')
+            return
+
+        new_file = not os.path.isfile(path)
+        with open(path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=ServerMetrics.CSV_FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerows(rows)
+
+
+class Timer:
+    """Context manager recording the elapsed time of its block into a registry."""
+    def __init__(self, registry, source, operation, tag=None):
+        self._registry = registry
+        self._source = source
+        self._operation = operation
+        self._tag = tag
+        self._start = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._registry.record(self._source, self._operation, time.perf_counter_ns() - self._start, self._tag)
+        if exc_type is not None:
+            self._registry.record_error(self._source, self._operation, self._tag)
+        return False
+
+
+CONNECTOR_METRICS = MetricsRegistry()
@@ -1,5 +1,28 @@
+import asyncio
+import errno
+import os
+import random
+import selectors
+import socket
+import struct
+import threading
+import time
+from array import array
+from contextlib import contextmanager, nullcontext
+
 from pyModbusTCP.client import ModbusClient
-from pyModbusTCP.server import ModbusServer, DataBank
+from pyModbusTCP.constants import EXP_SLAVE_DEVICE_BUSY
+from pyModbusTCP.server import ModbusServer, DataBank, DataHandler
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 class Client:
@@ -33,63 +56,259 @@ class Server:
 
 
 class ModbusBase:
-    def __init__(self, word_num=2, precision=4):
+    """Register codec of the tags of a PLC, every tag id owns word_num registers.
+
+    The 'scaled' encoding stores round(value * 10 ** precision) as an integer, two's complement with
+    ``signed``; 'float32' and 'float64' store the IEEE-754 value in 2 or 4 registers. ``word_order`` 'big'
+    puts the most significant register first, 'little' the least significant; the bytes of a register are
+    big-endian either way. tag_encodings {tag_id: (encoding, word_order)} overrides single tags, a tag may use
+    fewer registers than word_num but not more.
+
+    encode_many()/decode_many() convert whole sequences (or NumPy arrays, when NumPy is installed) in one
+    struct or NumPy pass; encode()/decode() are the one value case.
+    """
+    INTEGER_FORMATS = {1: 'h', 2: 'i', 4: 'q'}
+    ENCODINGS = {'scaled': None, 'float32': 'f', 'float64': 'd'}
+    WORD_ORDERS = {'big': '>', 'little': '<'}
+    MAX_READ_REGISTERS = 125
+    MAX_WRITE_REGISTERS = 123
+
+    def __init__(self, word_num=2, precision=4, signed=False, encoding='scaled', word_order='big',
+                 tag_encodings=None):
+        if encoding not in ModbusBase.ENCODINGS:
+            raise ValueError('%s is not a register encoding.' % encoding)
+        if word_order not in ModbusBase.WORD_ORDERS:
+            raise ValueError('%s is not a word order.' % word_order)
+        self._encoding = encoding
+        self._float_format = ModbusBase.ENCODINGS[encoding]
+        if self._float_format is not None:
+            word_num = struct.calcsize(self._float_format) // 2
+        self._byte_order = ModbusBase.WORD_ORDERS[word_order]
+
         self._precision = precision
         self._word_num = word_num
+        self._signed = signed
         self._precision_factor = pow(10, precision)
         self._base = pow(2, 16)
         self._max_int = pow(self._base, word_num)
+        if signed:
+            self._min_value, self._max_value = -self._max_int // 2, self._max_int // 2 - 1
+        else:
+            self._min_value, self._max_value = 0, self._max_int - 1
 
-    def decode(self, word_array):
+        integer_format = ModbusBase.INTEGER_FORMATS.get(word_num)
+        if integer_format is not None and not signed:
+            integer_format = integer_format.upper()
+        self._integer_format = integer_format
+        self._numpy_ready = integer_format is not None and self._float_format is None and word_order == 'big'
+        self._structs = {}
 
-        if len(word_array) != self._word_num:
+        self._tag_codecs = {}
+        for tag_id, (tag_encoding, tag_word_order) in (tag_encodings or {}).items():
+            codec = ModbusBase(encoding=tag_encoding, word_order=tag_word_order)
+            if codec._word_num > word_num:
+                raise ValueError('tag {} needs {} registers, its PLC has {} per tag.'.format(
+                    tag_id, codec._word_num, word_num))
+            self._tag_codecs[tag_id] = codec
+
+    def _struct(self, count, value_format, byte_order='>'):
+        key = (count, value_format, byte_order)
+        if key not in self._structs:
+            self._structs[key] = struct.Struct('{}{}{}'.format(byte_order, count, value_format))
+        return self._structs[key]
+
+    @staticmethod
+    def _swap_word_bytes(data):
+        # little-endian values with every register byte swapped are big-endian registers in little word order
+        words = array('H', data)
+        words.byteswap()
+        return words.tobytes()
+
+    def _integers(self, values):
+        integers = [round(value * self._precision_factor) for value in values]
+        if integers and (min(integers) < self._min_value or max(integers) > self._max_value):
+            raise ValueError('input number exceed max limit')
+        return integers
+
+    def encode_bytes(self, values):
+        """Register bytes of values, as they travel in a Modbus frame."""
+        if self._float_format is not None:
+            try:
+                data = self._struct(len(values), self._float_format, self._byte_order).pack(*values)
+            except (OverflowError, struct.error):
+                raise ValueError('input number exceed max limit')
+        else:
+            integers = self._integers(values)
+            if self._integer_format is not None:
+                data = self._struct(len(integers), self._integer_format, self._byte_order).pack(*integers)
+            else:
+                size = self._word_num * 2
+                byte_order = 'big' if self._byte_order == '>' else 'little'
+                data = b''.join(integer.to_bytes(size, byte_order, signed=self._signed) for integer in integers)
+
+        return data if self._byte_order == '>' else ModbusBase._swap_word_bytes(data)
+
+    def decode_bytes(self, data):
+        size = self._word_num * 2
+        if len(data) % size:
             raise ValueError('word array length is not correct')
+        if self._byte_order == '<':
+            data = ModbusBase._swap_word_bytes(data)
 
-        base_holder = 1
-        result = 0
+        count = len(data) // size
+        if self._float_format is not None:
+            return list(self._struct(count, self._float_format, self._byte_order).unpack(data))
+        if self._integer_format is not None:
+            integers = self._struct(count, self._integer_format, self._byte_order).unpack(data)
+        else:
+            byte_order = 'big' if self._byte_order == '>' else 'little'
+            integers = [int.from_bytes(data[i * size:(i + 1) * size], byte_order, signed=self._signed)
+                        for i in range(count)]
+        return [integer / self._precision_factor for integer in integers]
 
-        for word in word_array:
-            result *= base_holder
-            result += word
-            base_holder *= self._base
+    def encode_many(self, values):
+        """Flat register list of values, word_num registers each; a NumPy array gives a uint16 array."""
+        if numpy is not None and isinstance(values, numpy.ndarray) and self._numpy_ready:
+            integers = numpy.rint(values * self._precision_factor)
+            if integers.size and (integers.min() < self._min_value or integers.max() > self._max_value):
+                raise ValueError('input number exceed max limit')
+            return integers.astype(self._numpy_type()).view('>u2').astype(numpy.uint16)
 
-        return result / self._precision_factor
+        data = self.encode_bytes(values)
+        return list(self._struct(len(data) // 2, 'H').unpack(data))
 
-    def encode(self, number):
+    def decode_many(self, words):
+        """Values of a flat register sequence; a NumPy array gives a float64 array."""
+        if numpy is not None and isinstance(words, numpy.ndarray) and self._numpy_ready:
+            if len(words) % self._word_num:
+                raise ValueError('word array length is not correct')
+            integers = words.astype('>u2').view(self._numpy_type())
+            return integers / self._precision_factor
 
-        number = int(number * self._precision_factor)
+        return self.decode_bytes(self._struct(len(words), 'H').pack(*words))
 
-        if number > self._max_int:
-            raise ValueError('input number exceed max limit')
+    def _numpy_type(self):
+        return '>{}{}'.format('i' if self._signed else 'u', self._word_num * 2)
 
-        result = []
-        while number:
-            result.append(number % self._base)
-            number = int(number / self._base)
+    def decode(self, word_array):
+        if len(word_array) != self._word_num:
+            raise ValueError('word array length is not correct')
 
-        while len(result) < self._word_num:
-            result.append(0)
+        return self.decode_many(word_array)[0]
 
-        result.reverse()
-        return result
+    def encode(self, number):
+        return self.encode_many([number])
+
+    def encode_tag(self, tag_id, value):
+        """The word_num registers of a tag, zero padded when the tag encoding is shorter."""
+        codec = self._tag_codecs.get(tag_id)
+        if codec is None:
+            return self.encode(value)
+        return codec.encode(value) + [0] * (self._word_num - codec._word_num)
+
+    def decode_tag(self, tag_id, words):
+        codec = self._tag_codecs.get(tag_id)
+        if codec is None:
+            return self.decode(words)
+        if len(words) != self._word_num:
+            raise ValueError('word array length is not correct')
+        return codec.decode(words[:codec._word_num])
+
+    def decode_tags(self, first_id, words):
+        """Values of the consecutive tags from first_id held by a flat register sequence."""
+        if not self._tag_codecs:
+            return self.decode_many(words)
+        word_num = self._word_num
+        return [self.decode_tag(first_id + offset, words[offset * word_num:(offset + 1) * word_num])
+                for offset in range(len(words) // word_num)]
 
     def get_registers(self, index):
         return index * self._word_num
 
+    def plan_reads(self, tag_ids):
+        """Fewest (first id, id count) register ranges covering tag_ids within the Modbus read limit.
+
+        Gaps between ids are read along, one longer request is cheaper than another round trip.
+        """
+        max_ids = ModbusBase.MAX_READ_REGISTERS // self._word_num
+        ranges = []
+        for tag_id in sorted(set(tag_ids)):
+            if ranges and tag_id - ranges[-1][0] < max_ids:
+                ranges[-1][1] = tag_id - ranges[-1][0] + 1
+            else:
+                ranges.append([tag_id, 1])
+        return [(first_id, count) for first_id, count in ranges]
+
+    def plan_writes(self, tag_ids):
+        """Fewest (first id, id count) runs of adjacent tag_ids within the Modbus write limit.
+
+        Unlike reads, a write can not span a gap without overwriting the tags in it.
+        """
+        max_ids = ModbusBase.MAX_WRITE_REGISTERS // self._word_num
+        ranges = []
+        for tag_id in sorted(set(tag_ids)):
+            if ranges and tag_id == ranges[-1][0] + ranges[-1][1] and ranges[-1][1] < max_ids:
+                ranges[-1][1] += 1
+            else:
+                ranges.append([tag_id, 1])
+        return [(first_id, count) for first_id, count in ranges]
+
 
 class ClientModbus(Client, ModbusBase):
-    def __init__(self, ip, port):
-        ModbusBase.__init__(self)
+    def __init__(self, ip, port, encoding='scaled', word_order='big', tag_encodings=None):
+        ModbusBase.__init__(self, encoding=encoding, word_order=word_order, tag_encodings=tag_encodings)
         Client.__init__(self, ip, port)
         self.client = ModbusClient(host=self.ip, port=self.port)
 
     def receive(self, tag_id):
         self.open()
-        return self.decode(self.client.read_holding_registers(self.get_registers(tag_id), self._word_num))
+        words = self.client.read_holding_registers(self.get_registers(tag_id), self._word_num)
+        if words is None:
+            raise ConnectionError('reading tag {} from {}:{} failed ({})'.format(
+                tag_id, self.ip, self.port, self.client.last_error_as_txt))
+        return self.decode_tag(tag_id, words)
 
     def send(self, tag_id, value):
         self.open()
-        self.client.write_multiple_registers(self.get_registers(tag_id), self.encode(value))
+        self.client.write_multiple_registers(self.get_registers(tag_id), self.encode_tag(tag_id, value))
+
+    def send_many(self, values):
+        """Write {tag_id: value} with one request per run of adjacent ids.
+
+        Returns {tag_id: error message} of the tags that were not written, empty when all were.
+        """
+        failed = {}
+        words = {}
+        for tag_id, value in values.items():
+            try:
+                words[tag_id] = self.encode_tag(tag_id, value)
+            except ValueError as e:
+                failed[tag_id] = str(e)
+
+        self.open()
+        for first_id, count in self.plan_writes(words):
+            tag_ids = range(first_id, first_id + count)
+            registers = [word for tag_id in tag_ids for word in words[tag_id]]
+            if not self.client.write_multiple_registers(self.get_registers(first_id), registers):
+                for tag_id in tag_ids:
+                    failed[tag_id] = 'writing to {}:{} failed ({})'.format(
+                        self.ip, self.port, self.client.last_error_as_txt)
+        return failed
+
+    def receive_many(self, tag_ids):
+        """Values of tag_ids as a dict, read with the fewest register range requests."""
+        tag_ids = list(tag_ids)
+        self.open()
+
+        values = {}
+        for first_id, count in self.plan_reads(tag_ids):
+            words = self.client.read_holding_registers(self.get_registers(first_id), count * self._word_num)
+            if words is None:
+                raise ConnectionError('reading tags {}..{} from {}:{} failed ({})'.format(
+                    first_id, first_id + count - 1, self.ip, self.port, self.client.last_error_as_txt))
+            for offset, value in enumerate(self.decode_tags(first_id, words)):
+                values[first_id + offset] = value
+        return {tag_id: values[tag_id] for tag_id in tag_ids}
 
     def open(self):
         if not self.client.is_open:
@@ -100,11 +319,782 @@ class ClientModbus(Client, ModbusBase):
             self.client.close()
 
 
+class ModbusClientPool:
+    """Process wide pool of ClientModbus connections keyed by (ip, port).
+
+    client() checks a connection out of the endpoint, at most ``size`` are open at once. A connection idle
+    longer than health_interval seconds is probed with a one register read before it is handed out, one idle
+    longer than idle_timeout is closed. After a failed connect, or a request that lost its connection, the
+    endpoint is not tried again before an exponential backoff with jitter has passed and client() raises
+    ConnectionError right away, so a restarting PLC is not hit by a reconnect storm from every HMI and peer.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    class Endpoint:
+        def __init__(self, size, codec_options):
+            self.size = size
+            self.codec_options = codec_options
+            self.condition = threading.Condition()
+            self.idle = []
+            self.in_use = 0
+            self.failures = 0
+            self.retry_at = 0
+
+    def __init__(self, size=4, timeout=5.0, health_interval=5.0, idle_timeout=60.0, backoff_base=0.1,
+                 backoff_max=10.0):
+        self.size = size
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.idle_timeout = idle_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._next_reap = 0
+        self._counters = {'created': 0, 'reused': 0, 'closed': 0, 'reaped': 0, 'failures': 0, 'rejected': 0,
+                          'health_checks': 0, 'health_failures': 0, 'wait_timeouts': 0}
+
+    @staticmethod
+    def shared():
+        """The pool of this process, created on first use."""
+        with ModbusClientPool._shared_lock:
+            if ModbusClientPool._shared is None:
+                ModbusClientPool._shared = ModbusClientPool()
+            return ModbusClientPool._shared
+
+    @staticmethod
+    def _forget_shared():
+        # a forked child must not share the parent's sockets, it opens its own connections on first use
+        ModbusClientPool._shared = None
+        ModbusClientPool._shared_lock = threading.Lock()
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def _endpoint(self, ip, port, size, codec_options):
+        with self._lock:
+            endpoint = self._endpoints.get((ip, port))
+            if endpoint is None:
+                endpoint = self._endpoints[(ip, port)] = ModbusClientPool.Endpoint(self.size, codec_options)
+            elif codec_options != endpoint.codec_options:
+                raise ValueError('{}:{} is pooled with another register encoding.'.format(ip, port))
+            if size is not None and size > endpoint.size:
+                endpoint.size = size
+            return endpoint
+
+    @contextmanager
+    def client(self, ip, port, size=None, codec_options=None):
+        """Check out an open ClientModbus to ip:port, size raises the connection limit of the endpoint.
+
+        codec_options are the ClientModbus encoding arguments, every user of an endpoint must pass the same.
+        """
+        self.reap()
+        endpoint = self._endpoint(ip, port, size, codec_options or {})
+        client = self._checkout(ip, port, endpoint)
+        try:
+            yield client
+        finally:
+            self._checkin(endpoint, client)
+
+    def _checkout(self, ip, port, endpoint):
+        with endpoint.condition:
+            retry_in = endpoint.retry_at - time.monotonic()
+            if retry_in > 0:
+                self._count('rejected')
+                raise ConnectionError('{}:{} is unreachable, next attempt in {:.2f} s'.format(ip, port, retry_in))
+            if not endpoint.condition.wait_for(lambda: endpoint.idle or endpoint.in_use < endpoint.size,
+                                               self.timeout):
+                self._count('wait_timeouts')
+                raise ConnectionError('no free connection to {}:{}'.format(ip, port))
+            endpoint.in_use += 1
+            client, last_used = endpoint.idle.pop() if endpoint.idle else (None, None)
+
+        try:
+            if client is not None and time.monotonic() - last_used > self.health_interval:
+                self._count('health_checks')
+                client.client.read_holding_registers(0, 1)
+                # a Modbus exception is an answer too, only a dropped connection fails the check
+                if not client.client.is_open:
+                    self._count('health_failures')
+                    client = None
+
+            if client is None:
+                client = ClientModbus(ip, port, **endpoint.codec_options)
+                client.client.auto_open = False
+                client.client.timeout = self.timeout
+                if not client.client.open():
+                    raise ConnectionError('connecting to {}:{} failed ({})'.format(
+                        ip, port, client.client.last_error_as_txt))
+                self._count('created')
+            else:
+                self._count('reused')
+        except ConnectionError:
+            with endpoint.condition:
+                endpoint.in_use -= 1
+                self._failed(endpoint)
+                endpoint.condition.notify()
+            raise
+
+        with endpoint.condition:
+            endpoint.failures = 0
+        return client
+
+    def _checkin(self, endpoint, client):
+        with endpoint.condition:
+            endpoint.in_use -= 1
+            if client.client.is_open:
+                endpoint.idle.append((client, time.monotonic()))
+            else:
+                self._failed(endpoint)
+                self._count('closed')
+            endpoint.condition.notify()
+
+    def _failed(self, endpoint):
+        """Close the idle connections of the endpoint and back off, called with its condition held."""
+        self._count('failures')
+        endpoint.failures += 1
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (endpoint.failures - 1))
+        endpoint.retry_at = time.monotonic() + delay * random.uniform(0.5, 1)
+
+        for client, _ in endpoint.idle:
+            client.close()
+        self._count('closed', len(endpoint.idle))
+        endpoint.idle = []
+
+    def reap(self, force=False):
+        """Close the connections idle longer than idle_timeout, at most once per second unless forced."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now < self._next_reap:
+                return
+            self._next_reap = now + 1
+            endpoints = list(self._endpoints.values())
+
+        for endpoint in endpoints:
+            with endpoint.condition:
+                expired = [client for client, last_used in endpoint.idle if now - last_used > self.idle_timeout]
+                endpoint.idle = [item for item in endpoint.idle if now - item[1] <= self.idle_timeout]
+            for client in expired:
+                client.close()
+            if expired:
+                self._count('reaped', len(expired))
+
+    def stats(self):
+        """Pool counters and the state of every endpoint, keyed by 'ip:port'."""
+        with self._lock:
+            result = dict(self._counters)
+            endpoints = dict(self._endpoints)
+
+        now = time.monotonic()
+        result['endpoints'] = {}
+        for (ip, port), endpoint in endpoints.items():
+            with endpoint.condition:
+                result['endpoints']['{}:{}'.format(ip, port)] = {
+                    'idle': len(endpoint.idle), 'in_use': endpoint.in_use, 'size': endpoint.size,
+                    'failures': endpoint.failures, 'retry_in': max(endpoint.retry_at - now, 0)}
+        return result
+
+    def close(self):
+        with self._lock:
+            endpoints, self._endpoints = self._endpoints, {}
+        for endpoint in endpoints.values():
+            with endpoint.condition:
+                for client, _ in endpoint.idle:
+                    client.close()
+                endpoint.idle = []
+
+
+os.register_at_fork(after_in_child=ModbusClientPool._forget_shared)
+
+
+class AsyncClientModbus(Client, ModbusBase):
+    """asyncio Modbus TCP client pipelining requests on one connection.
+
+    Requests do not wait for each other: every frame gets its own MBAP transaction id and a reader task
+    matches the responses to the waiting coroutines, so many receive()/send() calls of one event loop share a
+    single connection. The client belongs to the event loop it is first used in.
+    """
+    MBAP = struct.Struct('>HHHB')
+    READ_HOLDING_REGISTERS = 3
+    WRITE_MULTIPLE_REGISTERS = 16
+
+    def __init__(self, ip, port, timeout=5.0, unit_id=1, encoding='scaled', word_order='big', tag_encodings=None):
+        ModbusBase.__init__(self, encoding=encoding, word_order=word_order, tag_encodings=tag_encodings)
+        Client.__init__(self, ip, port)
+        self.timeout = timeout
+        self.unit_id = unit_id
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._connecting = None
+        self._transaction_id = 0
+        self._pending = {}
+
+    @property
+    def is_open(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def open(self):
+        if self.is_open:
+            return
+        # concurrent first requests wait for the same connection attempt
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._connect())
+        try:
+            await asyncio.shield(self._connecting)
+        finally:
+            if self._connecting is not None and self._connecting.done():
+                self._connecting = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.ip, self.port), self.timeout)
+        self._reader_task = asyncio.ensure_future(self._read_responses(self._reader))
+
+    async def _read_responses(self, reader):
+        try:
+            while True:
+                header = await reader.readexactly(AsyncClientModbus.MBAP.size)
+                transaction_id, _, length, _ = AsyncClientModbus.MBAP.unpack(header)
+                if length < 2:
+                    # no function code, the stream can not be trusted any further
+                    raise ConnectionError('MBAP length {} is out of range'.format(length))
+                pdu = await reader.readexactly(length - 1)
+                future = self._pending.pop(transaction_id, None)
+                if future is not None and not future.done():
+                    future.set_result(pdu)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+            self._fail_pending(ConnectionError('connection to {}:{} lost ({})'.format(self.ip, self.port, e)))
+        except asyncio.CancelledError:
+            self._fail_pending(ConnectionError('connection to {}:{} closed'.format(self.ip, self.port)))
+            raise
+
+    def _fail_pending(self, exception):
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exception)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _request(self, pdu):
+        await self.open()
+        self._transaction_id = (self._transaction_id + 1) % 0x10000
+        transaction_id = self._transaction_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[transaction_id] = future
+
+        self._writer.write(AsyncClientModbus.MBAP.pack(transaction_id, 0, len(pdu) + 1, self.unit_id) + pdu)
+        try:
+            response = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(transaction_id, None)
+            raise ConnectionError('request to {}:{} timed out'.format(self.ip, self.port))
+
+        if response[0] & 0x80:
+            raise ConnectionError('{}:{} answered with exception code {}'.format(self.ip, self.port, response[1]))
+        return response
+
+    async def read_holding_registers(self, address, count):
+        pdu = struct.pack('>BHH', AsyncClientModbus.READ_HOLDING_REGISTERS, address, count)
+        response = await self._request(pdu)
+        return list(struct.unpack_from('>{}H'.format(response[1] // 2), response, 2))
+
+    async def write_multiple_registers(self, address, words):
+        pdu = struct.pack('>BHHB{}H'.format(len(words)), AsyncClientModbus.WRITE_MULTIPLE_REGISTERS,
+                          address, len(words), len(words) * 2, *words)
+        await self._request(pdu)
+
+    async def receive(self, tag_id):
+        words = await self.read_holding_registers(self.get_registers(tag_id), self._word_num)
+        return self.decode_tag(tag_id, words)
+
+    async def send(self, tag_id, value):
+        await self.write_multiple_registers(self.get_registers(tag_id), self.encode_tag(tag_id, value))
+
+    async def receive_many(self, tag_ids):
+        """Values of tag_ids as a dict, the register range reads of ClientModbus.receive_many run concurrently."""
+        tag_ids = list(tag_ids)
+        ranges = self.plan_reads(tag_ids)
+        results = await asyncio.gather(*[
+            self.read_holding_registers(self.get_registers(first_id), count * self._word_num)
+            for first_id, count in ranges])
+
+        values = {}
+        for (first_id, _), words in zip(ranges, results):
+            for offset, value in enumerate(self.decode_tags(first_id, words)):
+                values[first_id + offset] = value
+        return {tag_id: values[tag_id] for tag_id in tag_ids}
+
+    async def send_many(self, values):
+        """Concurrent version of ClientModbus.send_many, returning {tag_id: error message} of failed tags."""
+        failed = {}
+        words = {}
+        for tag_id, value in values.items():
+            try:
+                words[tag_id] = self.encode_tag(tag_id, value)
+            except ValueError as e:
+                failed[tag_id] = str(e)
+
+        ranges = self.plan_writes(words)
+        results = await asyncio.gather(*[
+            self.write_multiple_registers(self.get_registers(first_id),
+                                          [word for tag_id in range(first_id, first_id + count)
+                                           for word in words[tag_id]])
+            for first_id, count in ranges], return_exceptions=True)
+
+        for (first_id, count), result in zip(ranges, results):
+            if isinstance(result, Exception):
+                for tag_id in range(first_id, first_id + count):
+                    failed[tag_id] = str(result)
+        return failed
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class RegisterBank(DataBank):
+    """DataBank with only register spaces, preallocated as uint16 arrays (128 KiB each instead of list cells)."""
+    def __init__(self, h_regs_size=0x10000, i_regs_size=0x10000):
+        DataBank.__init__(self, coils_size=0, d_inputs_size=0, h_regs_size=h_regs_size, i_regs_size=i_regs_size)
+        self._h_regs = array('H', bytes(2 * self.h_regs_size))
+        self._i_regs = array('H', bytes(2 * self.i_regs_size))
+
+    def get_holding_registers(self, address, number=1, srv_info=None):
+        words = DataBank.get_holding_registers(self, address, number, srv_info)
+        return None if words is None else words.tolist()
+
+    def get_input_registers(self, address, number=1, srv_info=None):
+        words = DataBank.get_input_registers(self, address, number, srv_info)
+        return None if words is None else words.tolist()
+
+
+class EventLoopModbusServer(ModbusServer):
+    """ModbusServer serving every connection from one selectors loop instead of a thread per client.
+
+    Requests go through the ModbusServer engine, so data_bank, data_hdl and ext_engine behave the same. Each
+    connection buffers at most max_buffered_frames requests and max_output_bytes of responses, a client that
+    sends faster is simply not read until its backlog is served, and at most max_connections are accepted.
+    With an AdmissionControl, a connection it does not admit (see AdmissionControl.connect()) is closed at once.
+    A connection gets frames_per_turn requests served per loop turn, the rest waits in its queue. A frame whose
+    MBAP length is out of range closes its connection.
+
+    max_connections is kept FD_HEADROOM below the open file limit of the process; should accept() still run
+    out of descriptors, the listener leaves the selector for ACCEPT_PAUSE seconds instead of ending the loop.
+    """
+    MAX_FRAME = 7 + 253
+    FD_HEADROOM = 32
+    ACCEPT_PAUSE = 0.1
+
+    class Connection:
+        def __init__(self, sock, address):
+            self.sock = sock
+            self.address = address
+            self.inbox = bytearray()
+            self.outbox = bytearray()
+            self.frames = 0
+            self.events = 0
+
+    def __init__(self, host='localhost', port=502, no_block=False, ipv6=False, data_bank=None, data_hdl=None,
+                 ext_engine=None, device_id=None, max_connections=4096, max_buffered_frames=16,
+                 max_output_bytes=64 * 1024, frames_per_turn=4, admission=None):
+        if data_bank is None and data_hdl is None:
+            data_bank = RegisterBank()
+        ModbusServer.__init__(self, host, port, no_block, ipv6, data_bank, data_hdl, ext_engine, device_id)
+        self.max_connections = EventLoopModbusServer._descriptor_limit(max_connections)
+        self.max_buffered_frames = max_buffered_frames
+        self.max_output_bytes = max_output_bytes
+        self.frames_per_turn = frames_per_turn
+        self.admission = admission
+
+        self._selector = None
+        self._listener = None
+        self._connections = {}
+        self._stats_lock = threading.Lock()
+        self._counters = {'accepted': 0, 'rejected': 0, 'closed': 0, 'requests': 0, 'max_queue_depth': 0}
+        self._queue_depth = 0
+        self._accept_second = 0
+        self._accepts_this_second = 0
+        self._accept_rate = 0
+        self._accept_paused_until = None
+
+    @staticmethod
+    def _descriptor_limit(max_connections):
+        if resource is None:
+            return max_connections
+        soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if soft == resource.RLIM_INFINITY:
+            return max_connections
+        return max(1, min(max_connections, soft - EventLoopModbusServer.FD_HEADROOM))
+
+    def start(self):
+        if self.is_run:
+            return
+
+        family = socket.AF_INET6 if self.ipv6 else socket.AF_INET
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self._listener.bind((self.host, self.port))
+            self._listener.listen(1024)
+        except OSError as e:
+            self._listener.close()
+            raise ModbusServer.NetworkError(e)
+        self._listener.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._accept_paused_until = None
+        self._evt_running.set()
+        if self.no_block:
+            self._serve_th = threading.Thread(target=self._serve, name='modbus-server', daemon=True)
+            self._serve_th.start()
+        else:
+            self._serve()
+
+    def stop(self):
+        if self.is_run:
+            self._evt_running.clear()
+            if self._serve_th is not None and self._serve_th is not threading.current_thread():
+                self._serve_th.join()
+
+    def stats(self):
+        """Connection and request counters; accept_rate is the accepts of the last full second."""
+        with self._stats_lock:
+            result = dict(self._counters)
+            result['connections'] = len(self._connections)
+            result['queue_depth'] = self._queue_depth
+            result['accept_rate'] = self._accept_rate if self._accept_second >= int(time.monotonic()) - 1 else 0
+            return result
+
+    def _serve(self):
+        try:
+            while self.is_run:
+                if self._accept_paused_until is not None and time.monotonic() >= self._accept_paused_until:
+                    self._accept_paused_until = None
+                    self._selector.register(self._listener, selectors.EVENT_READ)
+
+                # connections with queued requests must not wait for new network events
+                backlog = any(connection.frames for connection in self._connections.values())
+                for key, mask in self._selector.select(0 if backlog else 0.2):
+                    if key.fileobj is self._listener:
+                        self._accept()
+                    elif mask & selectors.EVENT_WRITE:
+                        self._send(key.data)
+                    elif mask & selectors.EVENT_READ:
+                        self._receive(key.data)
+
+                queue_depth = 0
+                for connection in list(self._connections.values()):
+                    if connection.frames:
+                        self._process(connection)
+                    queue_depth += connection.frames
+                with self._stats_lock:
+                    self._queue_depth = queue_depth
+                    self._counters['max_queue_depth'] = max(self._counters['max_queue_depth'], queue_depth)
+        finally:
+            for connection in list(self._connections.values()):
+                self._close(connection)
+            self._selector.close()
+            self._listener.close()
+            self._evt_running.clear()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self._listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                with self._stats_lock:
+                    self._counters['rejected'] += 1
+                if e.errno in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+                    # the pending connections stay in the backlog until descriptors are released
+                    self._selector.unregister(self._listener)
+                    self._accept_paused_until = time.monotonic() + EventLoopModbusServer.ACCEPT_PAUSE
+                    return
+                continue
+
+            now = int(time.monotonic())
+            with self._stats_lock:
+                if now != self._accept_second:
+                    self._accept_rate = self._accepts_this_second if now == self._accept_second + 1 else 0
+                    self._accept_second = now
+                    self._accepts_this_second = 0
+                self._accepts_this_second += 1
+
+                if len(self._connections) >= self.max_connections or \
+                        (self.admission is not None and not self.admission.connect(address[0])):
+                    self._counters['rejected'] += 1
+                    sock.close()
+                    continue
+                self._counters['accepted'] += 1
+
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = EventLoopModbusServer.Connection(sock, address)
+            self._connections[sock.fileno()] = connection
+            connection.events = selectors.EVENT_READ
+            self._selector.register(sock, connection.events, connection)
+
+    def _receive(self, connection):
+        room = self.max_buffered_frames * EventLoopModbusServer.MAX_FRAME - len(connection.inbox)
+        try:
+            data = connection.sock.recv(max(room, 0))
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(connection)
+            return
+
+        connection.inbox += data
+        connection.frames = self._count_frames(connection)
+        if connection.frames is None:
+            self._close(connection)
+            return
+        self._update_interest(connection)
+
+    def _count_frames(self, connection):
+        """Complete frames at the head of the inbox, None when a length field is out of range."""
+        count, offset, inbox = 0, 0, connection.inbox
+        while len(inbox) - offset >= 7:
+            length = struct.unpack_from('>H', inbox, offset + 4)[0]
+            # unit id and function code at least, never a frame that could not fit the inbox
+            if length < 2 or 6 + length > EventLoopModbusServer.MAX_FRAME:
+                return None
+            if len(inbox) - offset < 6 + length:
+                break
+            count += 1
+            offset += 6 + length
+        return count
+
+    def _process(self, connection):
+        for _ in range(min(connection.frames, self.frames_per_turn)):
+            length = struct.unpack_from('>H', connection.inbox, 4)[0]
+            frame = bytes(connection.inbox[:6 + length])
+            del connection.inbox[:6 + length]
+            connection.frames -= 1
+
+            session_data = ModbusServer.SessionData()
+            session_data.client.address, session_data.client.port = connection.address[:2]
+            try:
+                session_data.request.mbap.raw = frame[:7]
+                session_data.request.pdu.raw = frame[7:]
+                session_data.set_response_mbap()
+                self._engine(session_data)
+                connection.outbox += session_data.response.raw
+            except ModbusServer.Error:
+                self._close(connection)
+                return
+
+            with self._stats_lock:
+                self._counters['requests'] += 1
+
+        self._send(connection)
+
+    def _send(self, connection):
+        if connection.outbox:
+            try:
+                sent = connection.sock.send(connection.outbox)
+                del connection.outbox[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self._close(connection)
+                return
+        self._update_interest(connection)
+
+    def _update_interest(self, connection):
+        if connection.sock.fileno() not in self._connections:
+            return
+        events = 0
+        inbox_full = len(connection.inbox) >= self.max_buffered_frames * EventLoopModbusServer.MAX_FRAME
+        if not inbox_full and len(connection.outbox) < self.max_output_bytes:
+            events |= selectors.EVENT_READ
+        if connection.outbox:
+            events |= selectors.EVENT_WRITE
+        if events == connection.events:
+            return
+
+        # nothing to read or write until the queued requests are served: the socket leaves the selector
+        if not events:
+            self._selector.unregister(connection.sock)
+        elif not connection.events:
+            self._selector.register(connection.sock, events, connection)
+        else:
+            self._selector.modify(connection.sock, events, connection)
+        connection.events = events
+
+    def _close(self, connection):
+        if self._connections.pop(connection.sock.fileno(), None) is None:
+            return
+        if connection.events:
+            self._selector.unregister(connection.sock)
+        connection.sock.close()
+        if self.admission is not None:
+            self.admission.disconnect(connection.address[0])
+        with self._stats_lock:
+            self._counters['closed'] += 1
+
+
+class AdmissionControl:
+    """Admission of server requests by client address.
+
+    Every client has a token bucket of ``burst`` requests refilled at ``rate`` requests per second, and at
+    most ``max_concurrent`` requests are served at once; None disables a limit. Whitelisted addresses (HMIs
+    and peer PLCs) bypass both, so a flood can not lock them out. Counters are kept per client address, for
+    at most MAX_CLIENTS addresses.
+
+    EventLoopModbusServer serves one request at a time, so there ``max_concurrent`` caps the connections
+    each client keeps open instead, through connect() and disconnect(); a refused connection counts as busy.
+    """
+    MAX_CLIENTS = 4096
+
+    def __init__(self, rate=None, burst=None, max_concurrent=None, whitelist=()):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.max_concurrent = max_concurrent
+        self.whitelist = set(whitelist)
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._in_flight = 0
+        self._connections = {}
+
+    def _client(self, address, now):
+        client = self._clients.get(address)
+        if client is None:
+            if len(self._clients) >= AdmissionControl.MAX_CLIENTS:
+                # forget the oldest address, a flood from changing addresses must not grow the table
+                del self._clients[next(iter(self._clients))]
+            client = self._clients[address] = {'admitted': 0, 'rate_limited': 0, 'busy': 0,
+                                               'tokens': self.burst, 'refilled': now}
+        return client
+
+    def admit(self, address):
+        """True when a request of address may be served, release() must follow it."""
+        now = time.monotonic()
+        with self._lock:
+            client = self._client(address, now)
+            if address not in self.whitelist:
+                if self.max_concurrent is not None and self._in_flight >= self.max_concurrent:
+                    client['busy'] += 1
+                    return False
+                if self.rate is not None:
+                    tokens = min(self.burst, client['tokens'] + (now - client['refilled']) * self.rate)
+                    client['refilled'] = now
+                    if tokens < 1:
+                        client['tokens'] = tokens
+                        client['rate_limited'] += 1
+                        return False
+                    client['tokens'] = tokens - 1
+
+            client['admitted'] += 1
+            self._in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def connect(self, address):
+        """True when address may open one more connection, disconnect() must follow it."""
+        with self._lock:
+            connections = self._connections.get(address, 0)
+            if address not in self.whitelist and self.max_concurrent is not None and \
+                    connections >= self.max_concurrent:
+                self._client(address, time.monotonic())['busy'] += 1
+                return False
+            self._connections[address] = connections + 1
+            return True
+
+    def disconnect(self, address):
+        with self._lock:
+            connections = self._connections.pop(address, 0) - 1
+            if connections > 0:
+                self._connections[address] = connections
+
+    def stats(self):
+        """Requests admitted and rejected per client address."""
+        with self._lock:
+            return {address: {'admitted': client['admitted'], 'rate_limited': client['rate_limited'],
+                              'busy': client['busy']}
+                    for address, client in self._clients.items()}
+
+
+class ServerDataHandler(DataHandler):
+    """DataHandler of ServerModbus, reports the holding registers written by clients."""
+    def __init__(self, data_bank, on_write):
+        DataHandler.__init__(self, data_bank)
+        self._on_write = on_write
+
+    def write_h_regs(self, address, words_l, srv_info):
+        result = DataHandler.write_h_regs(self, address, words_l, srv_info)
+        if result.ok:
+            self._on_write(address, len(words_l))
+        return result
+
+
 class ServerModbus(Server, ModbusBase):
-    def __init__(self, ip, port):
-        ModbusBase.__init__(self)
+    """Modbus TCP server of a PLC; engine 'thread' is pyModbusTCP's thread per client, 'eventloop' is
+    EventLoopModbusServer.
+
+    get() answers from decoded shadow values, the registers of a tag are decoded again only after a client
+    wrote them. The tags written by clients are also collected until pop_dirty().
+
+    With an AdmissionControl, a request it rejects gets the 'server busy' exception (0x06) before its PDU is
+    even parsed. With a ServerMetrics, every request is recorded per function code and client address, an
+    exception response counting as an error.
+    """
+    ENGINES = {'thread': ModbusServer, 'eventloop': EventLoopModbusServer}
+
+    def __init__(self, ip, port, engine='thread', encoding='scaled', word_order='big', tag_encodings=None,
+                 admission=None, metrics=None):
+        ModbusBase.__init__(self, encoding=encoding, word_order=word_order, tag_encodings=tag_encodings)
         Server.__init__(self, ip, port)
-        self.server = ModbusServer(ip, port, no_block=True)
+        if engine not in ServerModbus.ENGINES:
+            raise ValueError('%s is not a Modbus server engine.' % engine)
+        self.admission = admission
+        self.metrics = metrics
+        data_bank = RegisterBank() if engine == 'eventloop' else DataBank()
+        # the event loop serves one request at a time, it caps the connections of a client instead
+        engine_options = {'admission': admission} if engine == 'eventloop' else {}
+        self.server = ServerModbus.ENGINES[engine](
+            ip, port, no_block=True, data_hdl=ServerDataHandler(data_bank, self._on_client_write),
+            ext_engine=self._monitored_engine if admission is not None or metrics is not None else None,
+            **engine_options)
+
+        self._values = {}
+        self._stale = set()
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+
+    def _monitored_engine(self, session_data):
+        start = time.perf_counter_ns()
+        if self.admission is None:
+            self.server._internal_engine(session_data)
+        elif self.admission.admit(session_data.client.address):
+            try:
+                self.server._internal_engine(session_data)
+            finally:
+                self.admission.release()
+        else:
+            session_data.response.pdu.build_except(session_data.request.pdu.func_code, EXP_SLAVE_DEVICE_BUSY)
+
+        if self.metrics is not None:
+            self.metrics.record(session_data.request.pdu.func_code, session_data.client.address,
+                                len(session_data.request.raw), len(session_data.response.raw),
+                                session_data.response.pdu.func_code & 0x80, time.perf_counter_ns() - start)
 
     def start(self):
         self.server.start()
@@ -113,26 +1103,354 @@ class ServerModbus(Server, ModbusBase):
         self.server.stop()
 
     def set(self, tag_id, value):
-        self.server.data_bank.set_holding_registers(self.get_registers(tag_id),self.encode(value))
+        words = self.encode_tag(tag_id, value)
+        self._stale.discard(tag_id)
+        self.server.data_bank.set_holding_registers(self.get_registers(tag_id), words)
+        self._values[tag_id] = self.decode_tag(tag_id, words)
         #DataBank.set_words(self.get_registers(tag_id), self.encode(value))
 
     def get(self, tag_id):
-        return self.decode(self.server.data_bank.get_holding_registers(self.get_registers(tag_id), self._word_num))
+        if tag_id in self._stale or tag_id not in self._values:
+            # discarded before reading, a client write landing meanwhile marks the tag stale again
+            self._stale.discard(tag_id)
+            self._values[tag_id] = self.decode_tag(tag_id,
+                self.server.data_bank.get_holding_registers(self.get_registers(tag_id), self._word_num))
+        return self._values[tag_id]
         #return self.decode(DataBank.get_words(self.get_registers(tag_id), self._word_num))
 
+    def _on_client_write(self, address, count):
+        tag_ids = range(address // self._word_num, (address + count - 1) // self._word_num + 1)
+        with self._dirty_lock:
+            self._stale.update(tag_ids)
+            self._dirty.update(tag_ids)
+
+    def pop_dirty(self):
+        """Ids of the tags written by clients since the last call."""
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+
+
+class TagExchangeBase:
+    """Frames of the TagExchange-UDP protocol, one datagram per request or reply.
+
+    Every frame starts with version, op, count and sequence ('>BBHI'). A READ request carries count tag ids
+    (uint16) and its reply their values (float64) in the same order, a WRITE request carries count
+    (tag id, value) pairs and its reply no body. Replies echo the sequence of their request, ERROR replies
+    carry a utf-8 message. Batches are limited so that every datagram fits an Ethernet MTU.
+    """
+    VERSION = 1
+    OP_READ = 1
+    OP_WRITE = 2
+    OP_READ_REPLY = 0x81
+    OP_WRITE_REPLY = 0x82
+    OP_ERROR = 0xFF
+    HEADER = struct.Struct('>BBHI')
+    MAX_DATAGRAM = 1472
+    MAX_READ_TAGS = (MAX_DATAGRAM - HEADER.size) // 8
+    MAX_WRITE_TAGS = (MAX_DATAGRAM - HEADER.size) // 10
+
+    def __init__(self):
+        self._structs = {}
+
+    def _struct(self, count, value_format):
+        key = (count, value_format)
+        if key not in self._structs:
+            self._structs[key] = struct.Struct('>' + value_format * count)
+        return self._structs[key]
+
+    @staticmethod
+    def _frame(op, count, sequence, body=b''):
+        return TagExchangeBase.HEADER.pack(TagExchangeBase.VERSION, op, count, sequence) + body
+
+
+class ClientUDP(Client, TagExchangeBase):
+    """TagExchange-UDP client, thread safe, with the interface of ClientModbus.
+
+    A request is sent again when no reply with its sequence arrives within timeout seconds, at most retries
+    times; late replies of earlier requests are dropped. Reads and writes set absolute values, so a repeated
+    request does no harm.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, ip, port, timeout=1.0, retries=2):
+        Client.__init__(self, ip, port)
+        TagExchangeBase.__init__(self)
+        self.timeout = timeout
+        self.retries = retries
+        self._sequence = random.getrandbits(32)
+        self._lock = threading.Lock()
+        self._socket = None
+
+    @staticmethod
+    def shared(ip, port):
+        """The client of this process to ip:port; UDP needs no pool, one socket serves every thread."""
+        with ClientUDP._shared_lock:
+            if (ip, port) not in ClientUDP._shared:
+                ClientUDP._shared[(ip, port)] = ClientUDP(ip, port)
+            return ClientUDP._shared[(ip, port)]
+
+    @staticmethod
+    def _forget_shared():
+        # replies to the parent's requests must not reach a forked child reading the same socket
+        ClientUDP._shared = {}
+        ClientUDP._shared_lock = threading.Lock()
+
+    def open(self):
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # a connected socket only receives from the server, and learns at once when nobody listens
+            self._socket.connect((self.ip, self.port))
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _request(self, op, count, body):
+        """Body of the reply to a request frame, raises ConnectionError when none arrives."""
+        with self._lock:
+            self.open()
+            self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+            sequence = self._sequence
+            frame = TagExchangeBase._frame(op, count, sequence, body)
+
+            for _ in range(self.retries + 1):
+                try:
+                    self._socket.send(frame)
+                    deadline = time.monotonic() + self.timeout
+                    while True:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._socket.settimeout(remaining)
+                        try:
+                            data = self._socket.recv(65535)
+                        except socket.timeout:
+                            break
+                        if len(data) < TagExchangeBase.HEADER.size:
+                            continue
+                        _, reply_op, _, reply_sequence = TagExchangeBase.HEADER.unpack_from(data)
+                        if reply_sequence != sequence:
+                            continue
+                        if reply_op == TagExchangeBase.OP_ERROR:
+                            raise ConnectionError('{}:{} refused the request ({})'.format(
+                                self.ip, self.port, data[TagExchangeBase.HEADER.size:].decode(errors='replace')))
+                        return data[TagExchangeBase.HEADER.size:]
+                except OSError as e:
+                    self.close()
+                    raise ConnectionError('requesting {}:{} failed ({})'.format(self.ip, self.port, e))
+
+            raise ConnectionError('no reply from {}:{} after {} attempts'.format(
+                self.ip, self.port, self.retries + 1))
+
+    def receive(self, tag_id):
+        return self.receive_many([tag_id])[tag_id]
+
+    def send(self, tag_id, value):
+        failed = self.send_many({tag_id: value})
+        if failed:
+            raise ConnectionError(failed[tag_id])
+
+    def receive_many(self, tag_ids):
+        """Values of tag_ids as a dict, one request per MAX_READ_TAGS tags."""
+        tag_ids = list(tag_ids)
+        unique_ids = list(dict.fromkeys(tag_ids))
+
+        values = {}
+        for start in range(0, len(unique_ids), TagExchangeBase.MAX_READ_TAGS):
+            chunk = unique_ids[start:start + TagExchangeBase.MAX_READ_TAGS]
+            body = self._request(TagExchangeBase.OP_READ, len(chunk), self._struct(len(chunk), 'H').pack(*chunk))
+            if len(body) != 8 * len(chunk):
+                raise ConnectionError('malformed reply from {}:{}'.format(self.ip, self.port))
+            values.update(zip(chunk, self._struct(len(chunk), 'd').unpack(body)))
+        return {tag_id: values[tag_id] for tag_id in tag_ids}
+
+    def send_many(self, values):
+        """Write {tag_id: value}, one request per MAX_WRITE_TAGS tags.
+
+        Returns {tag_id: error message} of the tags that were not written, empty when all were.
+        """
+        failed = {}
+        pairs = []
+        for tag_id, value in values.items():
+            try:
+                pairs.append((tag_id, float(value)))
+            except (TypeError, ValueError) as e:
+                failed[tag_id] = str(e)
+
+        for start in range(0, len(pairs), TagExchangeBase.MAX_WRITE_TAGS):
+            chunk = pairs[start:start + TagExchangeBase.MAX_WRITE_TAGS]
+            body = self._struct(len(chunk), 'Hd').pack(*[item for pair in chunk for item in pair])
+            try:
+                self._request(TagExchangeBase.OP_WRITE, len(chunk), body)
+            except ConnectionError as e:
+                for tag_id, _ in chunk:
+                    failed[tag_id] = str(e)
+        return failed
+
+
+os.register_at_fork(after_in_child=ClientUDP._forget_shared)
+
+
+class ServerUDP(Server, TagExchangeBase):
+    """TagExchange-UDP server of a PLC with the interface of ServerModbus, one thread answers every client.
+
+    Values are stored as float64, so no register encoding applies. Tags written by clients are collected
+    until pop_dirty() and an AdmissionControl rejects requests with a 'server busy' error, as for ServerModbus.
+    A ServerMetrics records the requests per op code and client address.
+    """
+    def __init__(self, ip, port, admission=None, metrics=None):
+        Server.__init__(self, ip, port)
+        TagExchangeBase.__init__(self)
+        self.admission = admission
+        self.metrics = metrics
+        self._values = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._socket = None
+        self._thread = None
+        self._running = threading.Event()
+        self.requests = 0
+
+    def start(self):
+        if self._running.is_set():
+            return
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.ip, self.port))
+        self._socket.settimeout(0.2)
+        self._running.set()
+        self._thread = threading.Thread(target=self._serve, name='tag-exchange-server', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._running.is_set():
+            self._running.clear()
+            self._thread.join()
+            self._socket.close()
+
+    def set(self, tag_id, value):
+        self._values[tag_id] = float(value)
+
+    def get(self, tag_id):
+        return self._values.get(tag_id, 0.0)
+
+    def pop_dirty(self):
+        """Ids of the tags written by clients since the last call."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def _serve(self):
+        while self._running.is_set():
+            try:
+                data, address = self._socket.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            start = time.perf_counter_ns()
+            if self.admission is None:
+                reply = self._handle(data)
+            elif self.admission.admit(address[0]):
+                try:
+                    reply = self._handle(data)
+                finally:
+                    self.admission.release()
+            else:
+                reply = self._busy(data)
+            if self.metrics is not None and reply is not None:
+                self.metrics.record(data[1], address[0], len(data), len(reply),
+                                    reply[1] == TagExchangeBase.OP_ERROR, time.perf_counter_ns() - start)
+            if reply is not None:
+                try:
+                    self._socket.sendto(reply, address)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _busy(data):
+        if len(data) < TagExchangeBase.HEADER.size:
+            return None
+        sequence = TagExchangeBase.HEADER.unpack_from(data)[3]
+        return TagExchangeBase._frame(TagExchangeBase.OP_ERROR, 0, sequence, b'server busy')
+
+    def _handle(self, data):
+        if len(data) < TagExchangeBase.HEADER.size:
+            return None
+        version, op, count, sequence = TagExchangeBase.HEADER.unpack_from(data)
+        body = data[TagExchangeBase.HEADER.size:]
+        self.requests += 1
+
+        if version != TagExchangeBase.VERSION:
+            return TagExchangeBase._frame(TagExchangeBase.OP_ERROR, 0, sequence, b'unsupported version')
+
+        if op == TagExchangeBase.OP_READ and len(body) == 2 * count and count <= TagExchangeBase.MAX_READ_TAGS:
+            values = self._values
+            tag_ids = self._struct(count, 'H').unpack(body)
+            return TagExchangeBase._frame(TagExchangeBase.OP_READ_REPLY, count, sequence,
+                                          self._struct(count, 'd').pack(*[values.get(i, 0.0) for i in tag_ids]))
+
+        if op == TagExchangeBase.OP_WRITE and len(body) == 10 * count and count <= TagExchangeBase.MAX_WRITE_TAGS:
+            items = self._struct(count, 'Hd').unpack(body)
+            with self._lock:
+                for index in range(0, 2 * count, 2):
+                    self._values[items[index]] = items[index + 1]
+                    self._dirty.add(items[index])
+            return TagExchangeBase._frame(TagExchangeBase.OP_WRITE_REPLY, count, sequence)
+
+        return TagExchangeBase._frame(TagExchangeBase.OP_ERROR, 0, sequence, b'malformed request')
 
 
 class ProtocolFactory:
     @staticmethod
-    def create_client(protocol, ip, port):
+    def codec_options(plc, tags=()):
+        """Encoding arguments of the clients and server of a PLC_CONFIG entry, tags are its TAG_LIST entries.
+
+        'encoding' and 'word_order' of the PLC are the defaults of its tags, a tag may set its own.
+        """
+        encoding = plc.get('encoding', 'scaled')
+        word_order = plc.get('word_order', 'big')
+        tag_encodings = {}
+        for tag in tags:
+            if 'encoding' in tag or 'word_order' in tag:
+                tag_encodings[tag['id']] = (tag.get('encoding', encoding), tag.get('word_order', word_order))
+        return {'encoding': encoding, 'word_order': word_order, 'tag_encodings': tag_encodings}
+
+    @staticmethod
+    def create_client(protocol, ip, port, codec_options=None):
+        if protocol == 'ModbusWriteRequest-TCP':
+            return ClientModbus(ip, port, **(codec_options or {}))
+        elif protocol == 'TagExchange-UDP':
+            return ClientUDP(ip, port)
+        else:
+            raise TypeError()
+
+    @staticmethod
+    def create_async_client(protocol, ip, port, codec_options=None):
+        if protocol == 'ModbusWriteRequest-TCP':
+            return AsyncClientModbus(ip, port, **(codec_options or {}))
+        else:
+            raise TypeError()
+
+    @staticmethod
+    def pooled_client(protocol, ip, port, codec_options=None):
+        """Context manager checking a client out of the shared ModbusClientPool."""
         if protocol == 'ModbusWriteRequest-TCP':
-            return ClientModbus(ip, port)
+            return ModbusClientPool.shared().client(ip, port, codec_options=codec_options)
+        elif protocol == 'TagExchange-UDP':
+            return nullcontext(ClientUDP.shared(ip, port))
         else:
             raise TypeError()
 
     @staticmethod
-    def create_server(protocol, ip, port):
+    def create_server(protocol, ip, port, engine='thread', codec_options=None, admission=None, metrics=None):
         if protocol == 'ModbusWriteRequest-TCP':
-            return ServerModbus(ip, port)
+            return ServerModbus(ip, port, engine, admission=admission, metrics=metrics, **(codec_options or {}))
+        elif protocol == 'TagExchange-UDP':
+            return ServerUDP(ip, port, admission, metrics)
         else:
             raise TypeError()
@@ -0,0 +1,103 @@
+import heapq
+import logging
+import threading
+import time
+
+from ics_sim.configs import SpeedConfig
+
+
+class CooperativeRuntime:
+    """Runs the loops of many Runnables in one thread instead of a thread each.
+
+    Runnables wait in a priority queue ordered by the deadline of their next cycle, then by priority (lower
+    first), then by the order they were queued in. A runnable whose deadline already passed is queued at now,
+    so one that keeps overrunning takes turns with the others instead of starving them. _logic runs
+    unchanged but should not block, every other runnable waits for it to return.
+    """
+
+    def __init__(self, spin_us=SpeedConfig.LOOP_SPIN_US):
+        self.spin = int(spin_us * 1000)
+        self.cycles = 0
+        self._queue = []
+        self._pending = []
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def add(self, runnable, priority=0):
+        """Schedule a runnable, its _before_start runs in the runtime thread."""
+        with self._lock:
+            self._pending.append((runnable, priority))
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name='cooperative-runtime', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the runtime, the runnables it had are left as they are."""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {'runnables': len(self._queue), 'cycles': self.cycles}
+
+    def _push(self, runnable, priority, now):
+        deadline, missed = runnable._scheduler.next_deadline(now)
+        heapq.heappush(self._queue, (max(deadline, now), priority, self._sequence, deadline, missed, runnable))
+        self._sequence += 1
+
+    def _begin_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for runnable, priority in pending:
+            try:
+                runnable._begin_loop()
+            except Exception as e:
+                runnable.report(e.__str__(), logging.FATAL)
+                continue
+            self._push(runnable, priority, time.perf_counter_ns())
+
+    def run(self, timeout=None):
+        """Serve the runnables in the calling thread until stop(), or for timeout seconds."""
+        end = None if timeout is None else time.perf_counter_ns() + int(timeout * 1000000000)
+        while not self._stop_event.is_set():
+            self._wakeup.clear()
+            self._begin_pending()
+
+            now = time.perf_counter_ns()
+            if end is not None and now >= end:
+                break
+            if self._queue and self._queue[0][5].stop_event.is_set():
+                heapq.heappop(self._queue)
+                continue
+
+            # sleep until the spin window of the first deadline, add() and stop() wake the runtime up earlier
+            remaining = self._queue[0][0] - now - self.spin if self._queue else None
+            if end is not None:
+                remaining = end - now if remaining is None else min(remaining, end - now)
+            if remaining is None or remaining > 0:
+                self._wakeup.wait(None if remaining is None else remaining / 1000000000)
+                continue
+
+            key, priority, _, deadline, missed, runnable = heapq.heappop(self._queue)
+            while time.perf_counter_ns() < key:
+                pass
+
+            runnable._scheduler.started(deadline)
+            try:
+                runnable._run_cycle(deadline, missed)
+            except Exception as e:
+                # the thread of a runnable ends on an exception, here only that runnable is dropped
+                runnable.report(e.__str__(), logging.FATAL)
+                continue
+            self.cycles += 1
+            self._push(runnable, priority, time.perf_counter_ns())
@@ -1,8 +1,22 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
 import unittest
-from Configs import Connection
+from Configs import Connection, TAG
 
 
-from ics_sim.connectors import SQLiteConnector, MemcacheConnector, ConnectorFactory
+from ics_sim.connectors import Connector, SQLiteConnector, MemcacheConnector, FileConnector, SharedMemoryConnector, \
+    ConnectorFactory
+from ics_sim.protocol import ServerModbus
+from benchmarks.fake_memcached import FakeMemcached
+
+
+def _write_shm_value(connection_config, key, value):
+    connection = ConnectorFactory.build(connection_config)
+    connection.set(key, value)
+    connection.close()
 
 
 class ConnectionTests(unittest.TestCase):
@@ -63,3 +77,340 @@ class ConnectionTests(unittest.TestCase):
 
         except Exception:
             self.fail("cannot init values in the connection!")
+
+    def test_persistent_sqlite_connection(self):
+        path = os.path.join(tempfile.mkdtemp(), 'persistent.sqlite')
+        connection_config = {'type': 'sqlite', 'path': path, 'name': 'fp_table', 'options': {'persistent': True}}
+
+        writer = ConnectorFactory.build(connection_config)
+        reader = ConnectorFactory.build(connection_config)
+        writer.initialize([('value1', 1), ('value2', 2)])
+
+        self.assertEqual(reader.get('value1'), 1, 'get function in persistent sqliteConnection is not working')
+        self.assertEqual(writer._thread_connection().execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+        writer.begin()
+        writer.set('value1', 10)
+        writer.set('value2', 20)
+        self.assertEqual(reader.get('value1'), 1, 'grouped writes are visible before commit')
+        self.assertEqual(writer.get_many(['value1', 'value2']), {'value1': 10, 'value2': 20})
+        # the writer holds no lock until commit(), an other writer is not blocked meanwhile
+        self.assertFalse(writer._thread_connection().in_transaction)
+        reader.set('value2', 21)
+        writer.commit()
+
+        self.assertEqual(reader.get('value1'), 10, 'grouped writes are not visible after commit')
+        self.assertEqual(reader.get('value2'), 20, 'grouped writes are not visible after commit')
+
+        writer.set('value1', 11)
+        self.assertEqual(reader.get('value1'), 11, 'writes outside begin/commit must be committed at once')
+
+        writer.close()
+        reader.close()
+
+    def test_connection_factory_options(self):
+        connection_config = dict(Connection.SQLITE_CONNECTION)
+        connection_config['options'] = 'persistent'
+        self.assertRaises(TypeError, ConnectorFactory.build, connection_config)
+
+        connection_config['other'] = {}
+        self.assertRaises(KeyError, ConnectorFactory.build, connection_config)
+
+    def test_sqlite_bulk_access(self):
+        for options in ({}, {'persistent': True}):
+            path = os.path.join(tempfile.mkdtemp(), 'bulk.sqlite')
+            connection = SQLiteConnector({'type': 'sqlite', 'path': path, 'name': 'fp_table', 'options': options})
+            connection.initialize([('value1', 1), ('value2', 2), ('value3', 3)])
+
+            self.assertEqual(connection.get_many(['value3', 'value1']), {'value3': 3, 'value1': 1})
+
+            connection.set_many({'value1': 10, 'value2': 20})
+            self.assertEqual(connection.get_many(['value1', 'value2', 'value3']),
+                             {'value1': 10, 'value2': 20, 'value3': 3},
+                             'set_many in sqliteConnection is not working correctly')
+            connection.close()
+
+    def test_sqlite_compact_schema(self):
+        directory = tempfile.mkdtemp()
+        tags = {'value1': 3, 'value2': 7}
+        connection_configs = [
+            {'type': 'sqlite', 'path': os.path.join(directory, 'compact.sqlite'), 'name': 'fp_table',
+             'options': {'tags': tags}},
+            {'type': 'sqlite', 'path': os.path.join(directory, 'compact_memory.sqlite'), 'name': 'fp_table',
+             'options': {'tags': tags, 'memory': True, 'persistent': True}},
+        ]
+
+        for connection_config in connection_configs:
+            writer = ConnectorFactory.build(connection_config)
+            writer.initialize([('value1', 1), ('value2', 2)])
+            reader = ConnectorFactory.build(connection_config)
+
+            writer.set('value1', 10)
+            writer.set_many({'value2': 20})
+            self.assertEqual(reader.get('value1'), 10)
+            self.assertEqual(reader.get_many(['value2', 'value1']), {'value2': 20, 'value1': 10})
+            self.assertRaises(KeyError, reader.get, 'value3')
+
+            writer.initialize([('value1', 5)])
+            self.assertEqual(reader.get_many(['value1']), {'value1': 5}, 'clear_old did not recreate the table')
+            writer.close()
+            reader.close()
+
+        self.assertEqual(os.listdir(directory), ['compact.sqlite'], 'in-memory database created a file')
+
+    def test_sqlite_reinitialize_persistent(self):
+        connection_config = {'type': 'sqlite', 'path': os.path.join(tempfile.mkdtemp(), 'reinitialize.sqlite'),
+                             'name': 'fp_table', 'options': {'persistent': True}}
+        writer = ConnectorFactory.build(connection_config)
+        writer.initialize([('value1', 1)])
+        reader = ConnectorFactory.build(connection_config)
+        self.assertEqual(reader.get('value1'), 1)
+
+        writer.initialize([('value1', 5), ('value2', 6)])
+        self.assertEqual(reader.get_many(['value1', 'value2']), {'value1': 5, 'value2': 6},
+                         'a persistent reader did not see the new database')
+        writer.close()
+        reader.close()
+
+    def test_sqlite_memory_concurrency(self):
+        connection_config = {'type': 'sqlite', 'path': os.path.join(tempfile.mkdtemp(), 'concurrent.sqlite'),
+                             'name': 'fp_table',
+                             'options': {'tags': {'value1': 0, 'value2': 1}, 'memory': True, 'persistent': True}}
+        writer = ConnectorFactory.build(connection_config)
+        writer.initialize([('value1', 0), ('value2', 0)])
+        reader = ConnectorFactory.build(connection_config)
+        errors = []
+        writer._report_error = reader._report_error = lambda *args: errors.append(args)
+        stop = time.time() + 0.5
+
+        def write():
+            value = 0
+            while time.time() < stop:
+                value += 1
+                writer.begin()
+                writer.set('value1', value)
+                writer.set('value2', value)
+                writer.commit()
+
+        def read():
+            while time.time() < stop:
+                values = reader.get_many(['value1', 'value2'])
+                if values is None or values['value1'] != values['value2']:
+                    errors.append(values)
+
+        threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors[:3], [], 'accesses failed on a locked shared-cache table')
+        self.assertGreater(reader.get('value1'), 0)
+        writer.close()
+        reader.close()
+
+    def test_hardware_connection(self):
+        server = ServerModbus('127.0.0.1', 5620)
+        server.start()
+        connection_config = {'type': 'hardware', 'path': '127.0.0.1:5620', 'name': 'io_module',
+                             'options': {'tags': {'value1': 2, 'value2': 3, 'value3': 5}}}
+        try:
+            connection1 = ConnectorFactory.build(connection_config)
+            connection2 = ConnectorFactory.build(connection_config)
+            connection1.initialize([('value1', 1), ('value2', 2), ('value3', 3)])
+            self.assertEqual(connection2.get('value1'), 1)
+            self.assertEqual(server.get(5), 3)
+
+            connection2.begin()
+            server.set(2, 7)
+            self.assertEqual(connection2.get_many(['value1', 'value3']), {'value1': 1, 'value3': 3},
+                             'get between begin() and commit() did not use the image')
+            connection2.set('value3', 30)
+            self.assertEqual(connection2.get('value3'), 30, 'write is not visible in the image')
+            connection2.commit()
+            self.assertEqual(connection2.get('value1'), 7)
+            self.assertRaises(KeyError, connection2.get, 'value4')
+
+            connection1.close()
+            connection2.close()
+        finally:
+            server.stop()
+
+    def test_file_connection(self):
+        path = os.path.join(tempfile.mkdtemp(), 'sensors_actuators.json')
+        connection = FileConnector({'type': 'file', 'path': path, 'name': 'fake_name'})
+        connection.initialize([('value1', 1), ('value2', 2)])
+
+        self.assertEqual(connection.get('value1'), 1, 'get function in FileConnection is not working correctly')
+
+        connection.set('value1', 10)
+        self.assertEqual(connection.get('value1'), 10, 'set function in FileConnection is not working correctly')
+
+        connection.set_many({'value1': 11, 'value2': 21})
+        self.assertEqual(connection.get_many(['value1', 'value2']), {'value1': 11, 'value2': 21})
+
+    def test_shm_connection(self):
+        path = os.path.join(tempfile.mkdtemp(), 'tags.shm')
+        connection_config = {'type': 'shm', 'path': path, 'name': 'fp_table', 'options': {'tags': TAG.TAG_LIST}}
+
+        writer = ConnectorFactory.build(connection_config)
+        self.assertIsInstance(writer, SharedMemoryConnector)
+        writer.initialize([(tag, TAG.TAG_LIST[tag]['default']) for tag in TAG.TAG_LIST])
+
+        reader = ConnectorFactory.build(connection_config)
+        self.assertEqual(reader.get(TAG.TAG_TANK_LEVEL_VALUE), 5.8)
+
+        generation = reader.generation()
+        writer.set_many({TAG.TAG_TANK_LEVEL_VALUE: 6.5, TAG.TAG_BOTTLE_LEVEL_VALUE: 0.25})
+        self.assertNotEqual(reader.generation(), generation, 'shm generation does not change on writes')
+        self.assertEqual(reader.get_many([TAG.TAG_TANK_LEVEL_VALUE, TAG.TAG_BOTTLE_LEVEL_VALUE]),
+                         {TAG.TAG_TANK_LEVEL_VALUE: 6.5, TAG.TAG_BOTTLE_LEVEL_VALUE: 0.25})
+
+        process = multiprocessing.Process(target=_write_shm_value,
+                                          args=(connection_config, TAG.TAG_TANK_LEVEL_VALUE, 7.25))
+        process.start()
+        process.join()
+        self.assertEqual(reader.get(TAG.TAG_TANK_LEVEL_VALUE), 7.25, 'shm value is not shared between processes')
+
+        self.assertRaises(KeyError, reader.get, 'value1')
+
+        # a writer dying between the two sequence stores leaves the sequence odd
+        buffer = writer._mapping()
+        sequence = writer._sequence(buffer)
+        writer.SEQUENCE.pack_into(buffer, writer.SEQUENCE_OFFSET, sequence + 1)
+        self.assertEqual(reader.get(TAG.TAG_TANK_LEVEL_VALUE), 7.25, 'reads spin on a crashed writer')
+        writer.set(TAG.TAG_TANK_LEVEL_VALUE, 8.5)
+        self.assertEqual(writer._sequence(buffer) % 2, 0, 'a write after a crash keeps the wrong parity')
+        self.assertEqual(reader.get(TAG.TAG_TANK_LEVEL_VALUE), 8.5)
+
+        writer.close()
+        reader.close()
+
+    def test_memcache_shared_client_and_packing(self):
+        connection1 = MemcacheConnector(Connection.MEMCACHE_LOCAL_CONNECTION)
+        connection2 = MemcacheConnector(Connection.MEMCACHE_LOCAL_CONNECTION)
+        self.assertIs(connection1.memcached_client, connection2.memcached_client, 'memcache client is not shared')
+
+        packed = MemcacheConnector._pack(7.25)
+        self.assertEqual(len(packed), 8)
+        self.assertEqual(MemcacheConnector._unpack(packed), 7.25)
+        self.assertEqual(MemcacheConnector._unpack(MemcacheConnector._pack(3)), 3)
+        self.assertEqual(MemcacheConnector._pack('text'), 'text')
+
+        connection1.close()
+        connection2.close()
+
+    def test_memcache_connection_fake_server(self):
+        server = FakeMemcached().start()
+        connection_config = {'type': 'memcache', 'path': server.address, 'name': 'fake_name'}
+        try:
+            writer = ConnectorFactory.build(connection_config)
+            reader = ConnectorFactory.build(connection_config)
+            writer.initialize([('value1', 1), ('value2', 2.5)])
+            self.assertEqual(reader.get_many(['value1', 'value2']), {'value1': 1, 'value2': 2.5})
+
+            generation = reader.generation()
+            writer.set_many({'value1': 10})
+            self.assertEqual(reader.get('value1'), 10)
+            self.assertNotEqual(reader.generation(), generation, 'generation did not change after a write')
+
+            generation = reader.generation()
+            writer.set('value1', 10)
+            self.assertEqual(reader.generation(), generation, 'writing the same value bumped the generation')
+            writer.begin()
+            writer.set('value1', 11)
+            writer.set_many({'value2': 3.5})
+            self.assertEqual(reader.generation(), generation, 'generation bumped before commit')
+            writer.commit()
+            self.assertEqual(reader.generation(), generation + 1, 'a batch must bump the generation once')
+
+            writer.close()
+            reader.close()
+        finally:
+            server.stop()
+
+    def test_file_connection_write_behind(self):
+        path = os.path.join(tempfile.mkdtemp(), 'sensors_actuators.json')
+        connection_config = {'type': 'file', 'path': path, 'name': 'fake_name', 'options': {'flush_interval': 60000}}
+
+        writer = ConnectorFactory.build(connection_config)
+        reader = ConnectorFactory.build(connection_config)
+        writer.initialize([('value1', 1), ('value2', 2)])
+        self.assertEqual(reader.get('value1'), 1)
+
+        writer.set('value1', 10)
+        self.assertEqual(writer.get('value1'), 10, 'buffered write is not visible to its writer')
+        self.assertEqual(reader.get('value1'), 1, 'write is flushed before the flush interval')
+
+        reader.begin()
+        reader.set('value2', 20)
+        reader.commit()
+        writer.flush()
+
+        self.assertEqual(reader.get_many(['value1', 'value2']), {'value1': 10, 'value2': 20})
+        self.assertEqual(writer.get_many(['value1', 'value2']), {'value1': 10, 'value2': 20})
+        self.assertEqual(os.listdir(os.path.dirname(path)).count('sensors_actuators.json'), 1)
+
+        # a trailing write inside the interval still reaches the file once the interval is over
+        writer = ConnectorFactory.build(dict(connection_config, options={'flush_interval': 100}))
+        writer.initialize([('value1', 1), ('value2', 2)])
+        writer.set('value1', 30)
+        self.assertEqual(reader.get('value1'), 1)
+        time.sleep(0.3)
+        self.assertEqual(reader.get('value1'), 30, 'trailing write is not flushed')
+        writer.close()
+
+    def test_default_bulk_access(self):
+        class DictConnector(Connector):
+            def initialize(self, values, clear_old=False):
+                self.values = dict(values)
+
+            def set(self, key, value):
+                self.values[key] = value
+
+            def get(self, key):
+                return self.values[key]
+
+        connection = DictConnector({'type': 'dict', 'path': '', 'name': 'fp_table'})
+        connection.initialize([('value1', 1), ('value2', 2)])
+        connection.set_many({'value1': 10})
+        self.assertEqual(connection.get_many(['value1', 'value2']), {'value1': 10, 'value2': 2})
+
+    def test_subscriptions(self):
+        directory = tempfile.mkdtemp()
+        tags = {'value1': 0, 'value2': 1, 'value3': 2}
+        connection_configs = [
+            {'type': 'sqlite', 'path': os.path.join(directory, 'sub.sqlite'), 'name': 'fp_table'},
+            {'type': 'sqlite', 'path': os.path.join(directory, 'sub2.sqlite'), 'name': 'fp_table',
+             'options': {'persistent': True}},
+            {'type': 'shm', 'path': os.path.join(directory, 'sub.shm'), 'name': 'fp_table', 'options': {'tags': tags}},
+            {'type': 'file', 'path': os.path.join(directory, 'sub.json'), 'name': 'fake_name'},
+        ]
+
+        for connection_config in connection_configs:
+            writer = ConnectorFactory.build(connection_config)
+            writer.initialize([('value1', 1), ('value2', 2), ('value3', 3)])
+            reader = ConnectorFactory.build(connection_config)
+
+            received = []
+            reader.subscribe(['value1', 'value2'], received.append)
+
+            reader.poll_changes()
+            self.assertEqual(received, [{'value1': 1, 'value2': 2}], 'first poll must report the current values')
+
+            generation = reader.generation()
+            reader.poll_changes()
+            self.assertEqual(len(received), 1, 'poll without writes reported changes')
+
+            writer.set('value3', 30)
+            writer.set_many({'value1': 1, 'value2': 20})
+            self.assertNotEqual(reader.generation(), generation, 'generation did not change after a write')
+            reader.poll_changes()
+            self.assertEqual(received[-1], {'value2': 20}, 'poll must report only changed subscribed tags')
+
+            if connection_config['type'] == 'sqlite':
+                generation = reader.generation()
+                writer.set_many({'value1': 1, 'value2': 20})
+                self.assertEqual(reader.generation(), generation, 'unchanged values bumped the sqlite version')
+
+            writer.close()
+            reader.close()
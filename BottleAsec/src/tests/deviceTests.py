@@ -0,0 +1,178 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from ics_sim.Device import TagCache, SensorConnector, ActuatorConnector, LoopScheduler, Runnable, HMI, PLC
+from ics_sim.connectors import ConnectorFactory
+from ics_sim.protocol import ServerModbus, ModbusClientPool, ClientModbus
+from ics_sim.runtime import CooperativeRuntime
+
+
+class ScanRecorder(Runnable):
+    def __init__(self, name, loop, scans, fail_at=None):
+        with mock.patch.object(sys, 'stdin', open(os.devnull)):
+            Runnable.__init__(self, name, loop)
+        self.scans = scans
+        self.fail_at = fail_at
+
+    def _before_start(self):
+        pass
+
+    def _logic(self):
+        self.scans.append(self.name())
+        if self.scans.count(self.name()) == self.fail_at:
+            raise ValueError('scan failed')
+
+
+class TankPLC(PLC):
+    def __init__(self, sensor_connection, actuator_connection, tags, plcs):
+        with mock.patch.object(sys, 'stdin', open(os.devnull)):
+            PLC.__init__(self, 1, SensorConnector(sensor_connection), ActuatorConnector(actuator_connection),
+                         tags, plcs)
+
+    def _logic(self):
+        self._set('valve', 1 if self._get('level') < self._get('flow') else 0)
+
+
+class DeviceTests(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.join(tempfile.mkdtemp(), 'device.sqlite')
+        self.connection = {'type': 'sqlite', 'path': path, 'name': 'fp_table', 'options': {'persistent': True}}
+        self.backend = ConnectorFactory.build(self.connection)
+        self.backend.initialize([('level', 5.0), ('valve', 0)])
+
+    def test_loop_scheduler(self):
+        scheduler = LoopScheduler(5, spin_us=300)
+        first = scheduler.start() + scheduler.period
+        for cycle in range(20):
+            deadline, missed = scheduler.wait()
+            self.assertEqual((deadline, missed), (first + cycle * scheduler.period, 0))
+            self.assertGreaterEqual(time.perf_counter_ns(), deadline)
+        self.assertLess(scheduler.lateness.percentile(50), 1000000)
+
+        time.sleep(0.012)
+        deadline, missed = scheduler.wait()
+        self.assertGreaterEqual(missed, 2)
+        self.assertEqual((deadline - first) % scheduler.period, 0, 'skipping left the grid')
+        self.assertEqual(scheduler.skipped, missed)
+
+        scheduler = LoopScheduler(5, overrun=LoopScheduler.OVERRUN_CATCH_UP)
+        first = scheduler.start() + scheduler.period
+        time.sleep(0.017)
+        self.assertEqual([scheduler.wait()[0] for _ in range(3)], [first + i * scheduler.period for i in range(3)])
+        self.assertRaises(ValueError, LoopScheduler, 5, overrun='wait')
+
+    def test_cooperative_runtime(self):
+        scans = []
+        fast = ScanRecorder('fast', 5, scans)
+        slow = ScanRecorder('slow', 10, scans)
+        failing = ScanRecorder('failing', 5, scans, fail_at=3)
+        runtime = CooperativeRuntime()
+        fast.start(runtime)
+        runtime.add(slow, priority=-1)
+        failing.start(runtime)
+        runtime.run(timeout=0.2)
+
+        self.assertEqual(scans.count('failing'), 3, 'a runnable failing is not dropped')
+        self.assertGreaterEqual(scans.count('fast'), 30)
+        self.assertAlmostEqual(scans.count('slow') * 2, scans.count('fast'), delta=3)
+        # slow shares every other deadline with fast and goes first, being of higher priority
+        first = scans.index('slow')
+        self.assertEqual(scans[first:first + 3], ['slow', 'fast', 'failing'])
+        self.assertEqual(runtime.stats()['runnables'], 2)
+
+        fast.stop_event.set()
+        runtime.run(timeout=0.05)
+        self.assertEqual(runtime.stats()['runnables'], 1)
+
+    def test_dedicated_clients(self):
+        server = ServerModbus('127.0.0.1', 5013, engine='eventloop')
+        server.start()
+        server.set(0, 4.5)
+        plcs = {1: {'name': 'PLC1', 'ip': '127.0.0.1', 'port': 5013, 'protocol': 'ModbusWriteRequest-TCP'}}
+        tags = {'level': {'id': 0, 'plc': 1, 'type': 'input', 'fault': 0.0, 'default': 0}}
+        with mock.patch.object(sys, 'stdin', open(os.devnull)):
+            agents = [HMI('agent%d' % i, tags, plcs, 100) for i in range(2)]
+        for agent in agents:
+            agent.set_dedicated_clients(True)
+
+        self.assertEqual([agent._receive('level') for agent in agents], [4.5, 4.5])
+        self.assertIsNot(agents[0]._dedicated_clients[1], agents[1]._dedicated_clients[1])
+        self.assertNotIn('127.0.0.1:5013', ModbusClientPool.shared().stats()['endpoints'])
+        for agent in agents:
+            agent._dedicated_clients[1].close()
+        server.stop()
+
+    def test_plc_reads_hardware_once_per_scan(self):
+        module = ServerModbus('127.0.0.1', 5016)
+        module.start()
+        hardware = {'type': 'hardware', 'path': '127.0.0.1:5016', 'name': 'io_module',
+                    'options': {'tags': {'level': 0, 'flow': 1}}}
+        ConnectorFactory.build(hardware).initialize([('level', 2.0), ('flow', 3.0)])
+        plcs = {1: {'name': 'PLC1', 'ip': '127.0.0.1', 'port': 5017, 'protocol': 'ModbusWriteRequest-TCP'}}
+        tags = {'level': {'id': 0, 'plc': 1, 'type': 'input', 'fault': 0.0, 'default': 0},
+                'flow': {'id': 1, 'plc': 1, 'type': 'input', 'fault': 0.0, 'default': 0},
+                'valve': {'id': 2, 'plc': 1, 'type': 'output', 'fault': 0.0, 'default': 0}}
+        plc = TankPLC(hardware, self.connection, tags, plcs)
+
+        with mock.patch.object(ClientModbus, 'receive_many', autospec=True,
+                               side_effect=ClientModbus.receive_many) as receive_many:
+            for _ in range(3):
+                plc._pre_logic_update()
+                plc._logic()
+                plc._post_logic_update()
+        self.assertEqual(receive_many.call_count, 3, 'the sensor block is not read once per scan')
+        self.assertEqual(self.backend.get('valve'), 1)
+        module.stop()
+
+    def test_tag_cache(self):
+        cache = TagCache()
+        self.assertIs(cache.lookup('level'), TagCache.MISSING)
+        cache.store('level', 1.5)
+        self.assertEqual(cache.lookup('level'), 1.5)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+        self.assertTrue('level' in cache and 'flow' not in cache)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 1}, 'a membership test was counted')
+
+        cache.set_ttl('remote', 50)
+        cache.store('remote', 2.5)
+        cache.invalidate()
+        self.assertIs(cache.lookup('level'), TagCache.MISSING, 'cache entry survived the cycle invalidation')
+        self.assertEqual(cache.lookup('remote'), 2.5, 'tag with ttl did not survive the cycle invalidation')
+
+        time.sleep(0.06)
+        cache.invalidate()
+        self.assertIs(cache.lookup('remote'), TagCache.MISSING, 'tag outlived its ttl')
+
+    def test_sensor_reads_are_consistent_within_a_scan(self):
+        sensors = SensorConnector(self.connection)
+        sensors.add_sensor('level', 0.5)
+
+        first = sensors.read('level')
+        self.backend.set('level', 7.0)
+        self.assertEqual(sensors.read('level'), first, 'sensor value changed within one scan')
+        self.assertEqual(sensors.read_many(['level']), {'level': first})
+
+        sensors.cache.invalidate()
+        self.assertNotEqual(sensors.read('level'), first, 'sensor value was not refreshed by the next scan')
+
+    def test_actuator_skips_repeated_writes(self):
+        actuators = ActuatorConnector(self.connection)
+        actuators.add_actuator('valve')
+
+        actuators.write('valve', 1)
+        self.backend.set('valve', 0)
+        actuators.write('valve', 1)
+        self.assertEqual(self.backend.get('valve'), 0, 'repeated command was written again in the same scan')
+
+        actuators.cache.invalidate()
+        actuators.write_many({'valve': 1})
+        self.assertEqual(self.backend.get('valve'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from ics_sim.connectors import ConnectorFactory
+from ics_sim.history import HistoryStore
+
+
+class HistoryTests(unittest.TestCase):
+
+    def test_range_and_at_across_chunks(self):
+        directory = tempfile.mkdtemp()
+        store = HistoryStore(directory, capacity=4)
+        store.record({'level': 1, 'valve': 0}, timestamp=1)
+        for t in range(2, 11):
+            store.record({'level': t}, timestamp=t)
+        store.record({'flow': 5}, timestamp=11)
+
+        self.assertGreater(len([name for name in os.listdir(directory) if name.endswith('.chunk')]), 1)
+        self.assertEqual(store.range('level', 3, 6), ([3, 4, 5, 6], [3, 4, 5, 6]))
+        self.assertEqual(store.range('valve', 0, 100), ([1], [0]))
+        self.assertEqual(store.at(0.5), {})
+        self.assertEqual(store.at(7.5), {'level': 7, 'valve': 0})
+        self.assertEqual(store.at(20), {'level': 10, 'valve': 0, 'flow': 5})
+
+        store.close()
+        reader = HistoryStore(directory)
+        self.assertEqual(reader.at(20), {'level': 10, 'valve': 0, 'flow': 5}, 'flushed rows are not readable')
+        self.assertEqual(reader.range('level', 9, 10), ([9, 10], [9, 10]))
+        reader.close()
+
+    def test_history_connector(self):
+        directory = tempfile.mkdtemp()
+        connection_config = {'type': 'shm', 'path': os.path.join(directory, 'history.shm'), 'name': 'fp_table',
+                             'options': {'tags': {'value1': 0, 'value2': 1},
+                                         'history': os.path.join(directory, 'history')}}
+
+        connection = ConnectorFactory.build(connection_config)
+        connection.initialize([('value1', 1), ('value2', 2)])
+        connection.set('value1', 10)
+        connection.set_many({'value2': 20})
+        self.assertEqual(connection.get('value1'), 10)
+
+        times, values = connection.history.range('value1', 0, float('inf'))
+        self.assertEqual(values, [1, 10])
+        self.assertEqual(connection.history.at(times[-1]), {'value1': 10, 'value2': 2})
+        connection.close()
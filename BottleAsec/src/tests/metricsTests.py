@@ -0,0 +1,115 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from ics_sim.connectors import ConnectorFactory, InstrumentedConnector
+from ics_sim.metrics import LatencyHistogram, MetricsRegistry, ServerMetrics
+from ics_sim.protocol import ClientModbus, ServerModbus, AdmissionControl
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram()
+        for value in range(1, 10001):
+            histogram.record(value)
+
+        self.assertEqual(histogram.count, 10000)
+        self.assertEqual(histogram.min, 1)
+        self.assertEqual(histogram.max, 10000)
+        for percent, expected in ((50, 5000), (99, 9900), (99.9, 9990)):
+            value = histogram.percentile(percent)
+            self.assertLessEqual(abs(value - expected) / expected, 0.07, 'p{} is {}'.format(percent, value))
+
+        other = LatencyHistogram()
+        other.record(20000)
+        histogram.merge(other)
+        self.assertEqual(histogram.snapshot()['max'], 20000)
+
+    def test_histogram_buckets_are_monotonic(self):
+        previous = -1
+        for value in range(0, 5000):
+            index = LatencyHistogram._index(value)
+            self.assertGreaterEqual(index, previous)
+            self.assertLessEqual(LatencyHistogram._lowest_value(index), value)
+            previous = index
+
+    def test_instrumented_connector(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'metrics.sqlite')
+        connector = ConnectorFactory.build(
+            {'type': 'sqlite', 'path': path, 'name': 'fp_table', 'options': {'instrument': True}})
+        self.assertIsInstance(connector, InstrumentedConnector)
+
+        registry = MetricsRegistry()
+        connector._registry = registry
+        connector.initialize([('value1', 1), ('value2', 2)])
+        connector.set('value1', 10)
+        self.assertEqual(connector.get('value1'), 10)
+        self.assertEqual(connector.get_many(['value1', 'value2']), {'value1': 10, 'value2': 2})
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot[('sqlite', 'get', None)]['count'], 1)
+        self.assertEqual(snapshot[('sqlite', 'get', 'value1')]['count'], 1)
+        self.assertEqual(snapshot[('sqlite', 'get_many', None)]['count'], 1)
+        self.assertEqual(snapshot[('sqlite', 'initialize', None)]['count'], 1)
+
+        broken = ConnectorFactory.build(
+            {'type': 'sqlite', 'path': path, 'name': 'missing_table', 'options': {'instrument': True}})
+        broken._registry = registry
+        broken.set('value1', 1)
+        self.assertEqual(registry.snapshot()[('sqlite', 'set', 'value1')]['errors'], 1)
+
+        csv_path = os.path.join(directory, 'metrics.csv')
+        registry.dump(csv_path)
+        with open(csv_path) as f:
+            lines = f.readlines()
+        self.assertEqual(lines[0].strip(), ','.join(MetricsRegistry.CSV_FIELDS))
+        self.assertEqual(len(lines), len(registry.snapshot()) + 1)
+
+    def test_server_metrics(self):
+        metrics = ServerMetrics()
+        server = ServerModbus('127.0.0.1', 5011, engine='eventloop', metrics=metrics,
+                              admission=AdmissionControl(rate=1, burst=4))
+        server.start()
+        client = ClientModbus('127.0.0.1', 5011)
+        client.send(0, 1.5)
+        for _ in range(4):
+            try:
+                client.receive(0)
+            except ConnectionError:
+                pass
+        client.close()
+        server.stop()
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot[(16, '127.0.0.1')]['requests'], 1)
+        self.assertEqual(snapshot[(3, '127.0.0.1')]['requests'], 4)
+        self.assertEqual(snapshot[(3, '127.0.0.1')]['errors'], 1, 'the busy reply to the request over the burst')
+        self.assertEqual(snapshot[(3, '127.0.0.1')]['bytes_in'], 4 * 12)
+        self.assertEqual(snapshot[(None, '127.0.0.1')]['requests'], 5)
+        self.assertEqual(snapshot[(3, None)]['count'], 4)
+
+        # shards of other threads, alive or finished, are merged on read
+        def record():
+            for _ in range(100):
+                metrics.record(3, '10.0.0.1', 12, 13, False, 1000)
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        self.assertEqual(metrics.snapshot()[(3, '10.0.0.1')]['requests'], 400)
+        self.assertEqual(metrics.snapshot()[(3, None)]['requests'], 404)
+
+        directory = tempfile.mkdtemp()
+        metrics.dump(os.path.join(directory, 'server.csv'))
+        with open(os.path.join(directory, 'server.csv')) as f:
+            self.assertEqual(f.readline().strip(), ','.join(ServerMetrics.CSV_FIELDS))
+        metrics.dump(os.path.join(directory, 'server.json'))
+        with open(os.path.join(directory, 'server.json')) as f:
+            self.assertEqual(len(json.loads(f.readline())['requests']), len(metrics.snapshot()))
+
+
+if __name__ == '__main__':
+    unittest.main()
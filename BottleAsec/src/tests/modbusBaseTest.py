@@ -1,9 +1,20 @@
+import asyncio
+import os
+import socket
+import struct
 import time
 import unittest
 from ics_sim.helper import debug
+from pyModbusTCP.constants import EXP_SLAVE_DEVICE_BUSY
 from pyModbusTCP.server import ModbusServer, DataBank
 
-from ics_sim.protocol import ClientModbus, ServerModbus, ModbusBase
+from ics_sim.protocol import ClientModbus, ServerModbus, ModbusBase, AsyncClientModbus, ModbusClientPool, \
+    ProtocolFactory, ClientUDP, TagExchangeBase, AdmissionControl, EventLoopModbusServer
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 class ProtocolTests(unittest.TestCase):
@@ -24,6 +35,43 @@ class ProtocolTests(unittest.TestCase):
         number = round(number, modbus_base._precision)
         self.assertEqual(number, new_number, 'encoding and decoding is wrong ({})'.format(number))
 
+    def test_ModbusBase_many(self):
+        values = [0, 1.5, 7654.3219, 70000, 429496.7295]
+        modbus_base = ModbusBase()
+        words = modbus_base.encode_many(values)
+        self.assertEqual(len(words), 2 * len(values))
+        self.assertEqual(words[2:4], modbus_base.encode(1.5))
+        self.assertEqual(modbus_base.decode_many(words), values)
+        self.assertRaises(ValueError, modbus_base.encode, -1)
+        self.assertRaises(ValueError, modbus_base.encode, 429496.7296)
+
+        for word_num in (1, 2, 3, 4):
+            signed_base = ModbusBase(word_num=word_num, precision=2, signed=True)
+            values = [-1.5, 0, 3.25, -327.68, 327.67]
+            words = signed_base.encode_many(values)
+            self.assertEqual(len(words), word_num * len(values))
+            self.assertEqual(signed_base.decode_many(words), values, 'word_num={}'.format(word_num))
+            self.assertEqual(signed_base.decode_bytes(signed_base.encode_bytes(values)), values)
+
+    def test_ModbusBase_encodings(self):
+        self.assertEqual(ModbusBase(encoding='float32').encode(1.0), [0x3F80, 0])
+        self.assertEqual(ModbusBase(encoding='float32', word_order='little').encode(1.0), [0, 0x3F80])
+        self.assertEqual(ModbusBase(encoding='float64', word_order='little').encode(-2.0), [0, 0, 0, 0xC000])
+        self.assertEqual(ModbusBase(word_order='little').encode(1), [10000, 0])
+
+        values = [-1e20, -0.5, 0, 123456789.25, 1e300]
+        for word_order in ('big', 'little'):
+            codec = ModbusBase(encoding='float64', word_order=word_order)
+            self.assertEqual(codec.decode_many(codec.encode_many(values)), values)
+        self.assertRaises(ValueError, ModbusBase(encoding='float32').encode, 1e300)
+        self.assertRaises(ValueError, ModbusBase, encoding='float16')
+
+        codec = ModbusBase(encoding='float64', tag_encodings={1: ('scaled', 'little'), 2: ('float32', 'big')})
+        words = codec.encode_tag(0, 0.1) + codec.encode_tag(1, 7.5) + codec.encode_tag(2, 0.5)
+        self.assertEqual(words[4:8], [75000 & 0xFFFF, 75000 >> 16, 0, 0])
+        self.assertEqual(codec.decode_tags(0, words), [0.1, 7.5, 0.5])
+        self.assertRaises(ValueError, ModbusBase, tag_encodings={1: ('float64', 'big')})
+
     def test_ModbusServer(self):
         server = ModbusServer('127.0.0.1', 5001, no_block=True)
         server.start()
@@ -72,6 +120,331 @@ class ProtocolTests(unittest.TestCase):
         server.stop()
         client.close()
 
+    def test_client_receive_many(self):
+        modbus_base = ModbusBase()
+        self.assertEqual(modbus_base.plan_reads([12, 0, 3, 3]), [(0, 13)])
+        self.assertEqual(modbus_base.plan_reads([0, 61, 62, 200]), [(0, 62), (62, 1), (200, 1)])
+
+        client = ClientModbus('127.0.0.1', 5002)
+        server = ServerModbus('127.0.0.1', 5002)
+        server.start()
+        values = {0: 1.5, 4: 7563.42, 61: 3, 62: 4, 300: 12}
+        for tag_id, value in values.items():
+            server.set(tag_id, value)
+
+        self.assertEqual(client.receive_many([300, 0, 4, 61, 62]), {300: 12, 0: 1.5, 4: 7563.42, 61: 3, 62: 4})
+
+        server.stop()
+        client.close()
+        self.assertRaises(ConnectionError, client.receive_many, [0])
+
+    def test_client_send_many(self):
+        modbus_base = ModbusBase()
+        self.assertEqual(modbus_base.plan_writes([5, 0, 1, 2, 7, 6]), [(0, 3), (5, 3)])
+        self.assertEqual(modbus_base.plan_writes(range(0, 70)), [(0, 61), (61, 9)])
+
+        client = ClientModbus('127.0.0.1', 5003)
+        server = ServerModbus('127.0.0.1', 5003)
+        server.start()
+        values = {0: 1.5, 1: 2, 2: 7563.42, 9: 3}
+        self.assertEqual(client.send_many({**values, 4: -1}), {4: 'input number exceed max limit'})
+        for tag_id, value in values.items():
+            self.assertEqual(server.get(tag_id), value)
+
+        server.stop()
+        client.close()
+        self.assertEqual(set(client.send_many({0: 1, 1: 2})), {0, 1})
+
+    def test_async_client_pipelining(self):
+        server = ServerModbus('127.0.0.1', 5004)
+        server.start()
+        for tag_id in range(100):
+            server.set(tag_id, tag_id / 4)
+
+        async def scenario():
+            client = AsyncClientModbus('127.0.0.1', 5004)
+            values = await asyncio.gather(*[client.receive(tag_id) for tag_id in range(100)])
+            self.assertEqual(values, [tag_id / 4 for tag_id in range(100)])
+
+            self.assertEqual(await client.send_many({3: 30, 4: 40, 90: 9}), {})
+            self.assertEqual(await client.receive_many([90, 3, 4, 0]), {90: 9, 3: 30, 4: 40, 0: 0})
+            await client.send(5, 1.5)
+            self.assertEqual(server.get(5), 1.5)
+            await client.close()
+
+        asyncio.run(scenario())
+        server.stop()
+
+    def test_async_client_malformed_response(self):
+        async def answer(reader, writer):
+            request = await reader.readexactly(12)
+            transaction_id = struct.unpack_from('>H', request)[0]
+            if not connections:
+                # a length leaving no room for the function code
+                writer.write(struct.pack('>HHHB', transaction_id, 0, 0, 1))
+            else:
+                writer.write(struct.pack('>HHHBBBHH', transaction_id, 0, 7, 1, 3, 4, 0, 25000))
+            connections.append(transaction_id)
+            await writer.drain()
+
+        async def scenario():
+            server = await asyncio.start_server(answer, '127.0.0.1', 5018)
+            client = AsyncClientModbus('127.0.0.1', 5018, timeout=2)
+            start = time.monotonic()
+            with self.assertRaises(ConnectionError):
+                await client.receive(0)
+            self.assertLess(time.monotonic() - start, 1, 'the pending request waited for its timeout')
+            self.assertEqual(await client.receive(0), 2.5, 'the client did not reconnect')
+            await client.close()
+            server.close()
+            await server.wait_closed()
+
+        connections = []
+        asyncio.run(scenario())
+        self.assertEqual(len(connections), 2)
+
+    def test_event_loop_server(self):
+        server = ServerModbus('127.0.0.1', 5005, engine='eventloop')
+        server.start()
+        server.set(7, 12.5)
+
+        clients = [ClientModbus('127.0.0.1', 5005) for _ in range(8)]
+        for i, client in enumerate(clients):
+            self.assertEqual(client.receive(7), 12.5)
+            client.send(20 + i, i)
+        self.assertEqual([server.get(20 + i) for i in range(8)], list(range(8)))
+
+        async def scenario():
+            client = AsyncClientModbus('127.0.0.1', 5005)
+            values = await asyncio.gather(*[client.receive(20 + i % 8) for i in range(200)])
+            self.assertEqual(values, [i % 8 for i in range(200)])
+            await client.close()
+        asyncio.run(scenario())
+
+        # frames arriving in one segment are served frames_per_turn at a time, the rest waits in the queue
+        burst = socket.create_connection(('127.0.0.1', 5005))
+        burst.sendall(b''.join(struct.pack('>HHHBBHH', i, 0, 6, 1, 3, 14, 2) for i in range(10)))
+        received = b''
+        while len(received) < 10 * 13:
+            received += burst.recv(4096)
+        burst.close()
+
+        stats = server.server.stats()
+        self.assertEqual(stats['accepted'], 10)
+        self.assertGreaterEqual(stats['requests'], 226)
+        self.assertGreaterEqual(stats['max_queue_depth'], 1)
+        for client in clients:
+            client.close()
+        server.stop()
+        self.assertRaises(ValueError, ServerModbus, '127.0.0.1', 5005, 'forking')
+
+    def test_event_loop_server_malformed_header(self):
+        server = ServerModbus('127.0.0.1', 5012, engine='eventloop')
+        server.start()
+        server.set(1, 2.5)
+
+        # a length past the largest frame never completes, the connection must not sit in the inbox
+        attacker = socket.create_connection(('127.0.0.1', 5012))
+        attacker.settimeout(2)
+        attacker.sendall(struct.pack('>HHHB', 1, 0, 65000, 1) + bytes(5000))
+        try:
+            data = attacker.recv(4096)
+        except ConnectionResetError:
+            # closed with unread bytes the server answers with a reset
+            data = b''
+        self.assertEqual(data, b'', 'connection with a bad length is not closed')
+        attacker.close()
+
+        start = time.process_time()
+        time.sleep(0.5)
+        self.assertLess(time.process_time() - start, 0.25, 'server loop spins while idle')
+
+        client = ClientModbus('127.0.0.1', 5012)
+        self.assertEqual(client.receive(1), 2.5)
+        client.close()
+        self.assertGreaterEqual(server.server.stats()['closed'], 1)
+        server.stop()
+
+    @unittest.skipIf(resource is None, 'needs the resource module')
+    def test_event_loop_server_descriptor_exhaustion(self):
+        server = ServerModbus('127.0.0.1', 5015, engine='eventloop')
+        server.start()
+        server.set(1, 2.5)
+        limits = resource.getrlimit(resource.RLIMIT_NOFILE)
+        self.assertLessEqual(server.server.max_connections, limits[0] - EventLoopModbusServer.FD_HEADROOM)
+
+        # sockets created before the limit drops connect without a new descriptor, the server can not accept
+        flood = [socket.socket() for _ in range(5)]
+        resource.setrlimit(resource.RLIMIT_NOFILE, (len(os.listdir('/proc/self/fd')), limits[1]))
+        try:
+            for sock in flood:
+                sock.connect(('127.0.0.1', 5015))
+            time.sleep(0.3)
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, limits)
+        self.assertTrue(server.server.is_run, 'running out of descriptors ended the server loop')
+        self.assertGreaterEqual(server.server.stats()['rejected'], 1)
+
+        for sock in flood:
+            sock.close()
+        client = ClientModbus('127.0.0.1', 5015)
+        self.assertEqual(client.receive(1), 2.5)
+        client.close()
+        server.stop()
+
+    def test_client_pool_recovery(self):
+        pool = ModbusClientPool(timeout=1, backoff_base=0.2, idle_timeout=0)
+        server = ServerModbus('127.0.0.1', 5006, engine='eventloop')
+        server.start()
+        server.set(1, 2.5)
+
+        for _ in range(3):
+            with pool.client('127.0.0.1', 5006) as client:
+                self.assertEqual(client.receive(1), 2.5)
+        self.assertEqual((pool.stats()['created'], pool.stats()['reused']), (1, 2))
+
+        # the PLC restarts: the failed request backs the endpoint off instead of reconnecting on every call
+        server.stop()
+        with self.assertRaises(Exception):
+            with pool.client('127.0.0.1', 5006) as client:
+                client.receive(1)
+        self.assertRaises(ConnectionError, pool.client('127.0.0.1', 5006).__enter__)
+        self.assertEqual(pool.stats()['rejected'], 1)
+        self.assertGreater(pool.stats()['endpoints']['127.0.0.1:5006']['retry_in'], 0)
+
+        server = ServerModbus('127.0.0.1', 5006, engine='eventloop')
+        server.start()
+        server.set(1, 3.5)
+        time.sleep(0.25)
+        with pool.client('127.0.0.1', 5006) as client:
+            self.assertEqual(client.receive(1), 3.5)
+        self.assertEqual(pool.stats()['endpoints']['127.0.0.1:5006']['failures'], 0)
+
+        time.sleep(0.01)
+        pool.reap(force=True)
+        self.assertEqual(pool.stats()['reaped'], 1)
+        self.assertEqual(pool.stats()['endpoints']['127.0.0.1:5006']['idle'], 0)
+        pool.close()
+        server.stop()
+
+    def test_server_dirty_tracking(self):
+        for engine in ('thread', 'eventloop'):
+            server = ServerModbus('127.0.0.1', 5007, engine=engine)
+            server.start()
+            server.set(3, 1.5)
+            self.assertEqual(server.get(3), 1.5)
+            self.assertEqual(server.pop_dirty(), set(), 'the server own writes are not dirty')
+
+            client = ClientModbus('127.0.0.1', 5007)
+            client.send(3, 2.25)
+            client.send_many({5: 1, 6: 2})
+            self.assertEqual(server.pop_dirty(), {3, 5, 6})
+            self.assertEqual(server.pop_dirty(), set())
+            self.assertEqual([server.get(3), server.get(5), server.get(6)], [2.25, 1, 2])
+
+            client.close()
+            server.stop()
+
+    def test_client_server_float_encoding(self):
+        plc = {'encoding': 'float32', 'word_order': 'little'}
+        tags = [{'id': 0}, {'id': 1, 'encoding': 'scaled', 'word_order': 'big'}, {'id': 2}]
+        codec_options = ProtocolFactory.codec_options(plc, tags)
+        self.assertEqual(codec_options['tag_encodings'], {1: ('scaled', 'big')})
+
+        server = ProtocolFactory.create_server('ModbusWriteRequest-TCP', '127.0.0.1', 5008, 'eventloop', codec_options)
+        server.start()
+        server.set(0, -1e10)
+        server.set(1, 3.5)
+        client = ProtocolFactory.create_client('ModbusWriteRequest-TCP', '127.0.0.1', 5008, codec_options)
+        self.assertEqual(client.receive(0), -1e10)
+        client.send(2, -0.25)
+        self.assertEqual(server.get(2), -0.25)
+        self.assertEqual(client.receive_many([0, 1, 2]), {0: -1e10, 1: 3.5, 2: -0.25})
+
+        client.close()
+        server.stop()
+
+    def test_tag_exchange_udp(self):
+        server = ProtocolFactory.create_server('TagExchange-UDP', '127.0.0.1', 5009)
+        server.start()
+        server.set(1, 1e300)
+
+        with ProtocolFactory.pooled_client('TagExchange-UDP', '127.0.0.1', 5009) as client:
+            self.assertEqual(client.receive(1), 1e300)
+            self.assertEqual(client.send_many({tag_id: -tag_id / 3 for tag_id in range(400)}), {})
+            values = client.receive_many(range(399, -1, -1))
+            self.assertEqual(list(values.items()), [(tag_id, -tag_id / 3) for tag_id in range(399, -1, -1)])
+            self.assertEqual(set(client.send_many({2: 'x'})), {2})
+
+        self.assertEqual(server.pop_dirty(), set(range(400)))
+        self.assertEqual(server.get(7), -7 / 3)
+
+        # a malformed request gets an error reply with its sequence
+        raw = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        raw.settimeout(1)
+        raw.sendto(TagExchangeBase.HEADER.pack(1, TagExchangeBase.OP_READ, 2, 9) + b'\x00', ('127.0.0.1', 5009))
+        reply = raw.recv(100)
+        self.assertEqual(TagExchangeBase.HEADER.unpack_from(reply)[1:], (TagExchangeBase.OP_ERROR, 0, 9))
+
+        # so does a write over the batch limit, none of its values is applied
+        count = TagExchangeBase.MAX_WRITE_TAGS + 1
+        body = struct.pack('>' + 'Hd' * count, *[item for tag_id in range(1000, 1000 + count)
+                                                  for item in (tag_id, 1.0)])
+        raw.sendto(TagExchangeBase.HEADER.pack(1, TagExchangeBase.OP_WRITE, count, 10) + body, ('127.0.0.1', 5009))
+        reply = raw.recv(100)
+        self.assertEqual(TagExchangeBase.HEADER.unpack_from(reply)[1:], (TagExchangeBase.OP_ERROR, 0, 10))
+        self.assertEqual(server.pop_dirty(), set())
+        raw.close()
+
+        server.stop()
+        client = ClientUDP('127.0.0.1', 5009, timeout=0.1, retries=1)
+        self.assertRaises(ConnectionError, client.receive, 1)
+        client.close()
+
+    def test_admission_control(self):
+        admission = AdmissionControl(rate=1, burst=3)
+        server = ServerModbus('127.0.0.1', 5010, engine='eventloop', admission=admission)
+        server.start()
+        server.set(0, 4.5)
+
+        client = ClientModbus('127.0.0.1', 5010)
+        self.assertEqual([client.receive(0) for _ in range(3)], [4.5] * 3)
+        self.assertRaises(ConnectionError, client.receive, 0)
+        self.assertEqual(client.client.last_except, EXP_SLAVE_DEVICE_BUSY)
+        self.assertEqual(admission.stats(), {'127.0.0.1': {'admitted': 3, 'rate_limited': 1, 'busy': 0}})
+
+        admission.whitelist.add('127.0.0.1')
+        self.assertEqual([client.receive(0) for _ in range(10)], [4.5] * 10)
+        client.close()
+        server.stop()
+
+        admission = AdmissionControl(max_concurrent=1, whitelist=['10.0.0.1'])
+        self.assertTrue(admission.admit('10.0.0.2'))
+        self.assertFalse(admission.admit('10.0.0.3'))
+        self.assertTrue(admission.admit('10.0.0.1'), 'whitelisted clients bypass the concurrency cap')
+        admission.release()
+        admission.release()
+        self.assertTrue(admission.admit('10.0.0.3'))
+        self.assertEqual(admission.stats()['10.0.0.3'], {'admitted': 1, 'rate_limited': 0, 'busy': 1})
+
+    def test_admission_control_connections(self):
+        admission = AdmissionControl(max_concurrent=2)
+        server = ServerModbus('127.0.0.1', 5014, engine='eventloop', admission=admission)
+        server.start()
+        server.set(0, 4.5)
+
+        clients = [ClientModbus('127.0.0.1', 5014) for _ in range(3)]
+        self.assertEqual([client.receive(0) for client in clients[:2]], [4.5] * 2)
+        self.assertRaises(ConnectionError, clients[2].receive, 0)
+        self.assertEqual(admission.stats()['127.0.0.1']['busy'], 1, 'the connection over the cap')
+
+        clients[0].close()
+        time.sleep(0.3)
+        self.assertEqual(clients[2].receive(0), 4.5, 'a closed connection frees its slot')
+        for client in clients:
+            client.close()
+        server.stop()
+
     def client_server_modbus_func(self, server, client, tag_id, value):
         server.set(tag_id, value)
         received = client.receive(tag_id)